@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_bench.py
+- 离线基准测试：本地替身站点（bench/fixtures/ 下录制的页面模板 + 仓库里现有的播放列表）
+  代替 iptv.cqshushu.com，对 run_batch 全流程（HTTP / 浏览器两种后端均可）计时
+- 替身站点：首页、带大表格的搜索结果页（行数可调）、IP 详情页、频道列表页、M3U 下载，
+  以及若干静态资源（样式、统计脚本、图片，用于检验资源拦截）；每个请求按“延迟 ± 抖动”休眠
+- 报告：吞吐（省/分钟）、各步骤 p50 / p95 耗时（来自 iptv_trace 埋点）、峰值内存（RSS）
+
+用法：
+    python iptv_bench.py                                   # HTTP 后端，33 个地区，1 个 worker
+    python iptv_bench.py --backend selenium --workers 2 --provinces 6
+    python iptv_bench.py --rows 500 --latency 0.2 --jitter 0.1 --json /tmp/bench.json
+    python iptv_bench.py --pipeline                        # 分段流水线（各阶段并发见 PIPELINE_* 环境变量）
+    python iptv_bench.py --serve 8765                      # 只启动替身站点（手动调试）
+"""
+
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPO_PATH = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(REPO_PATH, "bench", "fixtures")
+PLAYLISTS_DIR = os.path.join(REPO_PATH, "m3u")
+
+DEFAULT_ROWS = 200
+DEFAULT_LATENCY = 0.05
+DEFAULT_JITTER = 0.02
+DEFAULT_SEED = 20260116
+
+_STATIC = {
+    ".css": ("text/css", b"body{font-family:sans-serif}" * 200),
+    ".js": ("application/javascript", b"/* analytics */" * 400),
+    ".png": ("image/png", b"\x89PNG\r\n\x1a\n" + b"\0" * 20000),
+}
+
+
+class FixtureSite:
+    """
+    替身站点：页面由 fixtures 模板渲染，内容按（种子, 关键词）确定性生成，便于前后对比
+    - 搜索结果：rows 行组播IP，状态混合“新上线 / 存活N天 / 暂时失效”，顺序打乱
+    - M3U 下载：按关键词里的省份名返回 m3u/<省>.m3u 的原始内容（找不到时按关键词哈希挑一个）
+    """
+
+    def __init__(self, fixtures_dir: str = FIXTURES_DIR, playlists_dir: str = PLAYLISTS_DIR,
+                 rows: int = DEFAULT_ROWS, latency: float = DEFAULT_LATENCY, jitter: float = DEFAULT_JITTER,
+                 seed: int = DEFAULT_SEED):
+        self.rows = rows
+        self.latency = latency
+        self.jitter = jitter
+        self.seed = seed
+        self.templates = {}
+        for name in ("home", "search", "row", "detail", "channels"):
+            with open(os.path.join(fixtures_dir, f"{name}.html"), "r", encoding="utf-8") as f:
+                self.templates[name] = f.read()
+        self.playlists = {}
+        for name in sorted(os.listdir(playlists_dir)):
+            if name.endswith(".m3u") and ".rank" not in name:
+                with open(os.path.join(playlists_dir, name), "rb") as f:
+                    self.playlists[name[:-4]] = f.read()
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[http.server.ThreadingHTTPServer] = None
+
+    # ---- 内容 ----
+    @staticmethod
+    def render(template: str, **values) -> str:
+        for key, value in values.items():
+            template = template.replace("{" + key + "}", str(value))
+        return template
+
+    def region_of(self, keyword: str) -> str:
+        for region in self.playlists:
+            if region in keyword:
+                return region
+        names = sorted(self.playlists)
+        return names[int(hashlib.md5(keyword.encode("utf-8")).hexdigest(), 16) % len(names)] if names else ""
+
+    def candidates(self, keyword: str) -> List[Dict]:
+        rng = random.Random(f"{self.seed}:{keyword}")
+        items = []
+        for i in range(self.rows):
+            roll = rng.random()
+            if roll < 0.05:
+                status = "新上线"
+            elif roll < 0.85:
+                status = f"存活{rng.randint(1, 90)}天"
+            else:
+                status = "暂时失效"
+            ip = f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+            items.append({"ip": ip, "port": rng.choice((4000, 4022, 8888, 8188, 9088)), "status": status})
+        return items
+
+    def search_page(self, keyword: str) -> str:
+        region = urllib.parse.quote(self.region_of(keyword))
+        rows = "".join(
+            self.render(self.templates["row"], keyword=keyword, ip=c["ip"], port=c["port"], status=c["status"],
+                        href=f"/ip?id={c['ip']}&p={c['port']}&r={region}")
+            for c in self.candidates(keyword)
+        )
+        return self.render(self.templates["search"], keyword=keyword, rows=rows)
+
+    def channel_rows(self, region: str) -> str:
+        body = self.playlists.get(region, b"").decode("utf-8", "ignore")
+        names = [ln.rsplit(",", 1)[-1] for ln in body.splitlines() if ln.startswith("#EXTINF")]
+        return "".join(f"<tr><td>{i}</td><td>{n}</td></tr>\n" for i, n in enumerate(names, start=1))
+
+    # ---- HTTP ----
+    def handle(self, handler: http.server.BaseHTTPRequestHandler):
+        url = urllib.parse.urlsplit(handler.path)
+        query = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        route = url.path if not url.path.startswith("/static/") else "/static/"
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        ip = query.get("id", "")
+        port = query.get("p", "")
+        region = query.get("r", "")
+        status = 200
+        content_type = "text/html; charset=utf-8"
+        extra = {}
+        if url.path == "/":
+            keyword = query.get("q")
+            body = (self.search_page(keyword) if keyword else self.templates["home"]).encode("utf-8")
+        elif url.path == "/ip" and ip:
+            rest = f"id={ip}&r={urllib.parse.quote(region)}"
+            body = self.render(self.templates["detail"], ip=ip, port=port, status="组播",
+                               channels_href=f"/channels?{rest}").encode("utf-8")
+        elif url.path == "/channels" and ip:
+            rest = f"id={ip}&r={urllib.parse.quote(region)}"
+            body = self.render(self.templates["channels"], ip=ip, m3u_href=f"/download.m3u?{rest}",
+                               txt_href=f"/download.txt?{rest}", channel_rows=self.channel_rows(region)).encode("utf-8")
+        elif url.path == "/download.m3u" and ip:
+            body = self.playlists.get(region) or b""
+            content_type = "application/octet-stream"
+            extra["Content-Disposition"] = f'attachment; filename="{ip}.m3u"'
+        elif url.path.startswith("/static/") and os.path.splitext(url.path)[1] in _STATIC:
+            content_type, body = _STATIC[os.path.splitext(url.path)[1]]
+        else:
+            status, body = 404, b"not found"
+
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        for k, v in extra.items():
+            handler.send_header(k, v)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        site = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                site.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self._server.server_address[1]}/"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# ===================== 基准测试 =====================
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩百分位"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    """本进程与已退出子进程（浏览器、驱动）的峰值 RSS（MB）"""
+    if resource is None:
+        return {}
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+def run_benchmark(site_url: str, backend: str = "http", workers: int = 1, provinces: int = 0,
+                  rounds: int = 1, precheck: bool = False, pipeline: bool = False,
+                  site_rps: float = 0) -> Dict:
+    """
+    对替身站点跑 run_batch：输出、状态、调度统计、历史都写到临时目录（不碰仓库里的 m3u/、state/ 和 .cache/，
+    结束后恢复原路径），搜索缓存、增量刷新、运行报告都关闭，保证每轮走完整流程
+    """
+    os.environ.update({
+        "HOME_PAGE_URL": site_url,
+        "FETCH_BACKEND": backend,
+        "BATCH_WORKERS": str(workers),
+        "PRECHECK": "1" if precheck else "0",
+        "PIPELINE": "1" if pipeline else "0",
+        "SITE_RPS": str(site_rps),
+        "SEARCH_CACHE": "0",
+        "INCREMENTAL": "0",
+        "RUN_REPORT": "0",
+        "HISTORY_DIR": "",
+    })
+    import iptv_m3u_get_chrome as scraper
+    import iptv_ratelimit
+    import iptv_trace
+
+    iptv_ratelimit.reset_limiter()
+
+    scraper.HOME_PAGE_URL = site_url
+    work_dir = tempfile.mkdtemp(prefix="iptv_bench_")
+    redirected = {
+        "OUTPUT_DIR": os.path.join(work_dir, "m3u"),
+        "STATE_PATH": os.path.join(work_dir, "state.json"),
+        "SCHEDULE_PATH": os.path.join(work_dir, "schedule.json"),
+        "SCHEDULE_STATS_PATH": os.path.join(work_dir, "schedule_stats.json"),
+        "HISTORY_LOG_DIR": os.path.join(work_dir, "history"),
+        "HISTORY_DB_PATH": os.path.join(work_dir, "history.sqlite"),
+        "PROVINCES": scraper.PROVINCES[:provinces] if provinces else scraper.PROVINCES,
+    }
+    saved = {name: getattr(scraper, name) for name in redirected}
+
+    def reset_singletons():
+        scraper._STATE = scraper._SCHEDULER = None
+        scraper._HISTORY = scraper._HISTORY_INDEX = None
+
+    for name, value in redirected.items():
+        setattr(scraper, name, value)
+    reset_singletons()
+    os.makedirs(scraper.OUTPUT_DIR, exist_ok=True)
+    regions = len(scraper.PROVINCES)
+
+    steps: Dict[str, List[float]] = {}
+    round_secs = []
+    successes = 0
+    try:
+        contexts = scraper.make_batch_contexts(workers)
+        try:
+            for _ in range(rounds):
+                started = time.perf_counter()
+                scraper.run_batch(1, contexts=contexts)
+                round_secs.append(time.perf_counter() - started)
+                for s in list(iptv_trace.TRACER.spans):
+                    steps.setdefault(s.name, []).append(s.dur)
+                successes += sum(1 for ok in iptv_trace.TRACER.results.values() if ok)
+        finally:
+            for ctx in contexts:
+                ctx.close()
+    finally:
+        for name, value in saved.items():
+            setattr(scraper, name, value)
+        reset_singletons()
+
+    total = sum(round_secs)
+    return {
+        "backend": backend,
+        "workers": workers,
+        "pipeline": pipeline,
+        "regions": regions,
+        "rounds": rounds,
+        "success": successes,
+        "elapsed_sec": round(total, 3),
+        "provinces_per_min": round(regions * rounds / total * 60, 1) if total else 0.0,
+        "steps": {
+            name: {"n": len(v), "p50_ms": round(percentile(v, 50) * 1000, 1),
+                   "p95_ms": round(percentile(v, 95) * 1000, 1)}
+            for name, v in sorted(steps.items(), key=lambda kv: -sum(kv[1]))
+        },
+        "peak_rss_mb": {k: round(v, 1) for k, v in peak_rss_mb().items()},
+    }
+
+
+def print_report(report: Dict, site: FixtureSite):
+    print("\n" + "=" * 64)
+    print(f"【基准】backend={report['backend']} workers={report['workers']} pipeline={int(report['pipeline'])} "
+          f"地区={report['regions']} "
+          f"轮数={report['rounds']} 成功={report['success']}")
+    print(f"【站点】每页 {site.rows} 行，延迟 {site.latency * 1000:.0f}±{site.jitter * 1000:.0f}ms，"
+          f"请求 {sum(site.requests.values())} 次 {dict(sorted(site.requests.items()))}")
+    print(f"【吞吐】{report['provinces_per_min']} 省/分钟（总耗时 {report['elapsed_sec']:.1f}s）")
+    print(f"  {'步骤':<16s}{'次数':>6s}{'p50(ms)':>10s}{'p95(ms)':>10s}")
+    for name, step in report["steps"].items():
+        print(f"  {name:<16s}{step['n']:>6d}{step['p50_ms']:>10.1f}{step['p95_ms']:>10.1f}")
+    rss = report["peak_rss_mb"]
+    if rss:
+        print(f"【峰值内存】本进程 {rss['self']:.0f} MB，子进程 {rss['children']:.0f} MB")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="离线基准测试（本地替身站点）")
+    parser.add_argument("--backend", choices=("http", "selenium", "auto"), default="http")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--provinces", type=int, default=0, help="只跑前 N 个地区（0=全部）")
+    parser.add_argument("--rounds", type=int, default=1)
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="搜索结果页的组播行数")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="每个请求的延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_JITTER, help="延迟抖动（±秒）")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--precheck", action="store_true", help="开启候选IP预检（替身站点的IP多为不可达，会拉长耗时）")
+    parser.add_argument("--pipeline", action="store_true", help="批量改用 asyncio 分段流水线（PIPELINE=1）")
+    parser.add_argument("--site-rps", type=float, default=0, help="对替身站点限速（次/秒，默认 0=不限）")
+    parser.add_argument("--json", help="报告另存为 JSON")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="只启动替身站点")
+    args = parser.parse_args(argv)
+
+    site = FixtureSite(rows=args.rows, latency=args.latency, jitter=args.jitter, seed=args.seed)
+    if args.serve is not None:
+        url = site.start(port=args.serve)
+        print(f"【替身站点】{url}（Ctrl+C 退出）")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            site.stop()
+        return 0
+
+    url = site.start()
+    try:
+        report = run_benchmark(url, backend=args.backend, workers=args.workers, provinces=args.provinces,
+                               rounds=args.rounds, precheck=args.precheck, pipeline=args.pipeline,
+                               site_rps=args.site_rps)
+    finally:
+        site.stop()
+    report["site"] = {"rows": site.rows, "latency": site.latency, "jitter": site.jitter, "requests": site.requests}
+    print_report(report, site)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if report["success"] else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_cache.py
+- 搜索结果磁盘缓存：关键词 -> 已解析的组播候选列表
+- 过期（TTL）自动失效；条目数超过上限时按最近使用时间淘汰（LRU）
+- 一个索引文件 + 每个关键词一个数据文件；线程安全（批量并发共用）
+- 命中只在内存里更新最近使用时间，由 save()（批量 / 单次结束时）统一写回索引，读多的批量不会每省写一次文件；
+  新增、失效、淘汰会删改数据文件，仍立即写索引
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+INDEX_NAME = "index.json"
+
+
+class SearchCache:
+
+    def __init__(self, directory: str, ttl_sec: float = 3600, max_entries: int = 200):
+        self.directory = directory
+        self.ttl_sec = ttl_sec
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._index: Dict[str, Dict] = {}   # keyword -> {"file", "created", "accessed"}
+        self._dirty = False                 # 内存里有尚未写回的访问时间
+        try:
+            with open(os.path.join(directory, INDEX_NAME), "r", encoding="utf-8") as f:
+                self._index = json.load(f)
+        except (OSError, ValueError):
+            self._index = {}
+
+    @staticmethod
+    def _file_name(keyword: str) -> str:
+        return hashlib.sha1(keyword.encode("utf-8")).hexdigest()[:16] + ".json"
+
+    def get(self, keyword: str) -> Optional[List[Dict]]:
+        """命中返回候选列表（sort_key 还原为 tuple）；未命中或已过期返回 None"""
+        with self._lock:
+            meta = self._index.get(keyword)
+            if not meta:
+                return None
+            now = time.time()
+            if now - meta["created"] > self.ttl_sec:
+                self._drop_locked(keyword)
+                self._save_index_locked()
+                return None
+            try:
+                with open(os.path.join(self.directory, meta["file"]), "r", encoding="utf-8") as f:
+                    items = json.load(f)
+            except (OSError, ValueError):
+                self._drop_locked(keyword)
+                self._save_index_locked()
+                return None
+            meta["accessed"] = now
+            self._dirty = True
+        for item in items:
+            item["sort_key"] = tuple(item.get("sort_key") or (99, 999999))
+        return items
+
+    def put(self, keyword: str, items: List[Dict]):
+        """只缓存可序列化的字段；空列表不缓存（可能只是一次性失败）"""
+        if not items:
+            return
+        keep = ("ip", "href", "status", "sort_key", "port")
+        payload = [{k: item.get(k) for k in keep} for item in items]
+        name = self._file_name(keyword)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = os.path.join(self.directory, name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp, os.path.join(self.directory, name))
+            now = time.time()
+            self._index[keyword] = {"file": name, "created": now, "accessed": now}
+            self._evict_locked()
+            self._save_index_locked()
+
+    def save(self):
+        """把命中时更新的访问时间写回索引（没有变化时不写）"""
+        with self._lock:
+            if self._dirty:
+                self._save_index_locked()
+
+    def invalidate(self, keyword: str):
+        with self._lock:
+            if keyword in self._index:
+                self._drop_locked(keyword)
+                self._save_index_locked()
+
+    def _evict_locked(self):
+        now = time.time()
+        for keyword in [k for k, m in self._index.items() if now - m["created"] > self.ttl_sec]:
+            self._drop_locked(keyword)
+        overflow = len(self._index) - self.max_entries
+        if overflow > 0:
+            for keyword in sorted(self._index, key=lambda k: self._index[k]["accessed"])[:overflow]:
+                self._drop_locked(keyword)
+
+    def _drop_locked(self, keyword: str):
+        meta = self._index.pop(keyword, None)
+        if meta:
+            try:
+                os.remove(os.path.join(self.directory, meta["file"]))
+            except OSError:
+                pass
+
+    def _save_index_locked(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, INDEX_NAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        self._dirty = False
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_dirwatch.py
+- 等待“专用下载目录”里出现写完的文件（浏览器下载完成检测）
+- Linux：inotify（IN_CLOSE_WRITE / IN_MOVED_TO）事件驱动，文件写完/改名的瞬间返回
+- 其它平台或 inotify 不可用：退回轮询（目录是专用的，只需看一两个文件，开销很小）
+- 只认目标后缀（默认 .m3u），Chrome 的 .crdownload 半成品永远不会被返回
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from typing import Optional
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+POLL_INTERVAL = 0.2
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except Exception:
+        return None
+
+
+_LIBC = _load_libc()
+
+
+class DownloadWatcher:
+    """
+    用法（必须在触发下载之前创建，避免漏掉事件）：
+        with DownloadWatcher(download_dir) as watcher:
+            button.click()
+            path = watcher.wait(timeout_sec=180)
+    """
+
+    def __init__(self, directory: str, suffix: str = ".m3u"):
+        self.directory = directory
+        self.suffix = suffix.lower()
+        self._fd = -1
+        if _LIBC is not None:
+            try:
+                fd = _LIBC.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+                if fd >= 0:
+                    if _LIBC.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) >= 0:
+                        self._fd = fd
+                    else:
+                        os.close(fd)
+            except Exception:
+                self._fd = -1
+
+    @property
+    def event_driven(self) -> bool:
+        return self._fd >= 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._fd >= 0:
+            try:
+                os.close(self._fd)
+            except Exception:
+                pass
+            self._fd = -1
+
+    def _complete(self, name: str) -> Optional[str]:
+        if not name.lower().endswith(self.suffix):
+            return None
+        full = os.path.join(self.directory, name)
+        try:
+            return full if os.path.getsize(full) > 0 else None
+        except OSError:
+            return None
+
+    def _scan(self) -> Optional[str]:
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return None
+        for name in names:
+            found = self._complete(name)
+            if found:
+                return found
+        return None
+
+    def wait(self, timeout_sec: float = 180) -> Optional[str]:
+        """返回写完的目标文件路径；超时返回 None"""
+        deadline = time.time() + timeout_sec
+
+        # watcher 创建前就已完成的下载（极快的小文件）
+        found = self._scan()
+        if found:
+            return found
+
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+
+            if not self.event_driven:
+                time.sleep(min(POLL_INTERVAL, remaining))
+                found = self._scan()
+                if found:
+                    return found
+                continue
+
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if not readable:
+                return None
+            try:
+                buf = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(buf):
+                _, _, _, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+                offset += _EVENT_HEADER.size
+                name = buf[offset:offset + name_len].split(b"\0", 1)[0].decode("utf-8", "surrogateescape")
+                offset += name_len
+                found = self._complete(name)
+                if found:
+                    return found
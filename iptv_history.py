@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_history.py
+- 历史时间线：每次批量运行、每个地区记一条（候选IP及其“存活N天”状态与预检结果、选中的IP、频道集合摘要、是否有变化）
+- 存储分两层：
+  * 追加日志 .cache/history/<年-月>.jsonl：只追加、一行一条；默认只留在本地不入库（CI 用 actions/cache 接着写），
+    HISTORY_DIR=目录 可改放到别处
+  * 本地索引 .cache/history.sqlite：按文件偏移增量同步日志，建 (省份, 时间) / (IP, 时间) 索引，供区间查询；删掉可随时重建
+- 用途：候选IP的历史可靠性（HISTORY_RANK=1 时同等新旧的候选按它排序）、各省来源IP存活时长与内容变化间隔 -> 建议刷新周期
+
+用法：
+    python iptv_history.py province 湖北 --since 2026-01-01          # 该省各次运行
+    python iptv_history.py ip 27.18.31.67 --since 2026-01-01 --until 2026-03-01
+    python iptv_history.py cadence                                    # 各省建议刷新周期
+"""
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import iptv_site
+
+REPO_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_LOG_DIR = os.path.join(REPO_PATH, ".cache", "history")
+DEFAULT_DB_PATH = os.path.join(REPO_PATH, ".cache", "history.sqlite")
+
+# 建议刷新周期的上下限（小时）
+MIN_CADENCE_HOURS = 6
+MAX_CADENCE_HOURS = 24 * 7
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS log_files (name TEXT PRIMARY KEY, offset INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, log_file TEXT NOT NULL, run_id TEXT, ts INTEGER NOT NULL, province TEXT NOT NULL, keyword TEXT,
+    status TEXT, content_hash TEXT, changed INTEGER
+);
+CREATE TABLE IF NOT EXISTS candidates (
+    run INTEGER NOT NULL REFERENCES runs(id), ts INTEGER NOT NULL, province TEXT NOT NULL, ip TEXT NOT NULL,
+    position INTEGER, status TEXT, alive_days INTEGER, alive INTEGER, latency_ms REAL, chosen_rank INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_province_ts ON runs (province, ts);
+CREATE INDEX IF NOT EXISTS candidates_province_ts ON candidates (province, ts);
+CREATE INDEX IF NOT EXISTS candidates_ip_ts ON candidates (ip, ts);
+"""
+
+
+def alive_days(status: str) -> Optional[int]:
+    """“新上线” -> 0，“存活N天” -> N，其它 -> None"""
+    if "新上线" in status:
+        return 0
+    m = iptv_site.ALIVE_DAYS_PATTERN.search(status)
+    return int(m.group(1)) if m else None
+
+
+# ===================== 记录（写日志）=====================
+
+class RegionRecord:
+    """一个地区一次运行的记录；抓取过程中逐步填充，结束时 HistoryLog.append 写出"""
+
+    def __init__(self, run_id: str, province: str):
+        self.run_id = run_id
+        self.province = province
+        self.ts = int(time.time())
+        self.keyword = ""
+        self.candidates: List[Dict] = []
+        self.outputs: List[Dict] = []
+        self.status = ""
+
+    def note_candidates(self, keyword: str, items: Sequence[Dict]):
+        """候选列表（搜索 + 预检之后的顺序）；同一地区换关键词时以最后一次为准"""
+        self.keyword = keyword
+        self.candidates = []
+        for position, item in enumerate(items, start=1):
+            status = item.get("status") or ""
+            entry = {"ip": item["ip"], "position": position, "status": status.split(" 在线")[0],
+                     "alive_days": alive_days(status)}
+            health = item.get("health")
+            if health is not None:
+                entry["alive"] = bool(health.alive)
+                entry["latency_ms"] = None if health.latency_ms is None else round(health.latency_ms, 1)
+            self.candidates.append(entry)
+
+    def note_output(self, rank: int, ip: str, content_hash: Optional[str], changed: bool):
+        self.outputs.append({"rank": rank, "ip": ip, "content_hash": content_hash, "changed": changed})
+
+    def to_json(self) -> Dict:
+        return {"run_id": self.run_id, "ts": self.ts, "province": self.province, "keyword": self.keyword,
+                "status": self.status, "candidates": self.candidates, "outputs": self.outputs}
+
+
+class HistoryLog:
+    """按月分文件的追加日志；多个 worker 线程共用一个实例"""
+
+    def __init__(self, log_dir: str = DEFAULT_LOG_DIR):
+        self.log_dir = log_dir
+        self._lock = threading.Lock()
+
+    def append(self, record: RegionRecord):
+        line = json.dumps(record.to_json(), ensure_ascii=False, sort_keys=True) + "\n"
+        path = os.path.join(self.log_dir, time.strftime("%Y-%m", time.localtime(record.ts)) + ".jsonl")
+        with self._lock:
+            os.makedirs(self.log_dir, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+_local = threading.local()
+
+
+@contextmanager
+def record_scope(record: Optional[RegionRecord]) -> Iterator[Optional[RegionRecord]]:
+    """在当前线程登记正在抓取的地区记录（抓取函数用 current() 取到后补充候选与输出）"""
+    prev = getattr(_local, "record", None)
+    _local.record = record
+    try:
+        yield record
+    finally:
+        _local.record = prev
+
+
+def current() -> Optional[RegionRecord]:
+    return getattr(_local, "record", None)
+
+
+def note_candidates(keyword: str, items: Sequence[Dict]):
+    record = current()
+    if record is not None:
+        record.note_candidates(keyword, items)
+
+
+def note_output(rank: int, ip: str, content_hash: Optional[str], changed: bool):
+    record = current()
+    if record is not None:
+        record.note_output(rank, ip, content_hash, changed)
+
+
+# ===================== 索引（查询）=====================
+
+def parse_time(value: Optional[str]) -> Optional[int]:
+    """'2026-01-01' / '2026-01-01 08:00:00' / 纯数字时间戳 -> 时间戳"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return int(time.mktime(time.strptime(value, fmt)))
+        except ValueError:
+            continue
+    raise ValueError(f"无法识别的时间：{value}")
+
+
+def format_time(ts: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(ts))
+
+
+class HistoryIndex:
+    """日志的 SQLite 索引：sync() 只读取各日志文件上次同步之后追加的部分"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, log_dir: str = DEFAULT_LOG_DIR):
+        self.log_dir = log_dir
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        # 批量模式下多个 worker 线程共用一个连接：查询经 _lock 串行
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def sync(self) -> int:
+        """增量导入新日志行，返回导入的记录数（与查询共用 _lock，可在 worker 线程查询期间调用）"""
+        with self._lock:
+            return self._sync()
+
+    def _sync(self) -> int:
+        imported = 0
+        offsets = dict(self.db.execute("SELECT name, offset FROM log_files"))
+        for path in sorted(glob.glob(os.path.join(self.log_dir, "*.jsonl"))):
+            name = os.path.basename(path)
+            start = offsets.get(name, 0)
+            if os.path.getsize(path) < start:
+                # 文件被改写（不应发生）：丢掉它导入过的记录，整份重新导入
+                start = 0
+                with self.db:
+                    self.db.execute("DELETE FROM candidates WHERE run IN (SELECT id FROM runs WHERE log_file = ?)", (name,))
+                    self.db.execute("DELETE FROM runs WHERE log_file = ?", (name,))
+            with open(path, "rb") as f:
+                f.seek(start)
+                data = f.read()
+            # 只处理完整的行（写到一半的最后一行留到下次）
+            end = data.rfind(b"\n") + 1
+            with self.db:
+                for raw in data[:end].splitlines():
+                    try:
+                        self._insert(name, json.loads(raw.decode("utf-8")))
+                        imported += 1
+                    except (ValueError, KeyError):
+                        continue
+                self.db.execute("INSERT OR REPLACE INTO log_files (name, offset) VALUES (?, ?)", (name, start + end))
+        return imported
+
+    def _insert(self, log_file: str, rec: Dict):
+        outputs = rec.get("outputs") or []
+        primary = min(outputs, key=lambda o: o["rank"]) if outputs else {}
+        cur = self.db.execute(
+            "INSERT INTO runs (log_file, run_id, ts, province, keyword, status, content_hash, changed)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (log_file, rec.get("run_id"), rec["ts"], rec["province"], rec.get("keyword"), rec.get("status"),
+             primary.get("content_hash"), int(any(o.get("changed") for o in outputs))))
+        chosen = {o["ip"]: o["rank"] for o in sorted(outputs, key=lambda o: -o["rank"])}
+        self.db.executemany(
+            "INSERT INTO candidates (run, ts, province, ip, position, status, alive_days, alive, latency_ms, chosen_rank)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(cur.lastrowid, rec["ts"], rec["province"], c["ip"], c.get("position"), c.get("status"),
+              c.get("alive_days"), None if c.get("alive") is None else int(c["alive"]), c.get("latency_ms"),
+              chosen.get(c["ip"])) for c in rec.get("candidates") or []])
+
+    # ---- 区间查询 ----
+    @staticmethod
+    def _range(since: Optional[int], until: Optional[int]) -> Tuple[str, List]:
+        clause, params = "", []
+        if since is not None:
+            clause += " AND ts >= ?"
+            params.append(since)
+        if until is not None:
+            clause += " AND ts < ?"
+            params.append(until)
+        return clause, params
+
+    def province_runs(self, province: str, since: Optional[int] = None, until: Optional[int] = None) -> List[Dict]:
+        clause, params = self._range(since, until)
+        rows = self.db.execute(
+            "SELECT id, ts, keyword, status, content_hash, changed FROM runs WHERE province = ?" + clause + " ORDER BY ts",
+            [province] + params).fetchall()
+        result = []
+        for run, ts, keyword, status, content_hash, changed in rows:
+            chosen = self.db.execute("SELECT ip, chosen_rank FROM candidates WHERE run = ? AND chosen_rank IS NOT NULL"
+                                     " ORDER BY chosen_rank", (run,)).fetchall()
+            count = self.db.execute("SELECT COUNT(*) FROM candidates WHERE run = ?", (run,)).fetchone()[0]
+            result.append({"ts": ts, "keyword": keyword, "status": status, "content_hash": content_hash,
+                           "changed": bool(changed), "candidates": count, "chosen": chosen})
+        return result
+
+    def ip_timeline(self, ip: str, since: Optional[int] = None, until: Optional[int] = None) -> List[Dict]:
+        clause, params = self._range(since, until)
+        rows = self.db.execute(
+            "SELECT ts, province, position, status, alive_days, alive, latency_ms, chosen_rank FROM candidates"
+            " WHERE ip = ?" + clause + " ORDER BY ts", [ip] + params).fetchall()
+        keys = ("ts", "province", "position", "status", "alive_days", "alive", "latency_ms", "chosen_rank")
+        return [dict(zip(keys, r)) for r in rows]
+
+    def ip_reliability(self, province: str, ips: Iterable[str], since: Optional[int] = None) -> Dict[str, float]:
+        """
+        候选IP的历史得分（越大越可靠）：被选中且该次运行成功的比例（拉普拉斯平滑），加上出现次数的少量加成
+        没有历史的 IP 得分为 0
+        """
+        ips = list(dict.fromkeys(ips))
+        if not ips:
+            return {}
+        clause, params = self._range(since, None)
+        placeholders = ",".join("?" * len(ips))
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT c.ip, COUNT(*), SUM(c.chosen_rank IS NOT NULL), SUM(c.chosen_rank IS NOT NULL AND r.status = 'ok')"
+                " FROM candidates c JOIN runs r ON r.id = c.run"
+                f" WHERE c.province = ? AND c.ip IN ({placeholders})" + clause.replace("ts", "c.ts") + " GROUP BY c.ip",
+                [province] + ips + params).fetchall()
+        scores = {ip: 0.0 for ip in ips}
+        for ip, seen, chosen, chosen_ok in rows:
+            scores[ip] = (chosen_ok + 1) / (chosen + 2) + min(seen, 10) * 0.01
+        return scores
+
+    def cadence(self, since: Optional[int] = None) -> List[Dict]:
+        """
+        各省：运行次数、内容变化次数、内容变化间隔中位数、选中IP的存活时长中位数、建议刷新周期
+        - 存活时长 = 最后一次出现 - （首次出现 - 首次出现时的“存活N天”）；只统计已从候选中消失的IP（仍在的只是下限）
+        - 建议周期取（变化间隔、存活时长）较小者的一半，限制在 6 小时 ~ 7 天
+        """
+        clause, params = self._range(since, None)
+        result = []
+        provinces = [r[0] for r in self.db.execute(
+            "SELECT DISTINCT province FROM runs WHERE 1=1" + clause + " ORDER BY province", params)]
+        for province in provinces:
+            runs = self.db.execute("SELECT ts, changed FROM runs WHERE province = ? AND status = 'ok'" + clause +
+                                   " ORDER BY ts", [province] + params).fetchall()
+            change_ts = [ts for ts, changed in runs if changed]
+            intervals = [b - a for a, b in zip(change_ts, change_ts[1:])]
+            # 选中过的IP作为候选出现的首末时间；最近一次搜索里还在的跳过
+            latest = self.db.execute("SELECT MAX(ts) FROM candidates WHERE province = ?" + clause,
+                                     [province] + params).fetchone()[0] or 0
+            lifetimes = []
+            for first, last, days in self.db.execute(
+                    "SELECT MIN(ts), MAX(ts), (SELECT alive_days FROM candidates c2 WHERE c2.ip = c.ip AND"
+                    " c2.province = c.province ORDER BY ts LIMIT 1) FROM candidates c WHERE province = ?" + clause +
+                    " AND ip IN (SELECT ip FROM candidates WHERE province = ? AND chosen_rank IS NOT NULL" + clause + ")"
+                    " GROUP BY ip", [province] + params + [province] + params):
+                if last < latest:
+                    lifetimes.append(last - (first - (days or 0) * 86400))
+            basis = [statistics.median(v) for v in (intervals, lifetimes) if v]
+            suggested = None
+            if basis:
+                suggested = min(max(min(basis) / 2 / 3600, MIN_CADENCE_HOURS), MAX_CADENCE_HOURS)
+            result.append({"province": province, "runs": len(runs), "changes": len(change_ts),
+                           "median_change_interval_h": round(statistics.median(intervals) / 3600, 1) if intervals else None,
+                           "median_ip_lifetime_h": round(statistics.median(lifetimes) / 3600, 1) if lifetimes else None,
+                           "suggested_cadence_h": round(suggested, 1) if suggested else None})
+        return result
+
+
+def open_index(db_path: str = DEFAULT_DB_PATH, log_dir: str = DEFAULT_LOG_DIR) -> HistoryIndex:
+    """打开并同步索引"""
+    index = HistoryIndex(db_path, log_dir)
+    index.sync()
+    return index
+
+
+# ===================== CLI =====================
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="来源IP与频道历史时间线查询")
+    parser.add_argument("--log-dir", default=(os.getenv("HISTORY_DIR") or "").strip() or DEFAULT_LOG_DIR,
+                        help="日志目录（默认 HISTORY_DIR 或 .cache/history）")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="本地索引路径")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_prov = sub.add_parser("province", help="某省各次运行")
+    p_prov.add_argument("province")
+    p_ip = sub.add_parser("ip", help="某个来源IP的出现记录")
+    p_ip.add_argument("ip")
+    p_cad = sub.add_parser("cadence", help="各省建议刷新周期")
+    sub.add_parser("sync", help="只同步索引")
+    for p in (p_prov, p_ip, p_cad):
+        p.add_argument("--since", help="起始时间（含），如 2026-01-01")
+    for p in (p_prov, p_ip):
+        p.add_argument("--until", help="结束时间（不含）")
+    args = parser.parse_args(argv)
+
+    with HistoryIndex(args.db, args.log_dir) as index:
+        imported = index.sync()
+        if args.cmd == "sync":
+            print(f"【历史】新导入 {imported} 条")
+            return 0
+        since = parse_time(args.since)
+        if args.cmd == "province":
+            runs = index.province_runs(args.province, since, parse_time(args.until))
+            for r in runs:
+                chosen = ",".join(f"{ip}(#{rank})" for ip, rank in r["chosen"]) or "-"
+                print(f"{format_time(r['ts'])}\t{r['status']}\t{r['keyword']}\t候选 {r['candidates']}\t选中 {chosen}\t"
+                      f"{(r['content_hash'] or '-')[:12]}{'  *变化' if r['changed'] else ''}")
+            return 0 if runs else 1
+        if args.cmd == "ip":
+            rows = index.ip_timeline(args.ip, since, parse_time(args.until))
+            for r in rows:
+                probe = "-" if r["alive"] is None else ("在线" if r["alive"] else "不通")
+                if r["latency_ms"] is not None:
+                    probe += f" {r['latency_ms']:.0f}ms"
+                print(f"{format_time(r['ts'])}\t{r['province']}\t第{r['position']}位\t{r['status']}\t{probe}"
+                      + (f"\t选中(#{r['chosen_rank']})" if r["chosen_rank"] else ""))
+            return 0 if rows else 1
+        rows = index.cadence(since)
+        print("省份\t运行\t变化\t变化间隔中位(h)\tIP存活中位(h)\t建议周期(h)")
+        for r in rows:
+            print("\t".join(str(r[k] if r[k] is not None else "-") for k in
+                            ("province", "runs", "changes", "median_change_interval_h", "median_ip_lifetime_h",
+                             "suggested_cadence_h")))
+        return 0 if rows else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_http_fetch.py
+- 纯 HTTP 抓取引擎（requests.Session 连接池 + Cookie），不启动浏览器
+- 流程与浏览器版一致：首页 -> ?q= 搜索 -> IP详情页 -> 查看频道列表 -> M3U下载
+- base_url 可指定为本地替身服务器（回放录制页面），便于离线测试
+- 每个请求先经过进程内共用的按站点限速器（iptv_ratelimit）；429 / 5xx / 疑似验证码页面触发降速后再重试
+"""
+
+import urllib.parse
+from typing import Dict, List, Optional
+
+import iptv_ratelimit
+import iptv_site
+
+DEFAULT_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0.0.0 Safari/537.36"
+)
+
+
+class HttpFetchError(Exception):
+    """HTTP 流程中某一步拿不到预期内容（由调用方决定是否回退到浏览器）"""
+
+
+class HttpFetcher:
+    """
+    一个 HttpFetcher 对应一个 requests.Session（同一 worker 内复用连接和 Cookie）
+    - 不跨线程共享：并发时每个 worker 各建一个
+    """
+
+    def __init__(self, base_url: str, timeout: float = 30, pool_size: int = 4, retries: int = 2,
+                 limiter: Optional[iptv_ratelimit.HostLimiter] = None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.base_url = base_url.rstrip("/") + "/"
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": DEFAULT_USER_AGENT,
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Language": "zh-CN,zh;q=0.9",
+        })
+        # 连接错误由 urllib3 重试；按状态码的重试在 _get 里做，好让每次重试都经过限速器
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(), allowed_methods=("GET",),
+                      respect_retry_after_header=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.retries = retries
+        self.limiter = limiter or iptv_ratelimit.get_limiter()
+        self._warmed = False
+        self._last_url: Optional[str] = None
+
+    def close(self):
+        try:
+            self.session.close()
+        except Exception:
+            pass
+
+    def _get(self, url: str):
+        headers = {"Referer": self._last_url} if self._last_url else {}
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire(url)
+            resp = self.session.get(url, headers=headers, timeout=self.timeout)
+            retry_after = iptv_ratelimit.parse_retry_after(resp.headers.get("Retry-After"))
+            if not self.limiter.feedback(url, status=resp.status_code, retry_after=retry_after):
+                break
+            if attempt == self.retries:
+                break
+        resp.raise_for_status()
+        self._last_url = resp.url
+        return resp
+
+    def get_text(self, url: str) -> str:
+        resp = self._get(url)
+        # 响应头没写 charset 时 requests 会按 ISO-8859-1 解码，中文页面一律按 UTF-8 处理
+        encoding = resp.encoding if "charset" in (resp.headers.get("Content-Type") or "").lower() else "utf-8"
+        text = resp.content.decode(encoding or "utf-8", errors="ignore")
+        if iptv_site.looks_like_captcha(text):
+            self.limiter.feedback(url, captcha=True)
+            raise HttpFetchError(f"疑似验证码 / 频率限制页面：{url}")
+        return text
+
+    def search(self, keyword: str) -> List[Dict]:
+        """首页（拿 Cookie）+ ?q= 搜索 -> 已排序的有效组播IP列表，href 为绝对地址"""
+        if not self._warmed:
+            self.get_text(self.base_url)
+            self._warmed = True
+
+        url = f"{self.base_url}?q={urllib.parse.quote(keyword)}"
+        html = self.get_text(url)
+        items = iptv_site.select_multicast_items(iptv_site.extract_multicast_rows(html))
+        items = [item for item in items if iptv_site.is_navigable_href(item["href"])]
+        for item in items:
+            item["href"] = iptv_site.absolute_url(url, item["href"])
+        return items
+
+    def fetch_m3u(self, detail_url: str) -> bytes:
+        """IP详情页 -> 查看频道列表 -> M3U下载，返回 M3U 原始字节"""
+        url = detail_url
+        for link_text in ("查看频道列表", "M3U下载"):
+            html = self.get_text(url)
+            href = iptv_site.find_link_href(html, link_text)
+            if not href:
+                raise HttpFetchError(f"页面中未找到可直接访问的“{link_text}”链接：{url}")
+            url = iptv_site.absolute_url(url, href)
+
+        body = self._get(url).content
+        if not iptv_site.looks_like_m3u(body):
+            raise HttpFetchError(f"下载内容不是 M3U：{url}")
+        return body
+
@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_index.py
+- 把 m3u/*.m3u（及 iptv_latest.m3u）编译成一个紧凑的二进制快照，查询时不再逐行解析文本
+- 列式存储：每个条目一行，各列是定长数组（字符串列存字符串表里的编号，IP / 端口列存整数）
+- 字符串统一驻留：同一个频道名、分组、主机只存一次
+- 倒排索引：规范化频道名（与 iptv_merge 相同的规则）、group-title、来源主机 -> 行号列表
+- 文件用 mmap 打开，各列直接以 memoryview 访问（零拷贝），打开只需解析一个很小的节表
+- 查询：哪些省份有某个频道、某台 udpxy 主机（或网段）提供的全部流、某个分组的全部频道
+
+用法：
+    python iptv_index.py build                        # 编译 -> .cache/playlists.idx
+    python iptv_index.py channel 湖南卫视4K             # 哪些省份有该频道（--contains 子串匹配）
+    python iptv_index.py host 27.18.31.67             # 该主机提供的全部流（也可写 host:port 或 27.18.0.0/16）
+    python iptv_index.py group 湖北电信组播
+    python iptv_index.py stats
+查询前若索引缺失或任一输入文件比索引新，会按编译时的输入自动重新编译（--no-rebuild 关闭）：
+默认输入时跟随 m3u/ 目录增删文件，build 显式给了文件列表时只看这些文件。
+
+文件格式（小端）：
+    头部   "IPTVIDX1" + 版本(u32) + 行数(u32) + 节数(u32)
+    节表   每节 (名称 8 字节, 偏移 u64, 长度 u64)；每节起点按 8 字节对齐
+    节     STR_OFF/STR_DATA 字符串表；C_* 列；{K,O,P}_{NAME,GRP,HOST} 倒排索引（键按 UTF-8 字节序排序，便于二分）；META（JSON）
+"""
+
+import argparse
+import array
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import weakref
+from itertools import count
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import iptv_merge
+import iptv_playlist
+
+REPO_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INDEX_PATH = os.path.join(REPO_PATH, ".cache", "playlists.idx")
+
+MAGIC = b"IPTVIDX1"
+VERSION = 2   # 2：频道名规范化规则变化（央视只保留频道号、去“综合”后缀），旧索引需重新编译
+_HEADER = struct.Struct("<8sIII")
+_SECTION = struct.Struct("<8sQQ")
+_ALIGN = 8
+
+# 字符串列（u32 字符串编号）与整数列
+STRING_COLUMNS = ("C_PROV", "C_NAME", "C_KEY", "C_GROUP", "C_URL", "C_HOST")
+INT_COLUMNS = (("C_IP", "I"), ("C_PORT", "H"), ("C_MCAST", "I"), ("C_RTP", "H"))
+# 倒排索引：名称 -> 建索引的字符串列
+INVERTED = (("NAME", "C_KEY"), ("GRP", "C_GROUP"), ("HOST", "C_HOST"))
+
+
+class Row(NamedTuple):
+    province: str
+    name: str
+    group: str
+    url: str
+    host: str
+    port: int
+    mcast_group: str
+    rtp_port: int
+
+
+def _ipv4_int(value: Optional[str]) -> int:
+    """点分 IPv4 -> u32；不是 IPv4（域名、空）返回 0"""
+    if not value:
+        return 0
+    try:
+        return int(ipaddress.IPv4Address(value))
+    except ValueError:
+        return 0
+
+
+def _ipv4_str(value: int) -> str:
+    return str(ipaddress.IPv4Address(value)) if value else ""
+
+
+def normalize_name(name: str) -> str:
+    """查询与建索引用同一套规范化（全角转半角、大写、去分隔符和“高清/HD”后缀）"""
+    return iptv_merge.channel_key(iptv_playlist.Channel(name, ""))
+
+
+# ===================== 编译 =====================
+
+class _StringTable:
+    """字符串驻留：编号 0 固定为空串（表示缺失）"""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {"": 0}
+        self.strings: List[str] = [""]
+
+    def intern(self, value: Optional[str]) -> int:
+        value = value or ""
+        sid = self.ids.get(value)
+        if sid is None:
+            sid = self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return sid
+
+
+def _le(arr: array.array) -> bytes:
+    if sys.byteorder != "little":
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def build_index(files: Optional[Sequence[str]] = None, out_path: str = DEFAULT_INDEX_PATH) -> Dict:
+    """
+    解析全部播放列表并写出索引（临时文件 + os.replace），返回统计。
+    files=None 表示默认输入（m3u/*.m3u + iptv_latest.m3u）；输入列表记在 META 里，判断过期与重新编译都按它来
+    """
+    started = time.perf_counter()
+    sources = None if files is None else [os.path.abspath(p) for p in files]
+    if files is None:
+        files = default_files()
+    strings = _StringTable()
+    columns = {name: array.array("I") for name in STRING_COLUMNS}
+    columns.update({name: array.array(code) for name, code in INT_COLUMNS})
+    inputs = {}
+
+    for path in files:
+        province = strings.intern(iptv_merge.province_of(path))
+        try:
+            inputs[os.path.abspath(path)] = os.path.getmtime(path)
+        except OSError:
+            continue
+        for ch in iptv_playlist.iter_channels(path):
+            columns["C_PROV"].append(province)
+            columns["C_NAME"].append(strings.intern(ch.name))
+            columns["C_KEY"].append(strings.intern(iptv_merge.channel_key(ch)))
+            columns["C_GROUP"].append(strings.intern(ch.group_title))
+            columns["C_URL"].append(strings.intern(ch.url))
+            columns["C_HOST"].append(strings.intern((ch.host or "").lower()))
+            columns["C_IP"].append(_ipv4_int(ch.host))
+            columns["C_PORT"].append(ch.port or 0)
+            columns["C_MCAST"].append(_ipv4_int(ch.mcast_group))
+            columns["C_RTP"].append(ch.rtp_port or 0)
+    rows = len(columns["C_PROV"])
+
+    encoded = [s.encode("utf-8") for s in strings.strings]
+    offsets = array.array("I", [0])
+    for b in encoded:
+        offsets.append(offsets[-1] + len(b))
+    sections: List[Tuple[str, bytes]] = [("STR_OFF", _le(offsets)), ("STR_DATA", b"".join(encoded))]
+    sections += [(name, _le(columns[name])) for name in STRING_COLUMNS]
+    sections += [(name, _le(columns[name])) for name, _ in INT_COLUMNS]
+
+    for index_name, column in INVERTED:
+        postings: Dict[int, array.array] = {}
+        for row, sid in enumerate(columns[column]):
+            if sid:
+                postings.setdefault(sid, array.array("I")).append(row)
+        keys = sorted(postings, key=lambda sid: encoded[sid])
+        key_arr, off_arr, post_arr = array.array("I", keys), array.array("I", [0]), array.array("I")
+        for sid in keys:
+            post_arr.extend(postings[sid])
+            off_arr.append(len(post_arr))
+        sections += [(f"K_{index_name}", _le(key_arr)), (f"O_{index_name}", _le(off_arr)),
+                     (f"P_{index_name}", _le(post_arr))]
+
+    meta = {"built_at": time.strftime("%Y-%m-%d %H:%M:%S"), "sources": sources, "inputs": inputs}
+    sections.append(("META", json.dumps(meta, ensure_ascii=False).encode("utf-8")))
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        table_size = _HEADER.size + _SECTION.size * len(sections)
+        pos = -(-table_size // _ALIGN) * _ALIGN
+        table, layout = [], []
+        for name, data in sections:
+            table.append(_SECTION.pack(name.encode("ascii"), pos, len(data)))
+            layout.append((pos, data))
+            pos = -(-(pos + len(data)) // _ALIGN) * _ALIGN
+        f.write(_HEADER.pack(MAGIC, VERSION, rows, len(sections)) + b"".join(table))
+        for offset, data in layout:
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(data)
+    os.replace(tmp_path, out_path)
+    return {"files": len(inputs), "rows": rows, "strings": len(encoded), "bytes": os.path.getsize(out_path),
+            "elapsed_sec": round(time.perf_counter() - started, 4)}
+
+
+# ===================== 读取 / 查询 =====================
+
+class IndexFormatError(Exception):
+    """索引文件损坏或版本不符（重新 build 即可）"""
+
+
+class PlaylistIndex:
+    """
+    mmap 打开的只读索引；列是 memoryview（零拷贝），字符串按需解码。
+    从 mmap 导出的 memoryview（含 lookup 返回的行号切片）都登记在 _views 里，close() 时逐个 release
+    再关闭 mmap；close 之后仍持有的切片不可再访问
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise IndexFormatError(f"索引文件为空：{path}")
+        self._views: "weakref.WeakValueDictionary[int, memoryview]" = weakref.WeakValueDictionary()
+        self._view_ids = count()
+        self._sections: Dict[str, memoryview] = {}
+        self._casts: Dict[str, Sequence[int]] = {}
+        try:
+            self._load()
+        except (struct.error, KeyError, ValueError, TypeError) as e:
+            self.close()
+            raise IndexFormatError(f"索引文件损坏：{path}（{e}）")
+
+    def _load(self):
+        view = self._export(memoryview(self._mm))
+        magic, version, self.rows, count = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("不是可识别的索引文件（或版本不符）")
+        for i in range(count):
+            name, offset, length = _SECTION.unpack_from(view, _HEADER.size + i * _SECTION.size)
+            if offset + length > len(view):
+                raise ValueError(f"节 {name!r} 越界")
+            self._sections[name.rstrip(b"\0").decode("ascii")] = self._export(view[offset:offset + length])
+        self._str_off = self._column("STR_OFF", "I")
+        self._str_data = self._sections["STR_DATA"]
+        self.columns = {name: self._column(name, "I") for name in STRING_COLUMNS}
+        self.columns.update({name: self._column(name, code) for name, code in INT_COLUMNS})
+        self.meta = json.loads(bytes(self._sections["META"]).decode("utf-8"))
+
+    def _export(self, view: memoryview) -> memoryview:
+        self._views[next(self._view_ids)] = view
+        return view
+
+    def _column(self, name: str, code: str):
+        column = self._casts.get(name)
+        if column is not None:
+            return column
+        data = self._sections[name]
+        if sys.byteorder == "little":
+            column = self._export(data.cast(code))
+        else:
+            column = array.array(code, bytes(data))
+            column.byteswap()
+        self._casts[name] = column
+        return column
+
+    def close(self):
+        """先 release 全部导出的 memoryview，mmap 才能真正关闭（否则 BufferError，映射泄漏）"""
+        self._sections = {}
+        self._casts = {}
+        self.columns = {}
+        self._str_off = self._str_data = None
+        for view in list(self._views.values()):
+            view.release()
+        self._views.clear()
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---- 基本访问 ----
+    def string(self, sid: int) -> str:
+        return self._str_bytes(sid).decode("utf-8")
+
+    def _str_bytes(self, sid: int) -> bytes:
+        return bytes(self._str_data[self._str_off[sid]:self._str_off[sid + 1]])
+
+    def row(self, i: int) -> Row:
+        c = self.columns
+        return Row(self.string(c["C_PROV"][i]), self.string(c["C_NAME"][i]), self.string(c["C_GROUP"][i]),
+                   self.string(c["C_URL"][i]), self.string(c["C_HOST"][i]), c["C_PORT"][i],
+                   _ipv4_str(c["C_MCAST"][i]), c["C_RTP"][i])
+
+    def rows_at(self, positions: Iterable[int]) -> List[Row]:
+        return [self.row(i) for i in positions]
+
+    # ---- 倒排索引 ----
+    def keys(self, index: str) -> Iterator[str]:
+        for sid in self._column(f"K_{index}", "I"):
+            yield self.string(sid)
+
+    def lookup(self, index: str, key: str) -> Sequence[int]:
+        """精确查找：返回行号序列（memoryview，零拷贝）；没有则为空"""
+        keys = self._column(f"K_{index}", "I")
+        target = key.encode("utf-8")
+        lo, hi = 0, len(keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._str_bytes(keys[mid]) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(keys) or self._str_bytes(keys[lo]) != target:
+            return ()
+        offsets = self._column(f"O_{index}", "I")
+        postings = self._column(f"P_{index}", "I")[offsets[lo]:offsets[lo + 1]]
+        return self._export(postings) if isinstance(postings, memoryview) else postings
+
+    # ---- 查询 ----
+    def channel_rows(self, name: str, contains: bool = False) -> List[int]:
+        key = normalize_name(name)
+        if not contains:
+            return list(self.lookup("NAME", key))
+        rows: List[int] = []
+        for k in self.keys("NAME"):
+            if key in k:
+                rows.extend(self.lookup("NAME", k))
+        return sorted(rows)
+
+    def provinces_with(self, name: str, contains: bool = False) -> Dict[str, int]:
+        """哪些省份有该频道：{省份: 条目数}（单次模式输出的省份为空串）"""
+        prov = self.columns["C_PROV"]
+        counts: Dict[str, int] = {}
+        for i in self.channel_rows(name, contains):
+            p = self.string(prov[i])
+            counts[p] = counts.get(p, 0) + 1
+        return counts
+
+    def host_rows(self, host: str) -> List[int]:
+        """主机提供的全部流：host、host:port，或 IPv4 网段（如 27.18.0.0/16，按 IP 列扫描）"""
+        if "/" in host:
+            net = ipaddress.IPv4Network(host, strict=False)
+            lo, hi = int(net.network_address), int(net.broadcast_address)
+            return [i for i, ip in enumerate(self.columns["C_IP"]) if lo <= ip <= hi]
+        name, _, port = host.rpartition(":") if host.count(":") == 1 else (host, "", "")
+        rows = self.lookup("HOST", name.lower())
+        if port.isdigit():
+            ports = self.columns["C_PORT"]
+            return [i for i in rows if ports[i] == int(port)]
+        return list(rows)
+
+    def group_rows(self, group: str) -> List[int]:
+        return list(self.lookup("GRP", group))
+
+    def source_files(self) -> List[str]:
+        return source_files(self.meta)
+
+    def stale(self) -> bool:
+        return index_stale(self.meta, self.source_files())
+
+
+def default_files() -> List[str]:
+    return iptv_merge.default_inputs()
+
+
+def source_files(meta: Dict) -> List[str]:
+    """编译时的输入：build 显式给的文件列表，或（默认输入时）当前的 m3u/*.m3u + iptv_latest.m3u"""
+    sources = meta.get("sources")
+    return default_files() if sources is None else list(sources)
+
+
+def index_stale(meta: Dict, files: Sequence[str]) -> bool:
+    """输入文件集合变了，或任一文件比编译时新（不存在的文件不算输入，编译时同样会跳过）"""
+    inputs = meta.get("inputs") or {}
+    if set(inputs) != {os.path.abspath(p) for p in files if os.path.exists(p)}:
+        return True
+    for path, mtime in inputs.items():
+        try:
+            if os.path.getmtime(path) != mtime:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def open_index(path: str = DEFAULT_INDEX_PATH, rebuild: bool = True) -> PlaylistIndex:
+    """打开索引；rebuild=True 时缺失、损坏则编译默认输入，过期则按原来的输入列表重新编译"""
+    if rebuild:
+        try:
+            index = PlaylistIndex(path)
+        except (OSError, IndexFormatError):
+            index = None
+        if index is not None and not index.stale():
+            return index
+        sources = None
+        if index is not None:
+            sources = index.meta.get("sources")
+            index.close()
+        stats = build_index(sources, path)
+        print(f"【索引】已重新编译：{stats['files']} 个文件 {stats['rows']} 条（{stats['bytes'] // 1024} KB）",
+              file=sys.stderr)
+    return PlaylistIndex(path)
+
+
+# ===================== CLI =====================
+
+def _print_rows(index: PlaylistIndex, positions: Sequence[int], limit: int):
+    for i in list(positions)[:limit] if limit else positions:
+        r = index.row(i)
+        print(f"{r.province or '-'}\t{r.group}\t{r.name}\t{r.url}")
+    if limit and len(positions) > limit:
+        print(f"...（共 {len(positions)} 条，--limit 0 显示全部）")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="播放列表二进制索引：编译与查询")
+    parser.add_argument("--index", default=DEFAULT_INDEX_PATH, help="索引文件路径")
+    parser.add_argument("--no-rebuild", action="store_true", help="查询前不检查 / 重新编译索引")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_build = sub.add_parser("build", help="编译索引")
+    p_build.add_argument("files", nargs="*", help="要编译的 .m3u（默认 m3u/*.m3u + iptv_latest.m3u）")
+    p_channel = sub.add_parser("channel", help="哪些省份有该频道")
+    p_channel.add_argument("name")
+    p_channel.add_argument("--contains", action="store_true", help="规范化后的子串匹配")
+    p_channel.add_argument("--rows", action="store_true", help="列出全部条目而不是按省份汇总")
+    p_host = sub.add_parser("host", help="某主机 / 网段提供的全部流")
+    p_host.add_argument("host", help="IP、IP:端口 或 网段（如 27.18.0.0/16）")
+    p_group = sub.add_parser("group", help="某个 group-title 的全部条目")
+    p_group.add_argument("group")
+    for p in (p_channel, p_host, p_group):
+        p.add_argument("--limit", type=int, default=50, help="最多显示条数（0=全部）")
+    sub.add_parser("stats", help="索引概况")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        stats = build_index(args.files or None, args.index)
+        print(f"【索引】{stats['files']} 个文件 {stats['rows']} 条，字符串 {stats['strings']} 个，"
+              f"{stats['bytes'] // 1024} KB，耗时 {stats['elapsed_sec'] * 1000:.0f}ms -> {args.index}")
+        return 0
+
+    started = time.perf_counter()
+    try:
+        index = open_index(args.index, rebuild=not args.no_rebuild)
+    except (OSError, IndexFormatError) as e:
+        print(f"❌ 无法打开索引：{e}（先运行 build）")
+        return 2
+    opened_ms = (time.perf_counter() - started) * 1000
+    with index:
+        if args.cmd == "channel":
+            if args.rows:
+                rows = index.channel_rows(args.name, args.contains)
+                _print_rows(index, rows, args.limit)
+                found = bool(rows)
+            else:
+                counts = index.provinces_with(args.name, args.contains)
+                for province, n in sorted(counts.items(), key=lambda kv: (-kv[1], kv[0])):
+                    print(f"{province or '(单次输出)'}\t{n}")
+                found = bool(counts)
+        elif args.cmd == "host":
+            rows = index.host_rows(args.host)
+            _print_rows(index, rows, args.limit)
+            found = bool(rows)
+        elif args.cmd == "group":
+            rows = index.group_rows(args.group)
+            _print_rows(index, rows, args.limit)
+            found = bool(rows)
+        else:
+            print(f"行数 {index.rows}，频道 {sum(1 for _ in index.keys('NAME'))}，分组 {sum(1 for _ in index.keys('GRP'))}，"
+                  f"主机 {sum(1 for _ in index.keys('HOST'))}，编译于 {index.meta.get('built_at')}，"
+                  f"{os.path.getsize(index.path) // 1024} KB")
+            found = True
+        print(f"（打开索引 {opened_ms:.1f}ms，查询 {(time.perf_counter() - started) * 1000 - opened_ms:.1f}ms）",
+              file=sys.stderr)
+    return 0 if found else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
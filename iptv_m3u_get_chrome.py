@@ -3,33 +3,114 @@
 iptv_m3u_get_chrome.py
 - Chrome + Selenium（兼容本地/CI）
 - 支持运行时输入 / 环境变量配置：SEARCH_KEYWORD, TARGET_IP_RANK
+- 多排名：TARGET_IP_RANK=1-3 / 1,2,3 时只搜索一次，同一会话依次下载各排名 -> <输出>.rank<N>.m3u（MULTI_RANK_MERGE=1 合并进主文件）
 - 支持批量省份模式：BATCH=1 -> 输出到 m3u/<省>.m3u
+- 批量模式可并发：BATCH_WORKERS=N -> N 个 Chrome 各自独立下载目录并行抓取
+- 自适应等待：条件满足即继续（ADAPTIVE_WAIT=0 可退回固定等待），并报告相对固定等待节省的时间
+- 下载完成检测：每次下载用专用临时目录 + 目录事件（inotify），不再轮询扫描仓库目录
+- 抓取后端可选：FETCH_BACKEND=selenium（默认，仅浏览器）/ auto（先纯 HTTP，失败回退浏览器）/ http
+- 候选IP预检：PRECHECK=1 时（默认关闭）并发探测候选IP的 udpxy 端口，在线的优先，同级按延迟；
+  只探测行内给出的端口和现有播放列表里出现过的端口，TARGET_IP_RANK 随之按重排后的顺序计
+- 搜索缓存：SEARCH_CACHE=1（默认）时按关键词缓存已解析的候选列表（TTL + LRU），重试/重跑/换 rank 不再重复搜索
+- 增量刷新：INCREMENTAL=1 时若选中的来源IP与上次相同且现有文件抽检可播，则跳过下载
+- 流水线：PIPELINE=1 时批量模式改为 asyncio 分段流水线（搜索 -> 预检 -> 下载 -> 写出，各阶段独立并发）
+- 站点限速：所有浏览器导航与 HTTP 请求共用按站点的令牌桶（SITE_RPS / SITE_BURST / SITE_LIMITS），遇 429 / 5xx / 验证码自动降速
+- 批量调度：SCHEDULER=1（默认）按历史成功率排序关键词，连续失败的地区熔断若干轮，超时/异常的地区放到本批末尾退避重试
+- 资源拦截：BLOCK_RESOURCES=light（默认，图片/字体/媒体/统计脚本）/ strict（再加样式表和广告）/ off
+- 常驻模式：PERSISTENT_BROWSER=1 固定浏览器配置目录 + 缓存 chromedriver 路径；DAEMON_INTERVAL=秒 定时重跑且复用已启动的浏览器
 - 保持“模拟点击”流程：进入IP详情页 -> 查看频道列表 -> M3U下载
-- 在 m3u 顶部写入 source_ip 标记（可关）
+- 免下载：DOWNLOAD_MODE=fetch 时在频道列表页内 fetch M3U（带页面 Cookie），不经过下载目录，输出与下载文件逐字节一致
+- 历史时间线：HISTORY=1（默认）时批量模式每地区记一条（候选IP与存活天数、预检结果、选中IP、频道摘要）到 .cache/history/
+  （本地，不入库；HISTORY_DIR=目录 可改到别处，例如要随仓库提交时）；
+  HISTORY_RANK=1 时同等新旧的候选按历史可靠性排序（查询与建议刷新周期见 iptv_history.py）
+- 运行报告：每地区每步耗时、重试、下载字节数、候选数 -> .cache/run_report.json/.csv；TRACE_EXPORT=路径 导出 Chrome trace
+- 在 m3u 顶部写入 source_ip 标记（可关）；输出为临时文件 + 原子替换，频道没变化时不改动文件（不产生提交）
 """
 
+import asyncio
+import base64
+import json
 import os
-import re
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
 import time
 import urllib.parse
-from typing import Optional, Tuple, Dict, List
+from typing import Callable, Optional, Sequence, Tuple, Dict, List, Union
 
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options as ChromeOptions
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
+from selenium.common.exceptions import WebDriverException
+
+import iptv_history
+import iptv_pipeline
+import iptv_playlist
+import iptv_probe
+import iptv_ratelimit
+import iptv_schedule
+import iptv_site
+import iptv_trace
+from iptv_trace import span
+from iptv_cache import SearchCache
+from iptv_state import ProvinceState
+from iptv_dirwatch import DownloadWatcher
+from iptv_http_fetch import HttpFetcher
 
 
 # ===================== 默认配置（可被环境变量/输入覆盖）=====================
 DEFAULT_SEARCH_KEYWORD = "湖北省武汉"
 DEFAULT_TARGET_IP_RANK = 1  # 获取“有效组播IP”里的第n新（1=最新）
 
-HOME_PAGE_URL = "https://iptv.cqshushu.com"
+# 站点地址；HOME_PAGE_URL 环境变量可指向本地替身站点（离线基准测试，见 iptv_bench.py）
+HOME_PAGE_URL = (os.getenv("HOME_PAGE_URL") or "").strip() or "https://iptv.cqshushu.com"
 ELEMENT_TIMEOUT = 60
 PAGE_LOAD_TIMEOUT = 120
 FIXED_DELAY = 3
 
+# 自适应等待：页面条件满足立即继续；轮询间隔从 WAIT_POLL_MIN 起按 WAIT_POLL_BACKOFF 递增到 WAIT_POLL_MAX
+# 每次抓取的等待总预算 WAIT_BUDGET 秒（环境变量可覆盖），超出即判定失败
+WAIT_POLL_MIN = 0.1
+WAIT_POLL_MAX = 1.0
+WAIT_POLL_BACKOFF = 1.5
+DEFAULT_WAIT_BUDGET = 180
+
+# 抓取后端：selenium=仅浏览器；auto=先 HTTP 后浏览器；http=仅 HTTP（环境变量 FETCH_BACKEND 覆盖）
+# 默认仍是浏览器：HTTP 抓取依赖对站点页面结构的解析，只在本地替身站点上验证过
+DEFAULT_FETCH_BACKEND = "selenium"
+FETCH_BACKENDS = ("auto", "http", "selenium")
+
+# 浏览器后端取 M3U 的方式：file=点击下载并等待文件落盘；fetch=在频道列表页内用 fetch（带页面 Cookie）
+# 直接取回内容，不经过下载目录（失败时自动退回 file）。环境变量 DOWNLOAD_MODE 覆盖
+DEFAULT_DOWNLOAD_MODE = "file"
+DOWNLOAD_MODES = ("file", "fetch")
+IN_PAGE_FETCH_TIMEOUT = 60
+
+# 资源拦截档位（CDP Network.setBlockedURLs 通配）：只需要 DOM 文字和几个链接，其余资源都可以不下载
+_BLOCK_IMAGES = ["*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico", "*.bmp"]
+_BLOCK_FONTS = ["*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot"]
+_BLOCK_MEDIA = ["*.mp4", "*.webm", "*.mp3", "*.m4a", "*.ogg"]
+_BLOCK_ANALYTICS = [
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*clarity.ms*",
+    "*hm.baidu.com*", "*cnzz.com*", "*51.la*", "*umeng.com*", "*busuanzi*",
+]
+_BLOCK_ADS = ["*googlesyndication.com*", "*adservice.google.*", "*pos.baidu.com*", "*cpro.baidu.com*"]
+RESOURCE_BLOCK_PROFILES: Dict[str, List[str]] = {
+    "off": [],
+    "light": _BLOCK_IMAGES + _BLOCK_FONTS + _BLOCK_MEDIA + _BLOCK_ANALYTICS,
+    "strict": _BLOCK_IMAGES + _BLOCK_FONTS + _BLOCK_MEDIA + _BLOCK_ANALYTICS + _BLOCK_ADS + ["*.css"],
+}
+DEFAULT_BLOCK_PROFILE = "light"
+
+# 候选IP预检：每个端口的连接超时（秒）
+PRECHECK_TIMEOUT = 1.5
+
+# 批量模式并发数（每个 worker 一个独立 Chrome + 独立下载目录）
+DEFAULT_BATCH_WORKERS = 1
+
 # 是否在 m3u 顶部写入本次来源标记（保证换IP/换rank有diff，播放器一般不受影响）
 ENABLE_STAMP = True
 
@@ -40,6 +121,41 @@ M3U_PATH = os.path.join(GITHUB_REPO_PATH, GITHUB_M3U_FILE_NAME)
 
 OUTPUT_DIR = os.path.join(GITHUB_REPO_PATH, "m3u")  # 批量模式输出目录
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+# 本地缓存目录（不入库）：常驻浏览器配置、chromedriver 路径等
+CACHE_DIR = os.path.join(GITHUB_REPO_PATH, ".cache")
+DEFAULT_PROFILE_DIR = os.path.join(CACHE_DIR, "chrome-profile")  # 可用 CHROME_PROFILE_DIR 覆盖
+CHROMEDRIVER_PATH_CACHE = os.path.join(CACHE_DIR, "chromedriver_path.txt")
+
+# 搜索结果缓存（关键词 -> 候选列表）；TTL / 条目上限可用 SEARCH_CACHE_TTL / SEARCH_CACHE_MAX 覆盖
+SEARCH_CACHE_DIR = os.path.join(CACHE_DIR, "search")
+DEFAULT_SEARCH_CACHE_TTL = 3600
+DEFAULT_SEARCH_CACHE_MAX = 200
+
+# 运行报告（每地区每步耗时、重试、字节数、候选数）；RUN_REPORT=0 关闭，TRACE_EXPORT=路径 另存 Chrome trace
+RUN_REPORT_PATH = os.path.join(CACHE_DIR, "run_report.json")
+
+# 增量刷新状态（入库，CI 每次都能读到上次的来源IP与内容摘要）
+STATE_PATH = os.path.join(GITHUB_REPO_PATH, "state", "provinces.json")
+INCREMENTAL_PROBE_SAMPLE = 6  # 增量跳过前，抽检现有文件中的几个地址
+
+# 批量调度历史（入库）：关键词成功率、地区熔断；SCHEDULER=0 退回按固定顺序逐个尝试
+SCHEDULE_PATH = os.path.join(GITHUB_REPO_PATH, "state", "schedule.json")
+SCHEDULE_STATS_PATH = os.path.join(CACHE_DIR, "schedule_stats.json")
+DEFAULT_RETRY_ROUNDS = 2      # 临时性失败在本批末尾最多再补跑几轮（RETRY_ROUNDS）
+DEFAULT_RETRY_BACKOFF = 30    # 补跑前的退避基数（秒，RETRY_BACKOFF），每轮翻倍并加随机抖动
+
+# 历史时间线（本地追加日志 + SQLite 索引）；HISTORY=0 关闭，HISTORY_DIR 改日志目录，HISTORY_RANK=1 用历史给同级候选排序
+HISTORY_LOG_DIR = os.path.join(CACHE_DIR, "history")
+HISTORY_DB_PATH = os.path.join(CACHE_DIR, "history.sqlite")
+HISTORY_RANK_DAYS = 90        # 历史可靠性只看最近多少天
+
+# 流水线模式（PIPELINE=1，HTTP 抓取）：各阶段并发数（PIPELINE_SEARCH / _PROBE / _DOWNLOAD / _POST）
+# 对站点的限速不在这里：所有浏览器与 HTTP 会话共用 iptv_ratelimit（SITE_RPS / SITE_BURST / SITE_LIMITS）
+DEFAULT_PIPELINE_SEARCH = 4
+DEFAULT_PIPELINE_PROBE = 8
+DEFAULT_PIPELINE_DOWNLOAD = 4
+DEFAULT_PIPELINE_POST = 2
 # ============================================================================
 
 
@@ -56,20 +172,32 @@ PROVINCES = [
 # ============================================================================
 
 
-def get_runtime_config() -> Tuple[str, int]:
+def parse_rank_spec(spec: str) -> List[int]:
+    """'1' -> [1]；'1-3' -> [1, 2, 3]；'1,3,5' -> [1, 3, 5]（可混用，如 '1-2,5'）；非法部分忽略"""
+    ranks: List[int] = []
+    for part in spec.replace("，", ",").split(","):
+        part = part.strip()
+        lo, sep, hi = part.partition("-")
+        if sep and lo.strip().isdigit() and hi.strip().isdigit():
+            ranks.extend(range(int(lo), int(hi) + 1))
+        elif part.isdigit():
+            ranks.append(int(part))
+    return list(dict.fromkeys(r for r in ranks if r >= 1))
+
+
+def get_runtime_config() -> Tuple[str, Union[int, List[int]]]:
     """
     优先级：
       1) 环境变量 SEARCH_KEYWORD / TARGET_IP_RANK
       2) 本地交互输入（仅在 TTY 且无环境变量时）
       3) 默认值
+    TARGET_IP_RANK 可以是单个排名（1），也可以是多个（1-3 / 1,2,3）：多个时返回列表，只搜索一次依次下载
     """
     kw_env = (os.getenv("SEARCH_KEYWORD") or "").strip()
     rk_env = (os.getenv("TARGET_IP_RANK") or "").strip()
 
     keyword = kw_env if kw_env else DEFAULT_SEARCH_KEYWORD
-    rank = DEFAULT_TARGET_IP_RANK
-    if rk_env.isdigit():
-        rank = int(rk_env)
+    ranks = parse_rank_spec(rk_env)
 
     # 本地交互（Actions/CI 通常没有 stdin）
     try:
@@ -79,26 +207,100 @@ def get_runtime_config() -> Tuple[str, int]:
 
     if is_tty and (not kw_env and not rk_env):
         kw_in = input(f"请输入搜索关键词（回车=默认：{DEFAULT_SEARCH_KEYWORD}）：").strip()
-        rk_in = input(f"请输入第几个新的IP（回车=默认：{DEFAULT_TARGET_IP_RANK}）：").strip()
+        rk_in = input(f"请输入第几个新的IP（回车=默认：{DEFAULT_TARGET_IP_RANK}，多个如 1-3）：").strip()
         if kw_in:
             keyword = kw_in
-        if rk_in.isdigit():
-            rank = int(rk_in)
+        if rk_in:
+            ranks = parse_rank_spec(rk_in) or ranks
+
+    if not ranks:
+        return keyword, DEFAULT_TARGET_IP_RANK
+    return keyword, ranks[0] if len(ranks) == 1 else ranks
+
+
+def get_batch_workers() -> int:
+    """批量并发数：环境变量 BATCH_WORKERS（默认 1=串行），不超过地区数"""
+    raw = (os.getenv("BATCH_WORKERS") or "").strip()
+    workers = int(raw) if raw.isdigit() else DEFAULT_BATCH_WORKERS
+    return max(1, min(workers, len(PROVINCES)))
+
+
+def get_fetch_backend() -> str:
+    """抓取后端：环境变量 FETCH_BACKEND（auto/http/selenium），非法值按默认处理"""
+    backend = (os.getenv("FETCH_BACKEND") or DEFAULT_FETCH_BACKEND).strip().lower()
+    return backend if backend in FETCH_BACKENDS else DEFAULT_FETCH_BACKEND
+
+
+def get_download_mode() -> str:
+    """浏览器后端的 M3U 获取方式：环境变量 DOWNLOAD_MODE（file/fetch），非法值按默认处理"""
+    mode = (os.getenv("DOWNLOAD_MODE") or DEFAULT_DOWNLOAD_MODE).strip().lower()
+    return mode if mode in DOWNLOAD_MODES else DEFAULT_DOWNLOAD_MODE
+
+
+def get_block_profile() -> str:
+    """资源拦截档位：环境变量 BLOCK_RESOURCES（off/light/strict），非法值按默认处理"""
+    profile = (os.getenv("BLOCK_RESOURCES") or DEFAULT_BLOCK_PROFILE).strip().lower()
+    return profile if profile in RESOURCE_BLOCK_PROFILES else DEFAULT_BLOCK_PROFILE
+
+
+def persistent_browser_enabled() -> bool:
+    """PERSISTENT_BROWSER=1：固定 user-data-dir（复用 Cookie / HTTP 缓存）并缓存 chromedriver 路径"""
+    return (os.getenv("PERSISTENT_BROWSER") or "0").strip() in ("1", "true", "True")
+
+
+def get_profile_dir(worker_id: Optional[int] = None) -> Optional[str]:
+    """
+    常驻模式下的浏览器配置目录；同一目录不能被两个 Chrome 同时使用，并发时每个 worker 一个子目录
+    """
+    if not persistent_browser_enabled():
+        return None
+    base = (os.getenv("CHROME_PROFILE_DIR") or "").strip() or DEFAULT_PROFILE_DIR
+    return os.path.join(base, f"w{worker_id}") if worker_id else base
+
+
+def resolve_chromedriver_path(refresh: bool = False) -> str:
+    """
+    chromedriver 路径：
+      1) 环境变量 CHROMEDRIVER_PATH
+      2) 常驻模式下读取本地缓存（跳过 ChromeDriverManager 的联网版本检查）
+      3) ChromeDriverManager().install()（常驻模式下写回缓存）
+    """
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    env_path = (os.getenv("CHROMEDRIVER_PATH") or "").strip()
+    if env_path:
+        return env_path
+
+    use_cache = persistent_browser_enabled()
+    if use_cache and not refresh:
+        try:
+            with open(CHROMEDRIVER_PATH_CACHE, "r", encoding="utf-8") as f:
+                cached = f.read().strip()
+            if cached and os.path.exists(cached):
+                return cached
+        except Exception:
+            pass
 
-    if rank < 1:
-        rank = 1
-    return keyword, rank
+    path = ChromeDriverManager().install()
+    if use_cache:
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(CHROMEDRIVER_PATH_CACHE, "w", encoding="utf-8") as f:
+                f.write(path)
+        except Exception:
+            pass
+    return path
 
 
-def make_driver(download_dir: str) -> webdriver.Chrome:
+def make_driver(download_dir: str, profile_dir: Optional[str] = None) -> webdriver.Chrome:
     """
     创建 Chrome WebDriver（跨平台）
     - Windows：显式指定 chrome.exe（避免 chrome 不在 PATH）
     - Linux/CI：不指定 binary_location，使用 PATH 中的 chrome（workflow 已安装）
+    - profile_dir：固定的 user-data-dir（常驻模式），Cookie 和 HTTP 缓存跨次运行保留
     """
     import platform
     from selenium.webdriver.chrome.service import Service
-    from webdriver_manager.chrome import ChromeDriverManager
 
     headless_env = (os.getenv("HEADLESS") or "1").strip()
     headless = headless_env not in ("0", "false", "False")
@@ -133,6 +335,17 @@ def make_driver(download_dir: str) -> webdriver.Chrome:
     options.add_argument("--disable-gpu")
     options.add_argument("--window-size=1920,1080")
 
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        options.add_argument(f"--user-data-dir={profile_dir}")
+
+    block_profile = get_block_profile()
+    if block_profile != "off":
+        # 图片在渲染层直接关掉（对新开的标签页同样生效）；其余类型由 CDP 按 URL 拦截
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        # 性能日志用于统计每页实际加载 / 被拦截的请求
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
     options.add_argument("--disable-blink-features=AutomationControlled")
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option("useAutomationExtension", False)
@@ -148,10 +361,17 @@ def make_driver(download_dir: str) -> webdriver.Chrome:
         "download.directory_upgrade": True,
         "safebrowsing.enabled": True,
     }
+    if block_profile != "off":
+        prefs["profile.managed_default_content_settings.images"] = 2
     options.add_experimental_option("prefs", prefs)
 
-    service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=options)
+    try:
+        driver = webdriver.Chrome(service=Service(resolve_chromedriver_path()), options=options)
+    except Exception:
+        # 缓存的 chromedriver 可能与升级后的 Chrome 不匹配：重新解析一次再试
+        if not persistent_browser_enabled() or (os.getenv("CHROMEDRIVER_PATH") or "").strip():
+            raise
+        driver = webdriver.Chrome(service=Service(resolve_chromedriver_path(refresh=True)), options=options)
 
     try:
         driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
@@ -160,21 +380,245 @@ def make_driver(download_dir: str) -> webdriver.Chrome:
     except Exception:
         pass
 
+    apply_resource_blocking(driver, block_profile)
+
     driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
     driver.set_script_timeout(ELEMENT_TIMEOUT)
     return driver
 
 
-def wait_for_dynamic_content(driver: webdriver.Chrome, timeout_sec: int = 25):
-    """等待动态内容出现（headless 下重要）"""
+def apply_resource_blocking(driver: webdriver.Chrome, profile: str) -> bool:
+    """
+    对当前标签页启用 URL 拦截（CDP 的拦截规则按标签页生效，新标签页需再次调用）
+    """
+    patterns = RESOURCE_BLOCK_PROFILES.get(profile) or []
+    if not patterns:
+        return False
     try:
-        WebDriverWait(driver, timeout_sec).until(
-            EC.presence_of_element_located(
-                (By.XPATH, "//*[contains(., 'Multicast IPTV') or contains(., '组播')]")
-            )
-        )
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+        return True
     except Exception:
-        pass
+        return False
+
+
+def drain_resource_stats(driver: webdriver.Chrome) -> Optional[Dict[str, int]]:
+    """
+    读取并清空性能日志，统计自上次调用以来：
+      requests=发出的请求数，bytes=实际传输字节，blocked=被拦截的请求数（即节省的请求）
+    未开启性能日志（BLOCK_RESOURCES=off）时返回 None
+    """
+    try:
+        entries = driver.get_log("performance")
+    except Exception:
+        return None
+
+    stats = {"requests": 0, "bytes": 0, "blocked": 0}
+    for entry in entries:
+        try:
+            msg = json.loads(entry["message"])["message"]
+        except Exception:
+            continue
+        method = msg.get("method")
+        params = msg.get("params") or {}
+        if method == "Network.requestWillBeSent":
+            stats["requests"] += 1
+        elif method == "Network.loadingFinished":
+            stats["bytes"] += int(params.get("encodedDataLength") or 0)
+        elif method == "Network.loadingFailed" and params.get("blockedReason"):
+            stats["blocked"] += 1
+    return stats
+
+
+def reset_resource_stats(driver: webdriver.Chrome):
+    """导航前清空性能日志，使 report_resources 只统计这一步（未开启拦截时没有性能日志，跳过）"""
+    if get_block_profile() != "off":
+        drain_resource_stats(driver)
+
+
+def report_resources(driver: webdriver.Chrome, label: str):
+    stats = drain_resource_stats(driver)
+    if stats is None:
+        return
+    print(f"  📉 资源（{label}）：请求 {stats['requests']} 个 / {stats['bytes'] / 1024:.1f} KB，"
+          f"拦截 {stats['blocked']} 个")
+
+
+# 页面条件（均为 driver -> 元素/True/False 的可调用对象）
+SEARCH_BOX_LOCATOR = (By.NAME, "q")
+MULTICAST_CONTENT_LOCATOR = (By.XPATH, "//*[contains(., 'Multicast IPTV') or contains(., '组播')]")
+CHANNEL_LIST_LINK_LOCATOR = (By.XPATH, "//a[contains(text(), '查看频道列表')]")
+M3U_DOWNLOAD_LINK_LOCATOR = (By.XPATH, "//a[contains(text(), 'M3U下载')]")
+
+
+def adaptive_wait_enabled() -> bool:
+    """ADAPTIVE_WAIT=0 时退回旧的固定等待（先 sleep FIXED_DELAY*2 再检查条件），便于对比"""
+    return (os.getenv("ADAPTIVE_WAIT") or "1").strip() not in ("0", "false", "False")
+
+
+class WaitBudget:
+    """
+    单次抓取的等待预算与统计
+    - 每一步记录实际等待时间与“固定等待基线”（旧逻辑的 FIXED_DELAY*2）
+    - report() 输出累计节省的时间
+    """
+
+    def __init__(self, total_sec: Optional[float] = None):
+        raw = (os.getenv("WAIT_BUDGET") or "").strip()
+        if total_sec is None:
+            total_sec = float(raw) if raw.replace(".", "", 1).isdigit() else DEFAULT_WAIT_BUDGET
+        self.deadline = time.time() + total_sec
+        self.steps: List[Tuple[str, float, float]] = []  # (label, spent, baseline)
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.time())
+
+    def record(self, label: str, spent: float, baseline: float):
+        self.steps.append((label, spent, baseline))
+
+    @property
+    def spent(self) -> float:
+        return sum(x[1] for x in self.steps)
+
+    @property
+    def baseline(self) -> float:
+        return sum(x[2] for x in self.steps)
+
+    def report(self) -> str:
+        detail = " ".join(f"{label}={spent:.1f}s" for label, spent, _ in self.steps)
+        return (f"⏱ 等待耗时 {self.spent:.1f}s（固定等待基线 {self.baseline:.1f}s，"
+                f"节省 {self.baseline - self.spent:.1f}s） {detail}")
+
+
+def adaptive_wait(driver: webdriver.Chrome, condition, label: str, budget: WaitBudget,
+                  timeout_sec: float = ELEMENT_TIMEOUT, baseline_sec: float = FIXED_DELAY * 2):
+    """
+    等待 condition(driver) 返回真值并返回该值；超时返回 None
+    - 条件已满足时立即返回；页面慢时轮询间隔逐步放大（不空转）
+    - 超时取 timeout_sec 与预算剩余时间的较小值
+    """
+    started = time.time()
+    deadline = started + min(timeout_sec, budget.remaining())
+    interval = WAIT_POLL_MIN
+    result = None
+
+    if not adaptive_wait_enabled():
+        time.sleep(baseline_sec)
+
+    try:
+        while True:
+            try:
+                result = condition(driver)
+            except Exception:
+                result = None
+            if result or time.time() >= deadline:
+                break
+            time.sleep(min(interval, max(0.0, deadline - time.time())))
+            interval = min(interval * WAIT_POLL_BACKOFF, WAIT_POLL_MAX)
+    finally:
+        budget.record(label, time.time() - started, baseline_sec)
+
+    return result or None
+
+
+# 一次 execute_script 取回“Multicast IPTV”分区内的候选行（文字 + 行内含 IP 的链接），避免逐行 WebDriver 往返；
+# 分区规则与 iptv_site 相同：最内层标题元素的最近 div/section/main/body 祖先，找不到时退回整页
+COLLECT_ROWS_JS = r"""
+const ipRe = /\d{1,3}(?:\.\d{1,3}){3}/;
+const titleRe = /multicast\s+iptv/i;
+let root = document;
+for (const el of document.querySelectorAll('body *')) {
+    if (!titleRe.test(el.textContent || '')) continue;
+    if (Array.from(el.children).some(c => titleRe.test(c.textContent || ''))) continue;
+    const container = el.parentElement && el.parentElement.closest('div, section, main, body');
+    if (container) root = container;
+    break;
+}
+const out = [];
+for (const el of root.querySelectorAll('tr, li, div')) {
+    const text = el.innerText || '';
+    if (text.indexOf('组播') < 0 || !ipRe.test(text)) continue;
+    const links = [];
+    for (const a of el.querySelectorAll('a')) {
+        const t = (a.innerText || '').trim();
+        if (ipRe.test(t)) links.push([t, a.getAttribute('href') || '']);
+    }
+    out.push({text: text, links: links});
+}
+return out;
+"""
+
+
+def collect_multicast_items(driver: webdriver.Chrome) -> List[Dict]:
+    """
+    搜索结果页 -> 有效组播IP列表（已排序，1=最新）
+    - 首选：一次 execute_script 返回结构化行数据
+    - 兜底：解析 page_source（同样只有一次往返）
+    - 状态解析、去重与排序在本地完成（iptv_site.select_multicast_items）
+    """
+    try:
+        raw_rows = driver.execute_script(COLLECT_ROWS_JS) or []
+        rows = [{"text": iptv_site.normalize_text(r.get("text") or ""),
+                 "links": [(iptv_site.normalize_text(t), h) for t, h in (r.get("links") or [])]}
+                for r in raw_rows]
+    except Exception:
+        rows = iptv_site.extract_multicast_rows(driver.page_source)
+
+    items = iptv_site.select_multicast_items(rows)
+    base_url = driver.current_url
+    for item in items:
+        if iptv_site.is_navigable_href(item["href"]):
+            item["href"] = iptv_site.absolute_url(base_url, item["href"])
+    return items
+
+
+def find_ip_link(driver: webdriver.Chrome, ip: str):
+    """只为选中的 IP 查找一次可点击链接（文字恰好为 IP 优先）；找不到返回 None"""
+    for xpath in (f"//a[normalize-space(text())='{ip}']", f"//a[contains(normalize-space(.), '{ip}')]"):
+        try:
+            return driver.find_element(By.XPATH, xpath)
+        except Exception:
+            continue
+    return None
+
+
+def set_download_dir(driver: webdriver.Chrome, directory: str) -> bool:
+    """通过 CDP 把后续下载定向到 directory；不支持时返回 False"""
+    params = {"behavior": "allow", "downloadPath": directory}
+    for cmd in ("Browser.setDownloadBehavior", "Page.setDownloadBehavior"):
+        try:
+            driver.execute_cdp_cmd(cmd, params)
+            return True
+        except Exception:
+            continue
+    return False
+
+
+# 在页面上下文里 fetch（同源、带 Cookie），原始字节转 base64 返回：不经过文本解码，保证与下载文件逐字节一致
+FETCH_BYTES_JS = r"""
+const href = arguments[0], done = arguments[arguments.length - 1];
+fetch(href, {credentials: 'include'})
+    .then(r => { if (!r.ok) throw new Error('HTTP ' + r.status); return r.arrayBuffer(); })
+    .then(buf => {
+        const bytes = new Uint8Array(buf);
+        let bin = '';
+        for (let i = 0; i < bytes.length; i += 0x8000) {
+            bin += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+        }
+        done({ok: true, data: btoa(bin)});
+    })
+    .catch(e => done({ok: false, error: String(e)}));
+"""
+
+
+def fetch_in_page(driver: webdriver.Chrome, href: str, timeout_sec: float = IN_PAGE_FETCH_TIMEOUT) -> bytes:
+    """用当前页面的 fetch 取回 href 的原始字节；失败抛异常"""
+    driver.set_script_timeout(max(1.0, timeout_sec))
+    site_throttle(href)
+    result = driver.execute_async_script(FETCH_BYTES_JS, href) or {}
+    if not result.get("ok"):
+        raise Exception(f"页面内 fetch 失败：{result.get('error') or '无返回'}")
+    return base64.b64decode(result.get("data") or "")
 
 
 def snapshot_m3u_mtimes(download_dir: str) -> Dict[str, float]:
@@ -241,41 +685,270 @@ def wait_for_new_m3u_file(download_dir: str, before_snapshot: Dict[str, float],
     return None
 
 
-def stamp_m3u(path: str, target_ip: str, target_ip_rank: int):
-    """在 m3u 头部写入本次来源标记（纯注释）"""
-    if not ENABLE_STAMP:
-        return
+def precheck_enabled() -> bool:
+    """默认关闭：候选IP是第三方地址，不请求就不去连它们的端口"""
+    return (os.getenv("PRECHECK") or "0").strip() in ("1", "true", "True")
+
+
+_PRECHECK_PORTS: Optional[List[int]] = None
+
+
+def precheck_ports() -> List[int]:
+    """预检端口：环境变量 PRECHECK_PORTS（逗号分隔），否则只用现有播放列表里出现过的端口"""
+    global _PRECHECK_PORTS
+    if _PRECHECK_PORTS is None:
+        raw = (os.getenv("PRECHECK_PORTS") or "").strip()
+        ports = [int(p) for p in raw.split(",") if p.strip().isdigit()]
+        _PRECHECK_PORTS = ports or iptv_probe.known_ports(OUTPUT_DIR)
+    return _PRECHECK_PORTS
+
+
+def precheck_plan(items: List[Dict]) -> Dict[str, List[int]]:
+    """预检目标：{ip: 候选端口}（行内给出的端口优先，再加已知端口）"""
+    ports = precheck_ports()
+    return {item["ip"]: ([item["port"]] if item.get("port") else []) + ports for item in items}
+
+
+def order_by_health(items: List[Dict], health: Dict, elapsed: float) -> List[Dict]:
+    """按预检结果重排（见 precheck_candidates）；全部不通时保持原顺序"""
+    alive = sum(1 for h in health.values() if h.alive)
+    print(f"  🔎 候选IP预检：{alive}/{len(items)} 在线（{len(precheck_ports())} 个端口，耗时 {elapsed:.1f}s）")
+    if not alive:
+        return items
+
+    for item in items:
+        h = health[item["ip"]]
+        item["health"] = h
+        if h.alive:
+            item["status"] += f" 在线:{h.port} {h.latency_ms:.0f}ms"
+    return sorted(items, key=lambda x: (x["health"].rank_key()[0], x["sort_key"], x["health"].rank_key()[1]))
+
+
+def precheck_candidates(items: List[Dict]) -> List[Dict]:
+    """
+    并发探测所有候选IP的 udpxy 端口，按“确认 udpxy > 端口可连 > 不通”重新排序，
+    同级保持原有新旧顺序，再按延迟；预检全部不通时保持原顺序（可能是本机网络受限）
+    """
+    if not precheck_enabled() or not items:
+        return items
+
+    started = time.time()
     try:
-        stamp = f"# source_ip={target_ip} rank={target_ip_rank} updated_at={time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            content = f.read()
+        with span("precheck", candidates=len(items)):
+            health = iptv_probe.check_hosts(precheck_plan(items), timeout=PRECHECK_TIMEOUT)
+    except Exception as e:
+        print(f"  ⚠️ 候选IP预检失败，保持原顺序：{e}")
+        return items
+    return order_by_health(items, health, time.time() - started)
+
+
+_SEARCH_CACHE: Optional[SearchCache] = None
+_SEARCH_CACHE_LOCK = threading.Lock()
+
+
+def get_search_cache() -> Optional[SearchCache]:
+    """SEARCH_CACHE=0 时关闭（返回 None）"""
+    global _SEARCH_CACHE
+    if (os.getenv("SEARCH_CACHE") or "1").strip() in ("0", "false", "False"):
+        return None
+    with _SEARCH_CACHE_LOCK:
+        if _SEARCH_CACHE is None:
+            ttl = (os.getenv("SEARCH_CACHE_TTL") or "").strip()
+            max_entries = (os.getenv("SEARCH_CACHE_MAX") or "").strip()
+            _SEARCH_CACHE = SearchCache(
+                SEARCH_CACHE_DIR,
+                ttl_sec=int(ttl) if ttl.isdigit() else DEFAULT_SEARCH_CACHE_TTL,
+                max_entries=int(max_entries) if max_entries.isdigit() else DEFAULT_SEARCH_CACHE_MAX,
+            )
+        return _SEARCH_CACHE
 
-        lines = content.splitlines(True)
-        lines = [ln for ln in lines if not ln.startswith("# source_ip=")]
 
-        if lines and lines[0].startswith("#EXTM3U"):
-            lines.insert(1, stamp)
-        else:
-            lines.insert(0, stamp)
+def flush_search_cache():
+    """写回搜索缓存命中时更新的访问时间（运行结束时调用一次）"""
+    if _SEARCH_CACHE is not None:
+        try:
+            _SEARCH_CACHE.save()
+        except OSError as e:
+            print(f"  ⚠️ 搜索缓存索引写入失败：{e}")
+
+
+def incremental_enabled() -> bool:
+    return (os.getenv("INCREMENTAL") or "0").strip() in ("1", "true", "True")
+
+
+_STATE: Optional[ProvinceState] = None
+_STATE_LOCK = threading.Lock()
+
+
+def get_state() -> ProvinceState:
+    global _STATE
+    with _STATE_LOCK:
+        if _STATE is None:
+            _STATE = ProvinceState(STATE_PATH, GITHUB_REPO_PATH)
+        return _STATE
+
+
+_SCHEDULER: Optional[iptv_schedule.RetryScheduler] = None
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = (os.getenv(name) or "").strip()
+    return int(raw) if raw.isdigit() else default
+
+
+def get_scheduler() -> Optional[iptv_schedule.RetryScheduler]:
+    """SCHEDULER=0 时关闭（返回 None）；BREAKER_THRESHOLD=N 连续失败 N 轮后熔断（默认 3）"""
+    global _SCHEDULER
+    if (os.getenv("SCHEDULER") or "1").strip() in ("0", "false", "False"):
+        return None
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None:
+            _SCHEDULER = iptv_schedule.RetryScheduler(
+                SCHEDULE_PATH,
+                SCHEDULE_STATS_PATH,
+                breaker_threshold=_env_int("BREAKER_THRESHOLD", iptv_schedule.DEFAULT_BREAKER_THRESHOLD),
+            )
+        return _SCHEDULER
 
-        with open(path, "w", encoding="utf-8") as f:
-            f.write("".join(lines))
-    except Exception:
-        pass
 
+_HISTORY: Optional[iptv_history.HistoryLog] = None
+_HISTORY_INDEX: Optional[iptv_history.HistoryIndex] = None
+_HISTORY_LOCK = threading.Lock()
+_HISTORY_RUN_ID = ""
+_HISTORY_INDEX_RUN = None     # 索引最近一次同步时的批次号：每批开始后首次使用时再增量同步一次
 
-def extract_m3u(driver: webdriver.Chrome, search_keyword: str, target_ip_rank: int, output_path: str) -> bool:
-    """单次抓取（失败返回 False，方便批量继续）"""
+
+def history_enabled() -> bool:
+    return (os.getenv("HISTORY") or "1").strip() not in ("0", "false", "False")
+
+
+def new_history_record(region: str) -> Optional[iptv_history.RegionRecord]:
+    """批量模式下每个地区每次尝试一条记录；HISTORY=0 时返回 None（各记录点自动跳过）"""
+    if not history_enabled():
+        return None
+    return iptv_history.RegionRecord(_HISTORY_RUN_ID, region)
+
+
+def history_log_dir() -> str:
+    return (os.getenv("HISTORY_DIR") or "").strip() or HISTORY_LOG_DIR
+
+
+def save_history_record(record: Optional[iptv_history.RegionRecord], status: str):
+    global _HISTORY
+    if record is None:
+        return
+    record.status = status
+    with _HISTORY_LOCK:
+        if _HISTORY is None:
+            _HISTORY = iptv_history.HistoryLog(history_log_dir())
     try:
-        print(f"\n========== 开始：{search_keyword} -> {os.path.relpath(output_path, GITHUB_REPO_PATH)} ==========")
+        _HISTORY.append(record)
+    except OSError as e:
+        print(f"  ⚠️ 历史记录写入失败：{e}")
+
+
+def rank_by_history(items: List[Dict], region: Optional[str] = None) -> List[Dict]:
+    """
+    HISTORY_RANK=1：同一新旧等级（sort_key 相同）的候选，按该地区历史上“被选中且成功”的比例排序；
+    不同等级之间仍是越新越靠前。地区默认取当前线程的历史记录，单次模式没有记录时不排序
+    """
+    global _HISTORY_INDEX, _HISTORY_INDEX_RUN
+    if not items or (os.getenv("HISTORY_RANK") or "0").strip() not in ("1", "true", "True"):
+        return items
+    record = iptv_history.current()
+    region = region or (record.province if record else None)
+    if not region:
+        return items
+    try:
+        with _HISTORY_LOCK:
+            if _HISTORY_INDEX is None:
+                _HISTORY_INDEX = iptv_history.open_index(HISTORY_DB_PATH, history_log_dir())
+            elif _HISTORY_INDEX_RUN != _HISTORY_RUN_ID:
+                # 常驻模式（DAEMON_INTERVAL）进程不退出：每一批都要看到上一批追加的记录
+                _HISTORY_INDEX.sync()
+            _HISTORY_INDEX_RUN = _HISTORY_RUN_ID
+        scores = _HISTORY_INDEX.ip_reliability(region, [x["ip"] for x in items],
+                                               since=int(time.time()) - HISTORY_RANK_DAYS * 86400)
+    except (OSError, sqlite3.Error) as e:
+        print(f"  ⚠️ 历史索引不可用，保持原顺序：{e}")
+        return items
+    return sorted(items, key=lambda x: (x["sort_key"], -scores.get(x["ip"], 0.0)))
+
+
+def playlist_still_healthy(path: str) -> bool:
+    """均匀抽检文件中的若干地址，至少一半能出数据即认为仍可用"""
+    urls = [ch.url for ch in iptv_playlist.iter_channels(path) if iptv_probe.is_probeable(ch.url)]
+    if not urls:
+        return False
+    step = max(1, len(urls) // INCREMENTAL_PROBE_SAMPLE)
+    sample = urls[::step][:INCREMENTAL_PROBE_SAMPLE]
+    results = iptv_probe.probe_urls(sample, ttfb=3.0, sample=0.2)
+    ok = sum(1 for r in results.values() if r.ok)
+    print(f"  🔎 抽检现有文件：{ok}/{len(sample)} 可用")
+    return ok * 2 >= len(sample)
+
+
+def try_skip_unchanged(output_path: str, target_ip: str) -> bool:
+    """
+    增量模式：来源IP与上次相同、文件内容与记录的摘要一致、抽检可播 -> 跳过下载（返回 True）
+    """
+    if not incremental_enabled():
+        return False
+    prev = get_state().get(output_path)
+    if not prev or prev.get("source_ip") != target_ip:
+        return False
+    if not os.path.exists(output_path) or iptv_playlist.channels_digest(output_path) != prev.get("content_hash"):
+        print("  ↻ 来源IP未变，但现有文件与记录不一致，重新下载")
+        return False
+    if not playlist_still_healthy(output_path):
+        print("  ↻ 来源IP未变，但现有文件抽检不可用，重新下载")
+        return False
+    print(f"  ⏭ 来源IP未变（{target_ip}，上次更新 {prev.get('updated_at')}），跳过下载")
+    iptv_history.note_output(prev.get("rank") or 1, target_ip, prev.get("content_hash"), False)
+    return True
 
-        print(f"【步骤1】打开首页：{HOME_PAGE_URL}")
-        driver.get(HOME_PAGE_URL)
-        time.sleep(FIXED_DELAY * 2)
 
-        print(f"【步骤2】搜索：{search_keyword}")
+def site_throttle(url: Optional[str] = None):
+    """浏览器每次导航（打开页面 / 点击跳转）前占用一个请求配额：与 HTTP 会话共用同一个按站点的限速桶"""
+    iptv_ratelimit.get_limiter().acquire(url or HOME_PAGE_URL)
+
+
+def browser_feedback(driver: webdriver.Chrome, ready, url: Optional[str] = None):
+    """页面等待结束后的限速反馈：等待失败且页面像验证码 / 频率限制时降速，正常则慢慢恢复速率"""
+    limiter = iptv_ratelimit.get_limiter()
+    if ready:
+        limiter.feedback(url or HOME_PAGE_URL)
+        return
+    try:
+        captcha = iptv_site.looks_like_captcha(driver.page_source)
+    except Exception:
+        captcha = False
+    if captcha:
+        limiter.feedback(url or HOME_PAGE_URL, captcha=True)
+
+
+def search_multicast_items(driver: webdriver.Chrome, search_keyword: str, budget: WaitBudget,
+                           on_first_page: Optional[Callable[[], None]] = None) -> List[Dict]:
+    """步骤1-3：打开首页 -> 搜索 -> 提取有效组播IP（已排序，未预检）"""
+    print(f"【步骤1】打开首页：{HOME_PAGE_URL}")
+    reset_resource_stats(driver)
+    with span("home_page"):
+        site_throttle()
+        driver.get(HOME_PAGE_URL)
+        if on_first_page:
+            on_first_page()
+        search_input = adaptive_wait(driver, EC.presence_of_element_located(SEARCH_BOX_LOCATOR), "首页",
+                                     budget, timeout_sec=FIXED_DELAY * 2)
+        browser_feedback(driver, search_input)
+
+    print(f"【步骤2】搜索：{search_keyword}")
+    with span("search", keyword=search_keyword):
+        old_page = driver.find_element(By.TAG_NAME, "html")
+        site_throttle()
         try:
-            search_input = driver.find_element(By.NAME, "q")
+            if not search_input:
+                raise Exception("未找到搜索框")
             search_input.clear()
             search_input.send_keys(search_keyword)
             search_input.submit()
@@ -283,167 +956,496 @@ def extract_m3u(driver: webdriver.Chrome, search_keyword: str, target_ip_rank: i
             encoded_key = urllib.parse.quote(search_keyword)
             driver.get(f"{HOME_PAGE_URL}?q={encoded_key}")
 
-        time.sleep(FIXED_DELAY * 2)
-        wait_for_dynamic_content(driver, timeout_sec=25)
+        # 首页本身可能含“组播”字样：先确认旧页面已被替换，再判断结果区出现
+        results_ready = EC.all_of(EC.staleness_of(old_page), EC.presence_of_element_located(MULTICAST_CONTENT_LOCATOR))
+        browser_feedback(driver, adaptive_wait(driver, results_ready, "搜索结果", budget, timeout_sec=25 + FIXED_DELAY * 2))
+    report_resources(driver, "首页+搜索")
 
-        print(f"【步骤3】提取 Multicast IPTV 中有效的组播IP...")
+    print(f"【步骤3】提取 Multicast IPTV 中有效的组播IP...")
+    with span("scan_rows"):
+        return collect_multicast_items(driver)
 
-        ip_pattern_anywhere = re.compile(r'(\d{1,3}(?:\.\d{1,3}){3})')
-        alive_days_pattern = re.compile(r'存活\s*(\d+)\s*天')
 
-        def parse_status(text: str):
-            t = text.replace("\u3000", " ").strip()
-            if "暂时失效" in t:
-                return (False, (99, 999999), "暂时失效")
-            if "新上线" in t:
-                return (True, (0, 0), "新上线")
-            m = alive_days_pattern.search(t)
-            if m:
-                days = int(m.group(1))
-                return (True, (1, days), f"存活{days}天")
-            return (False, (99, 999999), t)
+def normalize_ranks(target_ip_rank: Union[int, Sequence[int]]) -> List[int]:
+    ranks = [target_ip_rank] if isinstance(target_ip_rank, int) else list(target_ip_rank)
+    return list(dict.fromkeys(r for r in ranks if r >= 1)) or [DEFAULT_TARGET_IP_RANK]
 
-        multicast_root = None
-        try:
-            multicast_title = driver.find_element(
-                By.XPATH,
-                "//*[contains(translate(normalize-space(.), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'multicast iptv')]"
-            )
-            multicast_root = multicast_title.find_element(
-                By.XPATH,
-                "ancestor::*[self::div or self::section or self::main or self::body][1]"
-            )
-        except Exception:
-            multicast_root = None
 
-        if multicast_root:
-            candidate_rows = multicast_root.find_elements(By.XPATH, ".//tr | .//li | .//div")
-        else:
-            candidate_rows = driver.find_elements(By.XPATH, "//*[self::tr or self::li or self::div][contains(., '组播')]")
+def rank_output_path(output_path: str, rank: int) -> str:
+    """m3u/湖北.m3u -> m3u/湖北.rank2.m3u"""
+    base, ext = os.path.splitext(output_path)
+    return f"{base}.rank{rank}{ext}"
 
-        multicast_items = []
-        seen_ip = set()
 
-        for row in candidate_rows:
-            try:
-                row_text = row.text.strip()
-                if not row_text or "组播" not in row_text:
-                    continue
+def select_targets(multicast_items: List[Dict], ranks: List[int]) -> List[Tuple[int, Dict]]:
+    """打印候选列表并取出各目标排名对应的候选；超出范围的排名跳过"""
+    print("  📋 有效组播IP列表（前10个，1=最新）：")
+    for idx, item in enumerate(multicast_items[:10], start=1):
+        mark = "【目标】" if idx in ranks else ""
+        print(f"    第{idx}名：{item['ip']}  状态：{item['status']} {mark}")
 
-                m_ip = ip_pattern_anywhere.search(row_text)
-                if not m_ip:
-                    continue
-                ip = m_ip.group(1)
+    targets = []
+    for rank in ranks:
+        if rank > len(multicast_items):
+            print(f"  ❌ 目标IP排名超出范围：有效={len(multicast_items)}，目标={rank}，跳过")
+            continue
+        target = multicast_items[rank - 1]
+        print(f"  ✅ 选中：第{rank}名 {target['ip']}（{target['status']}）")
+        targets.append((rank, target))
+    return targets
 
-                if ip in seen_ip:
-                    continue
 
-                link_elem = None
-                try:
-                    link_elem = row.find_element(By.XPATH, f".//a[normalize-space(text())='{ip}']")
-                except Exception:
-                    try:
-                        link_elem = row.find_element(By.XPATH, f".//a[contains(normalize-space(.), '{ip}')]")
-                    except Exception:
-                        link_elem = None
+def finish_output(source: Union[str, bytes], path: str, target_ip: str, rank: int) -> bool:
+    """
+    输出阶段：把下载内容（文件路径或原始字节）写到 path 并记录增量状态，返回频道是否有变化
+    - 内容逐字节保留（换行符、属性顺序、注释都不变），只替换盖章行
+    - 同目录临时文件 + os.replace，中途退出不会留下写了一半的输出
+    - 频道集合与现有文件相同（忽略盖章）时不动现有文件，也不写新的 updated_at：不产生提交
+    """
+    stamp = iptv_playlist.format_stamp(target_ip, rank, time.strftime('%Y-%m-%d %H:%M:%S')) if ENABLE_STAMP else None
+    with span("publish"):
+        result = iptv_playlist.publish_playlist(source, path, stamp=stamp)
+        get_state().record(path, target_ip, rank, content_hash=result.digest)
+    iptv_history.note_output(rank, target_ip, result.digest, result.changed)
+    iptv_trace.count("files_changed" if result.changed else "files_unchanged")
+    name = os.path.relpath(path, GITHUB_REPO_PATH)
+    if result.changed:
+        print(f"  💾 已更新：{name}（{result.count} 条）")
+    else:
+        print(f"  ＝ 频道未变化，保留现有文件：{name}")
+    return result.changed
 
-                if not link_elem:
-                    continue
 
-                is_valid, sort_key, status_norm = parse_status(row_text)
-                if not is_valid:
-                    continue
+def multi_rank_merge_enabled() -> bool:
+    return (os.getenv("MULTI_RANK_MERGE") or "0").strip() in ("1", "true", "True")
 
-                seen_ip.add(ip)
-                multicast_items.append({
-                    "ip": ip,
-                    "link": link_elem,
-                    "status": status_norm,
-                    "sort_key": sort_key
-                })
-            except Exception:
-                continue
 
-        print(f"  ✅ 提取到 {len(multicast_items)} 个有效组播IP")
-        if not multicast_items:
-            print("  ❌ 未找到任何有效组播IP，跳过")
-            return False
+def combine_rank_outputs(output_path: str, done: List[Tuple[int, str, str]]):
+    """
+    多排名时生成主文件（保持 m3u/<省>.m3u 订阅地址可用）：
+    - MULTI_RANK_MERGE=1：按排名顺序合并所有成功的 rank 文件（同一频道多个备用源）
+    - 否则：复制排名最靠前的成功文件
+    done：[(rank, source_ip, rank 文件路径)]
+    """
+    done = sorted(done)
+    if not multi_rank_merge_enabled():
+        iptv_playlist.publish_playlist(done[0][2], output_path)
+        return
 
-        multicast_items.sort(key=lambda x: x["sort_key"])
+    first = iptv_playlist.iter_playlist(done[0][2])
+    header = next(first)
+    stamp = iptv_playlist.format_stamp(",".join(ip for _, ip, _ in done), ",".join(str(r) for r, _, _ in done),
+                                       time.strftime('%Y-%m-%d %H:%M:%S'))
 
-        print("  📋 有效组播IP列表（前10个，1=最新）：")
-        for idx, item in enumerate(multicast_items[:10], start=1):
-            mark = "【目标】" if idx == target_ip_rank else ""
-            print(f"    第{idx}名：{item['ip']}  状态：{item['status']} {mark}")
+    def all_channels():
+        yield from first
+        for _, _, path in done[1:]:
+            yield from iptv_playlist.iter_channels(path)
 
-        if target_ip_rank < 1 or target_ip_rank > len(multicast_items):
-            print(f"  ❌ 目标IP排名超出范围：有效={len(multicast_items)}，目标={target_ip_rank}，跳过")
-            return False
+    result = iptv_playlist.publish_channels(output_path, header, all_channels(), stamp=stamp if ENABLE_STAMP else None)
+    print(f"  🔗 合并 {len(done)} 个来源，共 {result.count} 条 -> {output_path}" + ("" if result.changed else "（未变化）"))
 
-        target = multicast_items[target_ip_rank - 1]
-        target_ip = target["ip"]
-        target_link = target["link"]
-        print(f"  ✅ 选中：{target_ip}（{target['status']}）")
 
+def close_extra_windows(driver: webdriver.Chrome):
+    try:
+        if driver and len(driver.window_handles) > 1:
+            main = driver.window_handles[0]
+            for h in driver.window_handles[1:]:
+                try:
+                    driver.switch_to.window(h)
+                    driver.close()
+                except Exception:
+                    pass
+            driver.switch_to.window(main)
+    except Exception:
+        pass
+
+
+def download_target(driver: webdriver.Chrome, target: Dict, rank: int, dest_path: str, budget: WaitBudget,
+                    download_dir: str, navigate_direct: bool,
+                    on_first_page: Optional[Callable[[], None]] = None) -> bool:
+    """
+    步骤4-7：详情页 -> 查看频道列表 -> M3U下载 -> 发布到 dest_path（见 finish_output）
+    - navigate_direct=False：在当前搜索结果页点击该 IP 的链接（模拟点击）
+    - navigate_direct=True：直接打开详情链接（命中缓存 / 同一次搜索的第二个及以后的排名）
+    """
+    target_ip = target["ip"]
+    run_dir = None
+    try:
         print(f"【步骤4】进入IP详情页：{target_ip}")
-        target_link.click()
-        WebDriverWait(driver, ELEMENT_TIMEOUT).until(EC.staleness_of(target_link))
-        time.sleep(FIXED_DELAY * 2)
+        reset_resource_stats(driver)
+        with span("detail_page", ip=target_ip, rank=rank):
+            old_page = driver.find_element(By.TAG_NAME, "html")
+            target_link = None if navigate_direct else find_ip_link(driver, target_ip)
+            site_throttle(target["href"] if iptv_site.is_navigable_href(target["href"]) else None)
+            if target_link is not None:
+                target_link.click()
+            elif iptv_site.is_navigable_href(target["href"]):
+                driver.get(target["href"])
+                if on_first_page:
+                    on_first_page()
+            else:
+                raise Exception(f"未找到 {target_ip} 的详情链接")
+            detail_ready = EC.all_of(EC.staleness_of(old_page), EC.element_to_be_clickable(CHANNEL_LIST_LINK_LOCATOR))
+            detail_ok = adaptive_wait(driver, detail_ready, "详情页", budget)
+            browser_feedback(driver, detail_ok)
+            if not detail_ok:
+                raise Exception("等待IP详情页超时")
+        report_resources(driver, "详情页")
 
         print("【步骤5】点击查看频道列表")
-        channel_btn = WebDriverWait(driver, ELEMENT_TIMEOUT).until(
-            EC.element_to_be_clickable((By.XPATH, "//a[contains(text(), '查看频道列表')]"))
-        )
-        channel_btn.click()
 
-        driver.switch_to.window(driver.window_handles[-1])
-        time.sleep(FIXED_DELAY * 2)
+        known_handles = set(driver.window_handles)
+        block_profile = get_block_profile()
+
+        def channel_page_ready(d):
+            # 频道列表可能在新标签页打开，且新标签出现可能稍晚：每次轮询都切到最新窗口
+            handle = d.window_handles[-1]
+            d.switch_to.window(handle)
+            if handle not in known_handles:
+                # CDP 拦截规则按标签页生效：新标签页补上（其后的子资源与页面内请求都会被拦截）
+                known_handles.add(handle)
+                apply_resource_blocking(d, block_profile)
+            return EC.element_to_be_clickable(M3U_DOWNLOAD_LINK_LOCATOR)(d)
+
+        reset_resource_stats(driver)
+        with span("channel_list"):
+            channel_btn = driver.find_element(*CHANNEL_LIST_LINK_LOCATOR)
+            site_throttle()
+            channel_btn.click()
+            m3u_download_btn = adaptive_wait(driver, channel_page_ready, "频道列表", budget)
+            browser_feedback(driver, m3u_download_btn)
+        if not m3u_download_btn:
+            raise Exception("等待频道列表页超时")
+        report_resources(driver, "频道列表")
+
+        if get_download_mode() == "fetch":
+            href = m3u_download_btn.get_attribute("href") or ""
+            if iptv_site.is_navigable_href(href):
+                print("【步骤6-7】页面内获取M3U（不经过下载目录）")
+                try:
+                    with span("page_fetch", ip=target_ip, rank=rank):
+                        body = fetch_in_page(driver, href, min(IN_PAGE_FETCH_TIMEOUT, budget.remaining()))
+                except Exception as e:
+                    print(f"  ⚠️ {e}，改用点击下载")
+                    iptv_trace.count("fallbacks")
+                else:
+                    if body:
+                        print(f"  ✅ 获取完成（{len(body)} 字节）")
+                        iptv_trace.count("bytes_downloaded", len(body))
+                        # 与下载文件同样原样发布，输出逐字节一致
+                        finish_output(body, dest_path, target_ip, rank)
+                        return True
+                    print("  ⚠️ 页面内获取到空内容，改用点击下载")
+            else:
+                print("  ⚠️ M3U下载链接不是普通地址，改用点击下载")
 
         print("【步骤6】点击M3U下载")
-        before_snapshot = snapshot_m3u_mtimes(GITHUB_REPO_PATH)
-
-        m3u_download_btn = WebDriverWait(driver, ELEMENT_TIMEOUT).until(
-            EC.element_to_be_clickable((By.XPATH, "//a[contains(text(), 'M3U下载')]"))
-        )
-        click_time = time.time()
-        m3u_download_btn.click()
+        run_dir = tempfile.mkdtemp(prefix="iptv_dl_")
+        if set_download_dir(driver, run_dir):
+            # 专用空目录 + 目录事件：文件写完（.crdownload 改名为 .m3u）的瞬间返回
+            with DownloadWatcher(run_dir) as watcher:
+                site_throttle()
+                m3u_download_btn.click()
+                print("【步骤7】等待下载完成")
+                with span("download_wait", mode="inotify" if watcher.event_driven else "poll"):
+                    downloaded = watcher.wait(timeout_sec=180)
+        else:
+            # CDP 不可用：退回对 driver 默认下载目录的快照轮询
+            before_snapshot = snapshot_m3u_mtimes(download_dir)
+            click_time = time.time()
+            site_throttle()
+            m3u_download_btn.click()
+            print("【步骤7】等待下载完成")
+            with span("download_wait", mode="snapshot"):
+                downloaded = wait_for_new_m3u_file(download_dir, before_snapshot, click_time, timeout_sec=180)
 
-        print("【步骤7】等待下载完成")
-        downloaded = wait_for_new_m3u_file(GITHUB_REPO_PATH, before_snapshot, click_time, timeout_sec=180)
         if not downloaded or not os.path.exists(downloaded) or os.path.getsize(downloaded) == 0:
             print("  ❌ 未检测到新的 .m3u 文件，跳过")
             return False
 
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        if os.path.abspath(downloaded) != os.path.abspath(output_path):
-            os.replace(downloaded, output_path)
+        iptv_trace.count("bytes_downloaded", os.path.getsize(downloaded))
+        # 直接从下载位置读取发布（临时目录可能跨文件系统，发布时在输出目录内写临时文件再替换）
+        finish_output(downloaded, dest_path, target_ip, rank)
+        if not run_dir or not os.path.abspath(downloaded).startswith(os.path.abspath(run_dir)):
+            if os.path.abspath(downloaded) != os.path.abspath(dest_path):
+                os.remove(downloaded)
+        return True
+
+    finally:
+        if run_dir:
+            shutil.rmtree(run_dir, ignore_errors=True)
+        close_extra_windows(driver)
+
 
-        if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
-            print("  ❌ 输出文件为空，跳过")
+def extract_m3u(driver: webdriver.Chrome, search_keyword: str, target_ip_rank: Union[int, Sequence[int]],
+                output_path: str, download_dir: str = GITHUB_REPO_PATH,
+                on_first_page: Optional[Callable[[], None]] = None) -> bool:
+    """
+    单次抓取（失败返回 False，方便批量继续）
+    - target_ip_rank：单个排名，或多个排名（如 [1, 2, 3]）：只搜索一次，同一会话里依次下载各排名的播放列表，
+      分别写入 <输出>.rank<N>.m3u，主输出文件见 combine_rank_outputs
+    - download_dir：该 driver 的默认下载目录（需与 make_driver 时一致；并发时每个 worker 各自独立）
+      正常情况下每次下载改用 CDP 指定的专用临时目录，仅在 CDP 不可用时才用它
+    - on_first_page：首页加载完成时回调（用于统计首个请求就绪时间）
+    """
+    ranks = normalize_ranks(target_ip_rank)
+    multi = len(ranks) > 1
+    cache = None
+    from_cache = False
+    try:
+        print(f"\n========== 开始：{search_keyword} -> {os.path.relpath(output_path, GITHUB_REPO_PATH)} ==========")
+
+        budget = WaitBudget()
+
+        cache = get_search_cache()
+        multicast_items = cache.get(search_keyword) if cache else None
+        from_cache = bool(multicast_items) and all(iptv_site.is_navigable_href(x["href"]) for x in multicast_items)
+        if from_cache:
+            print(f"【步骤1-3】命中搜索缓存：{search_keyword}（{len(multicast_items)} 个候选）")
+            iptv_trace.count("search_cache_hits")
+        else:
+            multicast_items = search_multicast_items(driver, search_keyword, budget, on_first_page)
+            if cache:
+                cache.put(search_keyword, multicast_items)
+        multicast_items = precheck_candidates(rank_by_history(multicast_items))
+        iptv_history.note_candidates(search_keyword, multicast_items)
+
+        print(f"  ✅ 提取到 {len(multicast_items)} 个有效组播IP")
+        iptv_trace.count("candidates", len(multicast_items))
+        if not multicast_items:
+            print("  ❌ 未找到任何有效组播IP，跳过")
+            iptv_schedule.mark_failure(iptv_schedule.FAILURE_EMPTY)
             return False
 
-        stamp_m3u(output_path, target_ip, target_ip_rank)
+        done: List[Tuple[int, str, str]] = []
+        on_search_page = not from_cache
+        targets = select_targets(multicast_items, ranks)
+        if not targets:
+            iptv_schedule.mark_failure(iptv_schedule.FAILURE_EMPTY)
+            return False
+        for rank, target in targets:
+            dest = rank_output_path(output_path, rank) if multi else output_path
+            if try_skip_unchanged(dest, target["ip"]):
+                iptv_trace.count("skipped_unchanged")
+                done.append((rank, target["ip"], dest))
+                continue
+            if multi:
+                print(f"  ▶ 第{rank}名 -> {os.path.relpath(dest, GITHUB_REPO_PATH)}")
+            try:
+                ok = download_target(driver, target, rank, dest, budget, download_dir,
+                                     navigate_direct=not on_search_page, on_first_page=on_first_page)
+            except Exception as e:
+                if not multi:
+                    raise
+                print(f"  ❌ 第{rank}名下载异常，跳过：{e}")
+                ok = False
+            # 离开过搜索结果页后，其余排名一律直接打开详情链接（不重新搜索）
+            on_search_page = False
+            if ok:
+                done.append((rank, target["ip"], dest))
+
+        if not done:
+            iptv_schedule.mark_failure(iptv_schedule.FAILURE_ERROR)
+            return False
+        if multi:
+            combine_rank_outputs(output_path, done)
 
-        print(f"✅ 输出成功：{output_path}")
+        print(f"  {budget.report()}")
+        print(f"✅ 输出成功：{output_path}" + (f"（排名 {[r for r, _, _ in sorted(done)]}）" if multi else ""))
         return True
 
     except Exception as e:
         print(f"  ❌ 发生异常，跳过：{e}")
+        iptv_schedule.mark_failure(iptv_schedule.FAILURE_ERROR)
+        if from_cache and cache:
+            # 缓存里的链接可能已失效：作废，下次重新搜索
+            cache.invalidate(search_keyword)
         return False
 
-    finally:
+
+def extract_m3u_http(fetcher: HttpFetcher, search_keyword: str, target_ip_rank: Union[int, Sequence[int]],
+                     output_path: str, on_first_page: Optional[Callable[[], None]] = None) -> bool:
+    """纯 HTTP 抓取（不启动浏览器）；失败返回 False，由调用方决定是否回退浏览器。多排名规则同 extract_m3u"""
+    ranks = normalize_ranks(target_ip_rank)
+    multi = len(ranks) > 1
+    cache = None
+    from_cache = False
+    try:
+        print(f"\n========== 开始（HTTP）：{search_keyword} -> {os.path.relpath(output_path, GITHUB_REPO_PATH)} ==========")
+
+        cache = get_search_cache()
+        multicast_items = cache.get(search_keyword) if cache else None
+        from_cache = bool(multicast_items)
+        if from_cache:
+            print(f"【步骤1-3】命中搜索缓存：{search_keyword}（{len(multicast_items)} 个候选）")
+            iptv_trace.count("search_cache_hits")
+        else:
+            print(f"【步骤1-3】搜索并提取有效组播IP：{search_keyword}")
+            with span("http_search", keyword=search_keyword):
+                multicast_items = fetcher.search(search_keyword)
+            if on_first_page:
+                on_first_page()
+            if cache:
+                cache.put(search_keyword, multicast_items)
+        multicast_items = precheck_candidates(rank_by_history(multicast_items))
+        iptv_history.note_candidates(search_keyword, multicast_items)
+        print(f"  ✅ 提取到 {len(multicast_items)} 个有效组播IP")
+        iptv_trace.count("candidates", len(multicast_items))
+        if not multicast_items:
+            print("  ❌ 未找到任何有效组播IP，跳过")
+            iptv_schedule.mark_failure(iptv_schedule.FAILURE_EMPTY)
+            return False
+
+        done: List[Tuple[int, str, str]] = []
+        targets = select_targets(multicast_items, ranks)
+        if not targets:
+            iptv_schedule.mark_failure(iptv_schedule.FAILURE_EMPTY)
+            return False
+        for rank, target in targets:
+            dest = rank_output_path(output_path, rank) if multi else output_path
+            if try_skip_unchanged(dest, target["ip"]):
+                iptv_trace.count("skipped_unchanged")
+                done.append((rank, target["ip"], dest))
+                continue
+
+            print(f"【步骤4-7】详情页 -> 频道列表 -> M3U下载：{target['href']}")
+            try:
+                with span("http_fetch_m3u", ip=target["ip"], rank=rank):
+                    body = fetcher.fetch_m3u(target["href"])
+            except Exception as e:
+                if not multi:
+                    raise
+                print(f"  ❌ 第{rank}名下载失败，跳过：{e}")
+                continue
+            if on_first_page:
+                on_first_page()
+
+            print(f"  ✅ 下载完成（{len(body)} 字节）")
+            iptv_trace.count("bytes_downloaded", len(body))
+            finish_output(body, dest, target["ip"], rank)
+            done.append((rank, target["ip"], dest))
+
+        if not done:
+            iptv_schedule.mark_failure(iptv_schedule.FAILURE_ERROR)
+            return False
+        if multi:
+            combine_rank_outputs(output_path, done)
+
+        print(f"✅ 输出成功（HTTP）：{output_path}")
+        return True
+
+    except Exception as e:
+        print(f"  ❌ HTTP 抓取失败：{e}")
+        iptv_schedule.mark_failure(iptv_schedule.FAILURE_ERROR)
+        if from_cache and cache:
+            cache.invalidate(search_keyword)
+        return False
+
+
+class FetchContext:
+    """
+    一个 worker 的抓取资源：按需创建 HttpFetcher / Chrome，结束时统一释放
+    - HTTP 成功时不会启动浏览器；auto 模式下只有 HTTP 失败才创建 driver
+    - 可跨多次运行复用（常驻/定时模式），begin_run() 重置“首个请求就绪时间”统计
+    - 复用前检查 driver 会话是否还活着（Chrome / chromedriver 崩溃或被 OOM 杀掉时丢弃，下次用到时重建）
+    - download_dir 为空时自建临时下载目录，close() 时删除
+    """
+
+    def __init__(self, download_dir: Optional[str] = None, backend: Optional[str] = None,
+                 profile_dir: Optional[str] = None):
+        self._owns_download_dir = download_dir is None
+        self.download_dir = download_dir or tempfile.mkdtemp(prefix="iptv_dl_")
+        self.backend = backend or get_fetch_backend()
+        self.profile_dir = profile_dir
+        self._fetcher: Optional[HttpFetcher] = None
+        self._driver: Optional[webdriver.Chrome] = None
+        self.driver_startup_sec: Optional[float] = None
+        self.run_started = time.time()
+        self.ttfr: Optional[float] = None
+        self._driver_started_this_run = False
+
+    @property
+    def fetcher(self) -> HttpFetcher:
+        if self._fetcher is None:
+            self._fetcher = HttpFetcher(HOME_PAGE_URL, timeout=ELEMENT_TIMEOUT)
+        return self._fetcher
+
+    @property
+    def driver(self) -> webdriver.Chrome:
+        if self._driver is None:
+            started = time.time()
+            with span("driver_create"):
+                self._driver = make_driver(download_dir=self.download_dir, profile_dir=self.profile_dir)
+            self.driver_startup_sec = time.time() - started
+            self._driver_started_this_run = True
+        return self._driver
+
+    def begin_run(self):
+        self.run_started = time.time()
+        self.ttfr = None
+        self._driver_started_this_run = False
+        self.check_driver()
+
+    def check_driver(self) -> bool:
+        """已启动的 driver 会话失效时 quit 并丢弃（返回 False），下次访问 .driver 重新创建"""
+        if self._driver is None:
+            return True
         try:
-            if driver and len(driver.window_handles) > 1:
-                main = driver.window_handles[0]
-                for h in driver.window_handles[1:]:
-                    try:
-                        driver.switch_to.window(h)
-                        driver.close()
-                    except Exception:
-                        pass
-                driver.switch_to.window(main)
+            self._driver.title
+            return True
+        except WebDriverException as e:
+            print(f"  ⚠️ 浏览器会话已失效，重新创建：{(e.msg or type(e).__name__).splitlines()[0]}")
+        self.drop_driver()
+        return False
+
+    def drop_driver(self):
+        if self._driver is None:
+            return
+        try:
+            self._driver.quit()
         except Exception:
             pass
+        self._driver = None
+
+    def mark_first_request(self):
+        if self.ttfr is None:
+            self.ttfr = time.time() - self.run_started
+
+    def startup_report(self) -> str:
+        if self.ttfr is None:
+            return "⏱ 本次未发出任何页面请求"
+        if self._driver is None:
+            how = "未启动浏览器"
+        elif self._driver_started_this_run:
+            how = f"含浏览器启动 {self.driver_startup_sec:.1f}s"
+        else:
+            how = "复用已启动的浏览器"
+        return f"⏱ 首个请求就绪 {self.ttfr:.1f}s（{how}）"
+
+    def extract(self, search_keyword: str, target_ip_rank: Union[int, List[int]], output_path: str) -> bool:
+        if self.backend in ("auto", "http"):
+            if extract_m3u_http(self.fetcher, search_keyword, target_ip_rank, output_path,
+                                on_first_page=self.mark_first_request):
+                return True
+            if self.backend == "http":
+                return False
+            print("  ↩️ 回退到浏览器抓取")
+            iptv_trace.count("fallbacks")
+        ok = extract_m3u(self.driver, search_keyword, target_ip_rank, output_path,
+                         download_dir=self.download_dir, on_first_page=self.mark_first_request)
+        if not ok:
+            # 失败可能是浏览器本身挂了：下一个关键词 / 地区换一个新会话
+            self.check_driver()
+        return ok
+
+    def close(self):
+        if self._fetcher is not None:
+            self._fetcher.close()
+            self._fetcher = None
+        self.drop_driver()
+        if self._owns_download_dir:
+            shutil.rmtree(self.download_dir, ignore_errors=True)
 
 
 # ✅ 关键：为每个地区生成“候选关键词列表”，逐个尝试（最稳）
@@ -490,66 +1492,440 @@ def build_keyword_candidates(region: str) -> List[str]:
     return out
 
 
-def run_single(keyword: str, rank: int) -> int:
-    print(f"【模式】单次模式：keyword={keyword} rank={rank}")
+def write_run_report():
+    """运行结束：写 JSON + CSV 报告（RUN_REPORT=路径 可改位置，=0 关闭），TRACE_EXPORT=路径 时另存 Chrome trace"""
+    for line in iptv_trace.TRACER.report_lines() + iptv_ratelimit.get_limiter().report_lines():
+        print(line)
+    report_env = (os.getenv("RUN_REPORT") or "").strip()
+    try:
+        if report_env not in ("0", "false", "False"):
+            json_path = report_env or RUN_REPORT_PATH
+            csv_path = os.path.splitext(json_path)[0] + ".csv"
+            iptv_trace.TRACER.write_report(json_path, csv_path, extra={"rate_limit": iptv_ratelimit.get_limiter().stats()})
+            print(f"【运行报告】{json_path}（{os.path.basename(csv_path)}）")
+        trace_path = (os.getenv("TRACE_EXPORT") or "").strip()
+        if trace_path:
+            iptv_trace.TRACER.write_chrome_trace(trace_path)
+            print(f"【Chrome trace】{trace_path}")
+    except OSError as e:
+        print(f"  ⚠️ 运行报告写入失败：{e}")
+
+
+def run_single(keyword: str, rank: Union[int, List[int]], ctx: Optional[FetchContext] = None) -> int:
+    """单次模式；传入 ctx 时复用（不关闭），否则本次新建并在结束时释放"""
+    print(f"【模式】单次模式：keyword={keyword} rank={rank} backend={get_fetch_backend()}")
     print(f"【输出】{M3U_PATH}")
 
-    driver = None
+    iptv_trace.TRACER.reset()
+    iptv_ratelimit.get_limiter().reset_stats()
+    own_ctx = ctx is None
+    if own_ctx:
+        ctx = FetchContext(download_dir=GITHUB_REPO_PATH, profile_dir=get_profile_dir())
+    ctx.begin_run()
     try:
-        driver = make_driver(download_dir=GITHUB_REPO_PATH)
-        ok = extract_m3u(driver, keyword, rank, M3U_PATH)
+        with iptv_trace.region_scope(keyword), span("region"):
+            ok = ctx.extract(keyword, rank, M3U_PATH)
+        iptv_trace.TRACER.set_result(keyword, ok)
+        print(ctx.startup_report())
         return 0 if ok else 2
     finally:
-        if driver:
-            try:
-                driver.quit()
-            except Exception:
-                pass
+        if own_ctx:
+            ctx.close()
+        flush_search_cache()
+        write_run_report()
 
 
-def run_batch(rank: int) -> int:
+def run_region(ctx: FetchContext, region: str, rank: Union[int, List[int]], tag: str = "",
+               defer: bool = False) -> str:
     """
-    批量模式：每个地区一个文件输出到 m3u/<地区>.m3u
-    ✅ 每个地区会按候选关键词依次尝试，直到成功或全部失败。
+    单个地区：按候选关键词依次尝试，直到成功或全部失败
+    - 启用调度时按历史成功率排序关键词；某个关键词“无结果”就换下一个
+    - defer=True 时遇到超时/异常（可能是临时的）不再当场换词，返回 REGION_RETRY，由批量末尾带退避重试
+    - 每次调用（含补跑）写一条历史记录；异常抛出时按 _batch_worker 的处理记为 RETRY / FAILED
     """
-    print(f"【模式】批量省份模式：rank={rank}")
-    print(f"【输出目录】{OUTPUT_DIR}")
+    out = os.path.join(OUTPUT_DIR, f"{region}.m3u")
+    scheduler = get_scheduler()
+    record = new_history_record(region)
+    status = iptv_schedule.REGION_RETRY if defer else iptv_schedule.REGION_FAILED
+    try:
+        with iptv_history.record_scope(record):
+            status = _run_region_keywords(ctx, region, rank, out, scheduler, tag, defer)
+        return status
+    finally:
+        save_history_record(record, status)
+
+
+def _run_region_keywords(ctx: FetchContext, region: str, rank: Union[int, List[int]], out: str,
+                         scheduler: Optional[iptv_schedule.RetryScheduler], tag: str, defer: bool) -> str:
+    candidates = build_keyword_candidates(region)
+    if scheduler:
+        candidates = scheduler.order_keywords(region, candidates)
+    print(f"\n--- {tag}地区：{region} 关键词候选：{candidates} ---")
+
+    with iptv_trace.region_scope(region), span("region"):
+        for attempt, kw in enumerate(candidates):
+            if attempt:
+                iptv_trace.count("retries")
+            iptv_schedule.clear_failure()
+            if ctx.extract(kw, rank, out):
+                if scheduler:
+                    scheduler.record_attempt(region, kw, True)
+                iptv_trace.TRACER.set_result(region, True)
+                return iptv_schedule.REGION_OK
+            failure = iptv_schedule.take_failure()
+            if scheduler and failure == iptv_schedule.FAILURE_EMPTY:
+                scheduler.record_attempt(region, kw, False)
+            if defer and failure == iptv_schedule.FAILURE_ERROR:
+                iptv_trace.TRACER.set_result(region, False)
+                print(f"  ⏳ {tag}{region} 抓取出错，放到本批末尾重试")
+                return iptv_schedule.REGION_RETRY
+
+    iptv_trace.TRACER.set_result(region, False)
+    print(f"  ❌ {tag}{region} 全部关键词均失败，跳过")
+    return iptv_schedule.REGION_FAILED
+
+
+def _batch_worker(ctx: FetchContext, worker_id: int, regions: "queue.Queue[str]", rank: Union[int, List[int]],
+                  results: Dict[str, str], defer: bool = False):
+    """
+    批量 worker：独占一套抓取资源（HTTP 会话 / Chrome）和一个临时下载目录，从队列里领取地区直到取空。
+    """
+    tag = f"[w{worker_id}] "
+    while True:
+        try:
+            region = regions.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            results[region] = run_region(ctx, region, rank, tag=tag, defer=defer)
+        except Exception as e:
+            print(f"  ❌ {tag}{region} 发生异常：{e}")
+            results[region] = iptv_schedule.REGION_RETRY if defer else iptv_schedule.REGION_FAILED
+
+
+def _run_pool(contexts: List[FetchContext], region_list: List[str], rank: Union[int, List[int]],
+              results: Dict[str, str], defer: bool):
+    """把一批地区分发给各 worker（每个 context 一个线程），全部跑完后返回"""
+    regions: "queue.Queue[str]" = queue.Queue()
+    for region in region_list:
+        regions.put(region)
+    threads = [
+        threading.Thread(target=_batch_worker, args=(ctx, i + 1, regions, rank, results, defer), daemon=True)
+        for i, ctx in enumerate(contexts[:len(region_list)])
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def pipeline_enabled() -> bool:
+    """PIPELINE=1 且后端不是 selenium（流水线只用 HTTP 抓取；auto 时失败的地区再交给浏览器 worker）"""
+    enabled = (os.getenv("PIPELINE") or "0").strip() in ("1", "true", "True")
+    if enabled and get_fetch_backend() == "selenium":
+        print("  ⚠️ PIPELINE=1 需要 FETCH_BACKEND=auto 或 http，当前为 selenium，按普通 worker 运行")
+        return False
+    return enabled
+
+
+class RegionJob:
+    """流水线里流转的一个地区：各阶段依次填充"""
+
+    __slots__ = ("region", "out", "keywords", "keyword", "items", "targets", "bodies", "done", "history")
+
+    def __init__(self, region: str, keywords: List[str]):
+        self.region = region
+        self.out = os.path.join(OUTPUT_DIR, f"{region}.m3u")
+        self.keywords = keywords
+        self.keyword = ""
+        self.items: List[Dict] = []
+        self.targets: List[Tuple[int, Dict, str]] = []      # 待下载：(排名, 候选, 输出路径)
+        self.bodies: List[Tuple[int, str, str, bytes]] = []  # 已下载：(排名, IP, 输出路径, 内容)
+        self.done: List[Tuple[int, str, str]] = []          # 已写出：(排名, IP, 输出路径)
+        self.history = new_history_record(region)
+
+
+def _in_region(job: RegionJob, fn: Callable, *args):
+    """线程池里执行 fn，并把埋点与历史记录归到该地区（二者都是线程局部的，协程之间不能共用）"""
+    with iptv_trace.region_scope(job.region), iptv_history.record_scope(job.history):
+        return fn(*args)
+
+
+def _pipeline_search(fetcher: HttpFetcher, keyword: str) -> List[Dict]:
+    with span("http_search", keyword=keyword):
+        return fetcher.search(keyword)
 
-    driver = None
-    success = 0
-    total = 0
+
+def _pipeline_fetch(fetcher: HttpFetcher, href: str, ip: str, rank: int) -> bytes:
+    with span("http_fetch_m3u", ip=ip, rank=rank):
+        return fetcher.fetch_m3u(href)
+
+
+def run_pipeline_pass(region_list: List[str], rank: Union[int, List[int]], results: Dict[str, str],
+                      defer: bool = False):
+    """
+    流水线模式跑一批地区（HTTP 抓取），结果写入 results（REGION_OK / FAILED / RETRY）
+    - 搜索：按关键词候选依次搜索（命中搜索缓存则不请求），直到有目标排名的结果
+    - 预检：协程里直接并发探测候选IP，按在线与延迟重排，增量模式下判断能否跳过
+    - 下载：详情页 -> 频道列表 -> M3U；与搜索共用一组 HttpFetcher（每个同一时刻只被一个任务使用）
+    - 写出：原子发布 + 记录状态（线程池）；多排名时合并主文件
+    - 对站点的请求经进程内共用的限速器（iptv_ratelimit）
+    """
+    ranks = normalize_ranks(rank)
+    multi = len(ranks) > 1
+    scheduler = get_scheduler()
+    cache = get_search_cache()
+    n_search = _env_int("PIPELINE_SEARCH", DEFAULT_PIPELINE_SEARCH)
+    n_download = _env_int("PIPELINE_DOWNLOAD", DEFAULT_PIPELINE_DOWNLOAD)
+    bucket = iptv_ratelimit.get_limiter().bucket(HOME_PAGE_URL)
+    print(f"【流水线】{len(region_list)} 个地区：搜索×{n_search} 下载×{n_download} "
+          f"限速 {f'{bucket.base_rate:g} 次/秒' if bucket.base_rate > 0 else '不限'}")
+
+    fetchers = [HttpFetcher(HOME_PAGE_URL, timeout=ELEMENT_TIMEOUT) for _ in range(max(n_search, n_download))]
+
+    def finish(job: RegionJob, status: str) -> None:
+        results[job.region] = status
+        save_history_record(job.history, status)
+        iptv_trace.TRACER.set_result(job.region, status == iptv_schedule.REGION_OK)
+        if status == iptv_schedule.REGION_OK:
+            print(f"✅ [{job.region}] 输出成功：{job.out}" + (f"（排名 {[r for r, _, _ in sorted(job.done)]}）" if multi else ""))
+        elif status == iptv_schedule.REGION_RETRY:
+            print(f"  ⏳ [{job.region}] 抓取出错，放到本批末尾重试")
+        else:
+            print(f"  ❌ [{job.region}] 全部关键词均失败，跳过")
+        return None
+
+    async def pipeline():
+        pool: "asyncio.Queue[HttpFetcher]" = asyncio.Queue()
+        for f in fetchers:
+            pool.put_nowait(f)
+
+        async def site_call(job: RegionJob, fn: Callable, *args):
+            # 限速在 HttpFetcher 内部逐个请求进行（在线程池里等待，不阻塞事件循环）
+            fetcher = await pool.get()
+            try:
+                return await asyncio.to_thread(_in_region, job, fn, fetcher, *args)
+            finally:
+                pool.put_nowait(fetcher)
+
+        async def search(job: RegionJob) -> Optional[RegionJob]:
+            for attempt, kw in enumerate(job.keywords):
+                if attempt:
+                    iptv_trace.count("retries", region=job.region)
+                items = cache.get(kw) if cache else None
+                if items:
+                    iptv_trace.count("search_cache_hits", region=job.region)
+                else:
+                    try:
+                        items = await site_call(job, _pipeline_search, kw)
+                    except Exception as e:
+                        print(f"  ❌ [{job.region}] 搜索失败：{kw}：{e}")
+                        if defer:
+                            return finish(job, iptv_schedule.REGION_RETRY)
+                        continue
+                    if cache:
+                        cache.put(kw, items)
+                if not any(r <= len(items) for r in ranks):
+                    print(f"  ∅ [{job.region}] {kw}：有效组播IP {len(items)} 个，没有目标排名，换下一个关键词")
+                    if scheduler:
+                        scheduler.record_attempt(job.region, kw, False)
+                    continue
+                job.keyword, job.items = kw, items
+                return job
+            return finish(job, iptv_schedule.REGION_FAILED)
+
+        async def probe(job: RegionJob) -> Optional[RegionJob]:
+            items = rank_by_history(job.items, job.region)
+            health, elapsed = None, 0.0
+            if precheck_enabled():
+                started = time.perf_counter()
+                try:
+                    health = await iptv_probe.check_hosts_async(precheck_plan(items), timeout=PRECHECK_TIMEOUT)
+                except Exception as e:
+                    print(f"  ⚠️ [{job.region}] 候选IP预检失败，保持原顺序：{e}")
+                elapsed = time.perf_counter() - started
+                iptv_trace.TRACER.add_span("precheck", job.region, started, elapsed, candidates=len(items))
+
+            # 以下打印都是同步的，同一地区的输出不会被其它协程打断
+            print(f"\n--- [{job.region}] 关键词：{job.keyword}（{len(items)} 个有效组播IP）---")
+            if health is not None:
+                items = order_by_health(items, health, elapsed)
+            if job.history:
+                job.history.note_candidates(job.keyword, items)
+            iptv_trace.count("candidates", len(items), region=job.region)
+            for r, target in select_targets(items, ranks):
+                job.targets.append((r, target, rank_output_path(job.out, r) if multi else job.out))
+            job.items = []
+
+            if incremental_enabled():
+                pending = []
+                for r, target, dest in job.targets:
+                    if await asyncio.to_thread(_in_region, job, try_skip_unchanged, dest, target["ip"]):
+                        iptv_trace.count("skipped_unchanged", region=job.region)
+                        job.done.append((r, target["ip"], dest))
+                    else:
+                        pending.append((r, target, dest))
+                job.targets = pending
+            return job
+
+        async def download(job: RegionJob) -> Optional[RegionJob]:
+            for r, target, dest in job.targets:
+                try:
+                    body = await site_call(job, _pipeline_fetch, target["href"], target["ip"], r)
+                except Exception as e:
+                    print(f"  ❌ [{job.region}] 第{r}名下载失败：{e}")
+                    continue
+                iptv_trace.count("bytes_downloaded", len(body), region=job.region)
+                job.bodies.append((r, target["ip"], dest, body))
+            job.targets = []
+            if not job.bodies and not job.done:
+                return finish(job, iptv_schedule.REGION_RETRY if defer else iptv_schedule.REGION_FAILED)
+            return job
+
+        async def post(job: RegionJob) -> None:
+            for r, ip, dest, body in job.bodies:
+                await asyncio.to_thread(_in_region, job, finish_output, body, dest, ip, r)
+                job.done.append((r, ip, dest))
+            job.bodies = []
+            if multi:
+                await asyncio.to_thread(_in_region, job, combine_rank_outputs, job.out, job.done)
+            if scheduler:
+                scheduler.record_attempt(job.region, job.keyword, True)
+            return finish(job, iptv_schedule.REGION_OK)
+
+        def on_error(job: RegionJob, exc: BaseException):
+            print(f"  ❌ [{job.region}] 流水线异常：{exc}")
+            finish(job, iptv_schedule.REGION_RETRY if defer else iptv_schedule.REGION_FAILED)
+
+        jobs = [RegionJob(region, scheduler.order_keywords(region, build_keyword_candidates(region))
+                          if scheduler else build_keyword_candidates(region)) for region in region_list]
+        await iptv_pipeline.run_stages(jobs, [
+            iptv_pipeline.Stage("search", search, n_search),
+            iptv_pipeline.Stage("probe", probe, _env_int("PIPELINE_PROBE", DEFAULT_PIPELINE_PROBE)),
+            iptv_pipeline.Stage("download", download, n_download),
+            iptv_pipeline.Stage("post", post, _env_int("PIPELINE_POST", DEFAULT_PIPELINE_POST)),
+        ], on_error=on_error)
 
     try:
-        driver = make_driver(download_dir=GITHUB_REPO_PATH)
+        asyncio.run(pipeline())
+    finally:
+        for f in fetchers:
+            f.close()
 
-        for region in PROVINCES:
-            total += 1
-            out = os.path.join(OUTPUT_DIR, f"{region}.m3u")
 
-            candidates = build_keyword_candidates(region)
-            print(f"\n--- 地区：{region} 关键词候选：{candidates} ---")
+def make_batch_contexts(workers: int) -> List[FetchContext]:
+    """每个 worker 一套抓取资源：独立临时下载目录；常驻模式下各自独立的浏览器配置目录"""
+    return [FetchContext(profile_dir=get_profile_dir(i + 1 if workers > 1 else None)) for i in range(workers)]
 
-            ok_any = False
-            for kw in candidates:
-                ok = extract_m3u(driver, kw, rank, out)
-                if ok:
-                    ok_any = True
-                    break
 
-            if ok_any:
-                success += 1
-            else:
-                print(f"  ❌ {region} 全部关键词均失败，跳过")
+def run_batch(rank: Union[int, List[int]], contexts: Optional[List[FetchContext]] = None) -> int:
+    """
+    批量模式：每个地区一个文件输出到 m3u/<地区>.m3u
+    ✅ 每个地区会按候选关键词依次尝试，直到成功或全部失败。
+    ✅ BATCH_WORKERS=N 时启动 N 个 worker，地区通过队列分发，各 worker 的下载目录互相隔离。
+    ✅ 传入 contexts 时复用（常驻/定时模式），否则本次新建并在结束时释放。
+    ✅ 调度（SCHEDULER=0 关闭）：连续失败的地区熔断跳过若干轮；超时/异常的地区在本批末尾
+       带抖动退避补跑 RETRY_ROUNDS 轮，不在当场反复耗时。
+    """
+    own_contexts = contexts is None
+    if own_contexts:
+        contexts = make_batch_contexts(get_batch_workers())
+    workers = len(contexts)
+    scheduler = get_scheduler()
+    retry_rounds = _env_int("RETRY_ROUNDS", DEFAULT_RETRY_ROUNDS) if scheduler else 0
+    retry_backoff = _env_int("RETRY_BACKOFF", DEFAULT_RETRY_BACKOFF)
+    use_pipeline = pipeline_enabled()
+    print(f"【模式】批量省份模式：rank={rank} workers={workers} backend={get_fetch_backend()}"
+          + ("  pipeline=1" if use_pipeline else ""))
+    print(f"【输出目录】{OUTPUT_DIR}")
 
-        print(f"\n【批量完成】成功 {success}/{total}")
-        return 0 if success > 0 else 2
+    pending: List[str] = []
+    tripped: List[str] = []
+    for region in PROVINCES:
+        if scheduler and not scheduler.allow(region):
+            print(f"  ⛔ {region} 熔断中，跳过（{scheduler.breaker_info(region)}）")
+            tripped.append(region)
+        else:
+            pending.append(region)
+
+    global _HISTORY_RUN_ID
+    _HISTORY_RUN_ID = time.strftime("%Y%m%d-%H%M%S")
+    results: Dict[str, str] = {}
+    retried: List[str] = []
+    started = time.time()
+    iptv_trace.TRACER.reset()
+    iptv_ratelimit.get_limiter().reset_stats()
+
+    def run_pass(region_list: List[str], defer: bool):
+        if not use_pipeline:
+            _run_pool(contexts, region_list, rank, results, defer)
+            return
+        run_pipeline_pass(region_list, rank, results, defer=defer)
+        left = [r for r in region_list if results.get(r) != iptv_schedule.REGION_OK]
+        if left and get_fetch_backend() == "auto":
+            print(f"\n  ↩️ 流水线未成功的 {len(left)} 个地区交给 worker（可回退浏览器）：{left}")
+            for region in left:
+                iptv_trace.count("fallbacks", region=region)
+            _run_pool(contexts, left, rank, results, defer)
 
+    try:
+        for ctx in contexts:
+            ctx.begin_run()
+        run_pass(pending, defer=retry_rounds > 0)
+        for attempt in range(retry_rounds):
+            deferred = [r for r in pending if results.get(r) == iptv_schedule.REGION_RETRY]
+            if not deferred:
+                break
+            delay = iptv_schedule.backoff_delay(attempt, retry_backoff)
+            print(f"\n【补跑 {attempt + 1}/{retry_rounds}】{len(deferred)} 个地区出错，{delay:.0f}s 后重试：{deferred}")
+            time.sleep(delay)
+            retried.extend(r for r in deferred if r not in retried)
+            run_pass(deferred, defer=attempt + 1 < retry_rounds)
     finally:
-        if driver:
-            try:
-                driver.quit()
-            except Exception:
-                pass
+        for i, ctx in enumerate(contexts, start=1):
+            print(f"  [w{i}] {ctx.startup_report()}")
+        if own_contexts:
+            for ctx in contexts:
+                ctx.close()
+
+    if scheduler:
+        for region in pending:
+            if region in results:
+                scheduler.finish_region(region, results[region] == iptv_schedule.REGION_OK)
+        scheduler.save()
+    flush_search_cache()
+
+    success = sum(1 for region in PROVINCES if results.get(region) == iptv_schedule.REGION_OK)
+    print(f"\n【批量完成】成功 {success}/{len(PROVINCES)}  耗时 {time.time() - started:.1f}s")
+    if tripped or retried:
+        print(f"【调度】熔断跳过 {len(tripped)}：{tripped}  补跑 {len(retried)}："
+              f"{[(r, results.get(r) == iptv_schedule.REGION_OK) for r in retried]}")
+    write_run_report()
+    return 0 if success > 0 else 2
+
+
+def run_daemon(batch: bool, keyword: str, rank: Union[int, List[int]], interval_sec: int) -> int:
+    """
+    定时模式：浏览器 / HTTP 会话只创建一次，每 interval_sec 秒重跑一遍，后续轮次无需冷启动
+    """
+    print(f"【模式】定时模式：每 {interval_sec}s 运行一次（Ctrl+C 退出）")
+    contexts = make_batch_contexts(get_batch_workers()) if batch else [
+        FetchContext(download_dir=GITHUB_REPO_PATH, profile_dir=get_profile_dir())
+    ]
+    code = 0
+    try:
+        while True:
+            started = time.time()
+            code = run_batch(rank, contexts=contexts) if batch else run_single(keyword, rank, ctx=contexts[0])
+            wait = max(0.0, interval_sec - (time.time() - started))
+            print(f"【定时】本轮结束（code={code}），{wait:.0f}s 后开始下一轮")
+            time.sleep(wait)
+    except KeyboardInterrupt:
+        print("【定时】收到中断，退出")
+        return code
+    finally:
+        for ctx in contexts:
+            ctx.close()
 
 
 if __name__ == "__main__":
@@ -559,8 +1935,11 @@ if __name__ == "__main__":
 
     print(f"【路径验证】仓库目录：{GITHUB_REPO_PATH}")
     print(f"【路径验证】是否为Git仓库：{os.path.exists(os.path.join(GITHUB_REPO_PATH, '.git'))}")
-    print(f"【当前配置】BATCH={batch}  HEADLESS={os.getenv('HEADLESS','1')}  rank={rank}")
+    print(f"【当前配置】BATCH={batch}  BATCH_WORKERS={get_batch_workers()}  HEADLESS={os.getenv('HEADLESS','1')}  rank={rank}")
 
+    daemon_env = (os.getenv("DAEMON_INTERVAL") or "").strip()
+    if daemon_env.isdigit() and int(daemon_env) > 0:
+        raise SystemExit(run_daemon(batch, keyword, rank, int(daemon_env)))
     if batch:
         raise SystemExit(run_batch(rank=rank))
     else:
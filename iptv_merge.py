@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_merge.py
+- 把 m3u/<省>.m3u（及 iptv_latest.m3u）流式合并成一个全国播放列表，按频道去重
+- 索引键：规范化后的 tvg-id（没有则用频道名），如 “CCTV1”“CCTV1HD”“cctv-1 高清”“CCTV1综合” 归为同一频道
+- 分组：央视、卫视单独分组；其余频道归入名称对应的省份（如“北京新闻”-> 北京），否则归入排名最靠前的源所在省份
+- 每个频道保留 N 个备用源，按实测延迟（iptv_probe 的探测结果）或新鲜度（文件盖章的 updated_at）排序
+- 单遍扫描、每个频道只保留一个大小为 N 的堆：时间与条目总数成线性，内存只与频道数 × N 有关
+
+用法：
+    python iptv_merge.py                          # 合并 m3u/*.m3u + iptv_latest.m3u -> iptv_national.m3u
+    python iptv_merge.py --by freshness -n 5
+    python iptv_merge.py m3u/湖北.m3u m3u/湖南.m3u --out /tmp/hx.m3u
+"""
+
+import argparse
+import heapq
+import itertools
+import os
+import re
+import sys
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import iptv_playlist
+import iptv_probe
+
+REPO_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INPUT_DIR = os.path.join(REPO_PATH, "m3u")
+DEFAULT_LATEST_PATH = os.path.join(REPO_PATH, "iptv_latest.m3u")
+DEFAULT_OUTPUT_PATH = os.path.join(REPO_PATH, "iptv_national.m3u")
+DEFAULT_ALTERNATIVES = 3
+RANK_MODES = ("latency", "freshness")
+
+GROUP_CCTV = "央视"
+GROUP_SATELLITE = "卫视"
+
+_KEY_STRIP = re.compile(r"[\s\-_·.]+")
+_KEY_SUFFIX = re.compile(r"(?:综合|高清|超清|标清|FHD|HD|SD)+$")
+# 央视频道号之后的中文栏目名一律去掉：CCTV1综合、CCTV4中文国际 -> CCTV1、CCTV4（CCTV4K / CCTV5+ 保留）
+_CCTV_NUMBER = re.compile(r"^(CCTV(?:4K|8K|\d+\+?))(?![0-9A-Z+])")
+_CCTV_PATTERN = re.compile(r"^(?:CCTV|CGTN)")
+_RANK_SUFFIX = re.compile(r"\.rank\d+$")
+
+
+def channel_key(ch: iptv_playlist.Channel) -> str:
+    """
+    规范化索引键：全角转半角、大写、去空白和连字符、去掉“综合/高清/HD”之类的后缀（4K 保留，属于不同频道）；
+    央视只保留频道号
+    """
+    raw = unicodedata.normalize("NFKC", ch.tvg_id or ch.name or "").upper()
+    key = _KEY_STRIP.sub("", raw)
+    m = _CCTV_NUMBER.match(key)
+    if m:
+        return m.group(1)
+    return _KEY_SUFFIX.sub("", key) or key
+
+
+def channel_group(key: str, province: str, fallback: Optional[str]) -> str:
+    if _CCTV_PATTERN.match(key):
+        return GROUP_CCTV
+    if "卫视" in key:
+        return GROUP_SATELLITE
+    return province or fallback or "其他"
+
+
+def home_province(name: str, provinces: Iterable[str]) -> Optional[str]:
+    """频道名以某个来源省份开头（如“北京新闻”与 北京）即视为该省的本地频道"""
+    name = unicodedata.normalize("NFKC", name or "")
+    return max((p for p in provinces if p and name.startswith(p)), key=len, default=None)
+
+
+def province_of(path: str) -> str:
+    """m3u/湖北.m3u、m3u/湖北.rank2.m3u -> 湖北；单次模式输出没有省份"""
+    if os.path.abspath(path) == os.path.abspath(DEFAULT_LATEST_PATH):
+        return ""
+    return _RANK_SUFFIX.sub("", os.path.splitext(os.path.basename(path))[0])
+
+
+def is_rank_file(path: str) -> bool:
+    """多排名模式的附属文件 <省>.rank<N>.m3u（内容与主文件 <省>.m3u 重复或是其备用源）"""
+    return bool(_RANK_SUFFIX.search(os.path.splitext(os.path.basename(path))[0]))
+
+
+def file_freshness(path: str, header: iptv_playlist.PlaylistHeader) -> float:
+    """文件新鲜度：优先用盖章里的 updated_at，没有则用文件修改时间"""
+    updated_at = iptv_playlist.parse_stamp(header.stamp or "").get("updated_at")
+    if updated_at:
+        try:
+            return time.mktime(time.strptime(updated_at, "%Y-%m-%d %H:%M:%S"))
+        except ValueError:
+            pass
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
+class _Slot:
+    """一个频道：展示用的元数据（首次出现的条目）+ 最好的 N 个源（最大堆，堆顶是当前最差的）"""
+
+    __slots__ = ("key", "channel", "heap", "urls")
+
+    def __init__(self, key: str, channel: iptv_playlist.Channel):
+        self.key = key
+        self.channel = channel
+        self.heap: List[Tuple[Tuple[float, ...], iptv_playlist.Channel, str]] = []   # (取反的分数, 条目, 省份)
+        self.urls = set()
+
+    def group(self) -> str:
+        """名称对应的省份优先（只认该频道确实有源来自的省份），否则取排名最靠前的源所在省份"""
+        ranked = sorted(self.heap, reverse=True)
+        provinces = [p for _, _, p in ranked]
+        best = ranked[0][1] if ranked else self.channel
+        province = home_province(self.channel.name, provinces) or next((p for p in provinces if p), "")
+        return channel_group(self.key, province, best.group_title)
+
+
+class NationalMerger:
+    """
+    单遍合并器：add_file() 逐个喂入播放列表，write() 输出
+    - by="latency"：探测通过的源按首字节延迟升序；未探测的排在后面；探测失败的丢弃
+    - by="freshness"：按所在文件的 updated_at 降序（同一文件内保持原顺序）
+    """
+
+    def __init__(self, alternatives: int = DEFAULT_ALTERNATIVES, by: str = "latency",
+                 probe_results: Optional[Dict[str, iptv_probe.ProbeResult]] = None):
+        if by not in RANK_MODES:
+            raise ValueError(f"不支持的排序方式：{by}")
+        self.alternatives = max(1, alternatives)
+        self.by = by
+        self.probe_results = probe_results or {}
+        self.extm3u = ""
+        self.slots: Dict[str, _Slot] = {}   # dict 保持首次出现顺序
+        self.seen = 0
+        self.dropped_dead = 0
+        self._seq = itertools.count()
+
+    def _score(self, ch: iptv_playlist.Channel, freshness: float) -> Optional[Tuple[float, ...]]:
+        """越小越好；None 表示丢弃"""
+        if self.by == "freshness":
+            return (-freshness,)
+        result = self.probe_results.get(ch.url)
+        if result is None or not iptv_probe.is_probeable(ch.url):
+            return (1, 0.0)
+        if not result.ok:
+            return None
+        return (0, result.latency_ms if result.latency_ms is not None else 0.0)
+
+    def add_file(self, path: str):
+        entries = iptv_playlist.iter_playlist(path)
+        header = next(entries)
+        if not self.extm3u and header.extm3u:
+            self.extm3u = header.extm3u
+        province = province_of(path)
+        freshness = file_freshness(path, header) if self.by == "freshness" else 0.0
+        for ch in entries:
+            self.add(ch, province, freshness)
+
+    def add(self, ch: iptv_playlist.Channel, province: str = "", freshness: float = 0.0):
+        self.seen += 1
+        score = self._score(ch, freshness)
+        if score is None:
+            self.dropped_dead += 1
+            return
+        key = channel_key(ch)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = _Slot(key, ch)
+        if ch.url in slot.urls:
+            return
+        # 堆里存取反的分数：堆顶是最差的源，满了以后新源只需和它比较
+        item = (tuple(-x for x in score) + (-next(self._seq),), ch, province)
+        if len(slot.heap) < self.alternatives:
+            heapq.heappush(slot.heap, item)
+            slot.urls.add(ch.url)
+        elif item[0] > slot.heap[0][0]:
+            _, evicted, _ = heapq.heapreplace(slot.heap, item)
+            slot.urls.discard(evicted.url)
+            slot.urls.add(ch.url)
+
+    def iter_output(self) -> Iterable[iptv_playlist.Channel]:
+        """央视、卫视在前，其余按省份首次出现顺序；每个频道的备用源按名次连续输出，元数据统一"""
+        groups: Dict[str, List[_Slot]] = {GROUP_CCTV: [], GROUP_SATELLITE: []}
+        for slot in self.slots.values():
+            groups.setdefault(slot.group(), []).append(slot)
+        for group, slots in groups.items():
+            for slot in slots:
+                meta = slot.channel
+                for _, ch, _ in sorted(slot.heap, reverse=True):
+                    yield iptv_playlist.Channel(meta.name, ch.url, duration=meta.duration, tvg_id=meta.tvg_id,
+                                                tvg_logo=meta.tvg_logo, group_title=group,
+                                                extra_attrs=meta.extra_attrs, options=ch.options)
+
+    def write(self, output_path: str) -> int:
+        header = iptv_playlist.PlaylistHeader(extm3u=self.extm3u or iptv_playlist.EXTM3U)
+        return iptv_playlist.publish_channels(output_path, header, self.iter_output()).count
+
+
+def default_inputs() -> List[str]:
+    files = iptv_playlist.playlist_files(DEFAULT_INPUT_DIR)
+    if os.path.exists(DEFAULT_LATEST_PATH):
+        files.append(DEFAULT_LATEST_PATH)
+    return files
+
+
+def build_national(files: List[str], output_path: str = DEFAULT_OUTPUT_PATH,
+                   alternatives: int = DEFAULT_ALTERNATIVES, by: str = "latency",
+                   results_path: str = iptv_probe.PROBE_RESULTS_PATH) -> int:
+    started = time.time()
+    probe_results = iptv_probe.load_probe_results(results_path) if by == "latency" else {}
+    merger = NationalMerger(alternatives=alternatives, by=by, probe_results=probe_results)
+    for path in files:
+        merger.add_file(path)
+    count = merger.write(output_path)
+    print(f"【合并】{len(files)} 个文件 {merger.seen} 条 -> {len(merger.slots)} 个频道 {count} 条"
+          f"（每频道最多 {merger.alternatives} 个源，按{'延迟' if by == 'latency' else '新鲜度'}"
+          f"，丢弃失效 {merger.dropped_dead}）耗时 {time.time() - started:.2f}s")
+    print(f"【输出】{output_path}")
+    return count
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="合并各省播放列表为去重的全国播放列表")
+    parser.add_argument("files", nargs="*", help="要合并的 .m3u（默认 m3u/*.m3u + iptv_latest.m3u）")
+    parser.add_argument("--out", default=DEFAULT_OUTPUT_PATH, help="输出路径")
+    parser.add_argument("-n", "--alternatives", type=int, default=DEFAULT_ALTERNATIVES, help="每个频道保留的源数")
+    parser.add_argument("--by", choices=RANK_MODES, default="latency", help="备用源排序方式")
+    parser.add_argument("--results", default=iptv_probe.PROBE_RESULTS_PATH, help="探测结果 JSON 路径（--by latency）")
+    args = parser.parse_args(argv)
+
+    files = args.files or default_inputs()
+    if not files:
+        print("❌ 没有可合并的播放列表")
+        return 2
+    count = build_national(files, args.out, alternatives=args.alternatives, by=args.by, results_path=args.results)
+    return 0 if count else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_pipeline.py
+- asyncio 分段流水线：若干个阶段（搜索 -> 预检 -> 下载 -> 写出）用有界队列串起来，每个阶段各自的并发数
+- 一个地区在某阶段等待网络时，其它地区可以在别的阶段继续：不同阶段的等待互相重叠
+- 阶段处理函数是协程；阻塞调用（requests、写文件）由处理函数自己用 asyncio.to_thread 放到线程池
+- 有界队列提供背压：下游慢时上游自动停下，内存里同时在途的地区数有上限
+- 每个阶段统计处理数、忙碌时间、排队等待时间，结束时打印
+- 对站点的限速不在引擎里：各阶段的请求都经过进程内共用的 iptv_ratelimit
+
+引擎本身与站点无关；具体的阶段（用哪个抓取器、怎么写出）由调用方组装，见 iptv_m3u_get_chrome.run_pipeline_pass
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+DEFAULT_QUEUE_FACTOR = 2   # 队列容量 = 下游阶段并发数 × 该系数
+
+_DONE = object()
+
+
+class Stage:
+    """
+    一个阶段：handler(item) 返回交给下一阶段的 item；返回 None 表示该 item 到此结束
+    - handler 抛出的异常交给 on_error(item, exc)，不影响其它 item
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any], Awaitable[Optional[Any]]], concurrency: int = 1):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.processed = 0
+        self.errors = 0
+        self.busy_sec = 0.0
+        self.queue_wait_sec = 0.0
+
+    def report(self, elapsed: float) -> str:
+        util = self.busy_sec / (elapsed * self.concurrency) if elapsed > 0 else 0.0
+        return (f"{self.name:<10s} 并发 {self.concurrency:<3d} 处理 {self.processed:<4d} 忙碌 {self.busy_sec:7.2f}s "
+                f"（利用率 {util:4.0%}） 排队 {self.queue_wait_sec:7.2f}s" + (f" 出错 {self.errors}" if self.errors else ""))
+
+
+async def run_stages(items: Iterable[Any], stages: List[Stage],
+                     on_error: Optional[Callable[[Any, BaseException], None]] = None,
+                     queue_factor: int = DEFAULT_QUEUE_FACTOR) -> Dict[str, float]:
+    """把 items 依次送入各阶段，全部处理完返回；返回值为各阶段忙碌时间（秒）"""
+    queues = [asyncio.Queue(maxsize=max(1, s.concurrency * queue_factor)) for s in stages]
+    started = time.monotonic()
+
+    async def feed():
+        for item in items:
+            await queues[0].put((item, time.monotonic()))
+        for _ in range(stages[0].concurrency):
+            await queues[0].put((_DONE, 0.0))
+
+    async def worker(index: int):
+        stage = stages[index]
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(stages) else None
+        while True:
+            item, queued_at = await inbox.get()
+            if item is _DONE:
+                return
+            stage.queue_wait_sec += time.monotonic() - queued_at
+            t0 = time.monotonic()
+            try:
+                result = await stage.handler(item)
+            except Exception as e:
+                stage.errors += 1
+                result = None
+                if on_error:
+                    on_error(item, e)
+            finally:
+                stage.busy_sec += time.monotonic() - t0
+                stage.processed += 1
+            if result is not None and outbox is not None:
+                await outbox.put((result, time.monotonic()))
+
+    async def run_stage(index: int):
+        await asyncio.gather(*(worker(index) for _ in range(stages[index].concurrency)))
+        # 本阶段全部 worker 退出后，通知下一阶段的每个 worker 结束
+        if index + 1 < len(stages):
+            for _ in range(stages[index + 1].concurrency):
+                await queues[index + 1].put((_DONE, 0.0))
+
+    await asyncio.gather(feed(), *(run_stage(i) for i in range(len(stages))))
+    elapsed = time.monotonic() - started
+    for s in stages:
+        print(f"  ⛓ {s.report(elapsed)}")
+    return {s.name: s.busy_sec for s in stages}
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_playlist.py
+- 流式 M3U 解析：逐行读取，按条目产出紧凑的频道记录（Channel，__slots__）
+- 不把整个文件读进内存；条目的 #EXTINF 原文、条目内指令行、条目之后的注释 / 未知行都原样保留，写回时不丢内容
+- 盖章（# source_ip=...）的解析 / 生成也在这里，供盖章、合并、校验、导出等下游步骤共用
+- 输出统一走 publish_*：临时文件 + os.replace，频道没变就不碰现有文件
+  * 下载所得的播放列表用 publish_playlist 原样发布（字节不变，只替换盖章行）；解析结果只用来算频道摘要
+  * 合并、过滤等派生输出用 publish_channels 由频道记录生成
+
+典型条目：
+    #EXTINF:-1 tvg-id="CCTV1" tvg-logo="..." group-title="湖北电信组播",CCTV1
+    http://27.18.31.67:8888/rtp/239.254.96.96:8550
+"""
+
+import hashlib
+import io
+import os
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+EXTM3U = "#EXTM3U"
+EXTINF = "#EXTINF:"
+STAMP_PREFIX = "# source_ip="
+
+# 新建的条目（非解析所得）输出时常见属性按固定顺序，其余属性保持原顺序追加在后面
+KNOWN_ATTRS = (("tvg-id", "tvg_id"), ("tvg-logo", "tvg_logo"), ("group-title", "group_title"))
+# key="value" / key='value' / key=value
+_ATTR_PATTERN = re.compile(r"""([A-Za-z0-9_-]+)=(?:"([^"]*)"|'([^']*)'|([^\s"',]*))""")
+# udpxy 风格：http://<host>:<port>/rtp/<组播地址>:<组播端口>（也兼容 /udp/）
+_UDPXY_PATTERN = re.compile(r'^[a-z]+://([^/:]+)(?::(\d+))?/(?:rtp|udp)/(\d{1,3}(?:\.\d{1,3}){3}):(\d+)', re.I)
+_STAMP_PATTERN = re.compile(r'([a-z_]+)=(\S+(?: \d{2}:\d{2}:\d{2})?)')
+
+
+class Channel:
+    """
+    单个频道条目（#EXTINF + 可选指令行 + URL + 之后到下一条目之前的注释 / 未知行）
+    - raw_extinf：解析所得条目的 #EXTINF 原文，输出时原样写回（属性顺序、引号风格不变）；新建条目为 None，按字段生成
+    - trailing：条目之后、下一个 #EXTINF 之前的其它行（注释、无法识别的行、没有 URL 的残缺条目），原样保留
+    """
+
+    __slots__ = ("duration", "tvg_id", "tvg_logo", "group_title", "name", "url",
+                 "host", "port", "mcast_group", "rtp_port", "extra_attrs", "options", "raw_extinf", "trailing")
+
+    def __init__(self, name: str, url: str, duration: str = "-1", tvg_id: Optional[str] = None,
+                 tvg_logo: Optional[str] = None, group_title: Optional[str] = None,
+                 extra_attrs: Tuple[Tuple[str, str], ...] = (), options: Tuple[str, ...] = (),
+                 raw_extinf: Optional[str] = None, trailing: Tuple[str, ...] = ()):
+        self.duration = duration
+        self.tvg_id = tvg_id
+        self.tvg_logo = tvg_logo
+        self.group_title = group_title
+        self.name = name
+        self.extra_attrs = extra_attrs
+        self.options = options
+        self.raw_extinf = raw_extinf
+        self.trailing = trailing
+        self.set_url(url)
+
+    def set_url(self, url: str):
+        self.url = url
+        m = _UDPXY_PATTERN.match(url)
+        if m:
+            self.host = m.group(1)
+            self.port = int(m.group(2)) if m.group(2) else 80
+            self.mcast_group = m.group(3)
+            self.rtp_port = int(m.group(4))
+        else:
+            self.host = None
+            self.port = None
+            self.mcast_group = None
+            self.rtp_port = None
+
+    def extinf(self) -> str:
+        if self.raw_extinf is not None:
+            return self.raw_extinf
+        parts = [f"{EXTINF}{self.duration}"]
+        for attr, slot in KNOWN_ATTRS:
+            value = getattr(self, slot)
+            if value is not None:
+                parts.append(_format_attr(attr, value))
+        parts.extend(_format_attr(k, v) for k, v in self.extra_attrs)
+        return " ".join(parts) + f",{self.name}"
+
+    def to_m3u(self) -> str:
+        """条目文本（含结尾换行）"""
+        return "\n".join((self.extinf(),) + self.options + (self.url,) + self.trailing) + "\n"
+
+    def __repr__(self):
+        return f"Channel({self.name!r}, {self.url!r})"
+
+
+class PlaylistHeader:
+    """文件头：#EXTM3U 行（可能为空）、盖章行、其它注释行"""
+
+    __slots__ = ("extm3u", "stamp", "comments")
+
+    def __init__(self, extm3u: str = "", stamp: Optional[str] = None, comments: Tuple[str, ...] = ()):
+        self.extm3u = extm3u
+        self.stamp = stamp
+        self.comments = comments
+
+    def to_m3u(self, stamp: Optional[str] = None) -> str:
+        """stamp 不为 None 时替换原盖章；盖章固定写在 #EXTM3U 之后（无 #EXTM3U 时写在最前）"""
+        stamp = self.stamp if stamp is None else stamp
+        lines = [ln for ln in (self.extm3u, stamp) if ln] + list(self.comments)
+        return "".join(ln + "\n" for ln in lines)
+
+
+def _format_attr(key: str, value: str) -> str:
+    return f"{key}='{value}'" if '"' in value else f'{key}="{value}"'
+
+
+def split_extinf(body: str) -> Tuple[str, str]:
+    """
+    '#EXTINF:' 之后的部分 -> (时长与属性, 名称)
+    名称从属性区之后第一个不在引号内的逗号开始（名称本身可以含逗号）；只有紧跟在 = 后的引号才算属性值的引号
+    """
+    quote = None
+    for i, ch in enumerate(body):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "\"'" and i and body[i - 1] == "=":
+            quote = ch
+        elif ch == ",":
+            return body[:i], body[i + 1:]
+    return body, ""
+
+
+def parse_extinf(line: str) -> Tuple[str, dict, List[Tuple[str, str]], str]:
+    """#EXTINF 行 -> (duration, 已知属性 {slot: value}, 其它属性 [(k, v)], 名称)"""
+    meta, name = split_extinf(line[len(EXTINF):])
+
+    duration = (meta.split(None, 1) or ["-1"])[0]
+    known = {}
+    extra = []
+    slots = dict(KNOWN_ATTRS)
+    for key, dq, sq, bare in _ATTR_PATTERN.findall(meta):
+        value = dq or sq or bare
+        if key in slots:
+            known[slots[key]] = value
+        else:
+            extra.append((key, value))
+    return duration, known, extra, name.strip()
+
+
+def parse_stamp(line: str) -> dict:
+    """'# source_ip=1.2.3.4 rank=1 updated_at=2026-01-16 00:47:20' -> {source_ip, rank, updated_at}"""
+    if not line.startswith(STAMP_PREFIX):
+        return {}
+    return dict(_STAMP_PATTERN.findall(line[2:]))
+
+
+def format_stamp(source_ip: str, rank: int, updated_at: str) -> str:
+    return f"{STAMP_PREFIX}{source_ip} rank={rank} updated_at={updated_at}"
+
+
+def iter_lines(source: Union[str, Iterable[str]]) -> Iterator[str]:
+    """文件路径或行序列 -> 去掉换行符的行（文件按 UTF-8 读取，忽略非法字节，兼容 BOM）"""
+    if isinstance(source, str):
+        with open(source, "r", encoding="utf-8-sig", errors="ignore") as f:
+            for line in f:
+                yield line.rstrip("\r\n")
+    else:
+        for line in source:
+            yield line.rstrip("\r\n")
+
+
+def iter_playlist(source: Union[str, Iterable[str]]) -> Iterator[Union[PlaylistHeader, Channel]]:
+    """
+    流式解析：第一个产出一定是 PlaylistHeader，之后逐个产出 Channel
+    - 第一个 #EXTINF 之前的其它行（注释、未知行）归入文件头；#EXTINF 与 URL 之间的 # 指令行（如 #EXTVLCOPT）归入该条目
+    - URL 之后、下一个 #EXTINF 之前的行（注释、未知行）归入前一个条目的 trailing；
+      没有 URL 的残缺条目也按原文放进去（在第一个条目之前则归入文件头），不丢任何非空行
+    - 条目要等到下一个完整条目（或文件结束）才产出，以便收齐它后面的行
+    """
+    header = PlaylistHeader()
+    comments: List[str] = []
+    header_done = False      # 已遇到第一个 #EXTINF
+    header_yielded = False
+    pending: Optional[Tuple[str, Tuple[str, dict, List[Tuple[str, str]], str]]] = None
+    options: List[str] = []
+    last: Optional[Channel] = None
+    trailing: List[str] = []
+
+    def loose(lines: List[str]):
+        # 不属于任何完整条目的行：归入前一个条目，没有前一个条目时归入文件头
+        (trailing if last is not None else comments).extend(lines)
+
+    def flush_last() -> Optional[Channel]:
+        nonlocal last, trailing
+        ch, last = last, None
+        if ch is not None:
+            ch.trailing = tuple(trailing)
+        trailing = []
+        return ch
+
+    for line in iter_lines(source):
+        if not line.strip():
+            continue
+        if line.startswith(EXTINF):
+            if pending is not None:
+                loose([pending[0]] + options)
+            header_done = True
+            pending = (line, parse_extinf(line))
+            options = []
+        elif pending is not None:
+            if line.startswith("#"):
+                options.append(line)
+                continue
+            done = flush_last()
+            if not header_yielded:
+                header.comments = tuple(comments)
+                header_yielded = True
+                yield header
+            if done is not None:
+                yield done
+            raw, (duration, known, extra, name) = pending
+            last = Channel(name, line.strip(), duration=duration, extra_attrs=tuple(extra),
+                           options=tuple(options), raw_extinf=raw, **known)
+            pending = None
+        elif not header_done:
+            if line.startswith(EXTM3U) and not header.extm3u:
+                header.extm3u = line
+            elif line.startswith(STAMP_PREFIX) and header.stamp is None:
+                header.stamp = line
+            else:
+                comments.append(line)
+        else:
+            loose([line])
+
+    if pending is not None:
+        loose([pending[0]] + options)
+    done = flush_last()
+    if not header_yielded:
+        header.comments = tuple(comments)
+        yield header
+    if done is not None:
+        yield done
+
+
+def read_header(source: Union[str, Iterable[str]]) -> PlaylistHeader:
+    """只读文件头（读到第一个条目即停）"""
+    return next(iter_playlist(source))
+
+
+def iter_channels(source: Union[str, Iterable[str]]) -> Iterator[Channel]:
+    """只要频道条目"""
+    it = iter_playlist(source)
+    next(it)
+    yield from it
+
+
+def write_playlist(f, header: PlaylistHeader, channels: Iterable[Channel], stamp: Optional[str] = None) -> int:
+    """写出整个播放列表（f 为文本文件对象），返回写出的频道数"""
+    f.write(header.to_m3u(stamp))
+    count = 0
+    for ch in channels:
+        f.write(ch.to_m3u())
+        count += 1
+    return count
+
+
+class PublishResult:
+    __slots__ = ("changed", "digest", "count")
+
+    def __init__(self, changed: bool, digest: str, count: int):
+        self.changed = changed
+        self.digest = digest
+        self.count = count
+
+
+def publish_channels(output_path: str, header: PlaylistHeader, channels: Iterable[Channel],
+                     stamp: Optional[str] = None) -> PublishResult:
+    """
+    原子、最小变更地输出播放列表：
+    - 边写同目录临时文件边计算频道摘要（与 channels_digest 一致，忽略文件头和盖章）
+    - 摘要与现有文件相同：丢弃临时文件，现有文件（连同盖章里的 updated_at）原样保留，不产生 diff
+    - 不同才 os.replace 覆盖；进程中途退出只会留下 .tmp，不会出现写了一半的输出
+    """
+    old_digest = channels_digest(output_path) if os.path.exists(output_path) else None
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    h = hashlib.sha1()
+    count = 0
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(header.to_m3u(stamp))
+            for ch in channels:
+                text = ch.to_m3u()
+                h.update(text.encode("utf-8"))
+                f.write(text)
+                count += 1
+        digest = h.hexdigest()
+        if digest == old_digest:
+            os.remove(tmp_path)
+            return PublishResult(False, digest, count)
+        os.replace(tmp_path, output_path)
+        return PublishResult(True, digest, count)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _raw_lines(source: Union[str, bytes, Iterable[str]]) -> Iterator[bytes]:
+    """文件路径 / 原始字节 / 文本行 -> 带原换行符的字节行"""
+    if isinstance(source, bytes):
+        yield from io.BytesIO(source)
+    elif isinstance(source, str):
+        with open(source, "rb") as f:
+            yield from f
+    else:
+        for line in source:
+            yield (line if line.endswith("\n") else line + "\n").encode("utf-8")
+
+
+def restamp_lines(lines: Iterable[bytes], stamp: Optional[str]) -> Iterator[bytes]:
+    """
+    只替换盖章：去掉第一个 #EXTINF 之前的旧盖章行，把新盖章写在 #EXTM3U 之后（没有 #EXTM3U 时写在最前）；
+    其余字节（BOM、换行符、属性顺序、注释）原样保留。stamp 为 None 时不做任何改动
+    """
+    if stamp is None:
+        yield from lines
+        return
+    in_header = True
+    first = True
+    for raw in lines:
+        if first:
+            first = False
+            bom = b"\xef\xbb\xbf" if raw.startswith(b"\xef\xbb\xbf") else b""
+            eol = b"\r\n" if raw.endswith(b"\r\n") else b"\n"
+            stamp_line = stamp.encode("utf-8") + eol
+            if raw[len(bom):].startswith(EXTM3U.encode()):
+                yield raw if raw.endswith(b"\n") else raw + eol
+                yield stamp_line
+                continue
+            yield bom + stamp_line
+            raw = raw[len(bom):]
+        if in_header:
+            if raw.startswith(EXTINF.encode()):
+                in_header = False
+            elif raw.startswith(STAMP_PREFIX.encode()):
+                continue
+        yield raw
+    if first:
+        yield stamp.encode("utf-8") + b"\n"
+
+
+def publish_playlist(source: Union[str, bytes, Iterable[str]], output_path: str,
+                     stamp: Optional[str] = None) -> PublishResult:
+    """
+    把 source（文件路径、下载的原始字节或文本行）原样发布到 output_path，只替换盖章（stamp 为 None 时保留原盖章）
+    - 频道摘要由同一份内容解析得出（与 channels_digest 一致），摘要没变则不动现有文件
+    """
+    old_digest = channels_digest(output_path) if os.path.exists(output_path) else None
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            def written() -> Iterator[str]:
+                for raw in restamp_lines(_raw_lines(source), stamp):
+                    f.write(raw)
+                    yield raw.decode("utf-8", "ignore").lstrip("\ufeff")
+            lines = written()
+            h = hashlib.sha1()
+            count = 0
+            for ch in iter_channels(lines):
+                h.update(ch.to_m3u().encode("utf-8"))
+                count += 1
+            for _ in lines:
+                pass
+        digest = h.hexdigest()
+        if digest == old_digest:
+            os.remove(tmp_path)
+            return PublishResult(False, digest, count)
+        os.replace(tmp_path, output_path)
+        return PublishResult(True, digest, count)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def channels_digest(source: Union[str, Iterable[str]]) -> str:
+    """频道集合的内容摘要（忽略文件头和盖章），用于判断“频道是否真的变了”"""
+    h = hashlib.sha1()
+    for ch in iter_channels(source):
+        h.update(ch.to_m3u().encode("utf-8"))
+    return h.hexdigest()
+
+
+def playlist_files(directory: str) -> List[str]:
+    """目录下的 .m3u 文件（按文件名排序）"""
+    try:
+        names = sorted(n for n in os.listdir(directory) if n.lower().endswith(".m3u"))
+    except OSError:
+        return []
+    return [os.path.join(directory, n) for n in names]
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_probe.py
+- 并发探测播放列表里的 udpxy 流地址是否能出数据（asyncio，纯标准库）
+- 全局并发上限 + 每主机并发上限（家用 udpxy 盒子同时连接数很少）
+- 首字节超时（TTFB）很短；拿到首字节后再采样一小段时间计算码率
+- 同一主机连接失败（拒绝/超时）即判定整台主机不可用，其余地址不再逐个尝试
+- 输出：过滤掉失效条目的播放列表 + 探测结果 JSON（供合并、服务等下游使用）
+- 只探测 http:// 地址；rtp://、https:// 等其它地址不探测（没有结果），过滤输出时原样保留
+
+用法：
+    python iptv_probe.py                       # 探测 m3u/*.m3u，输出到 m3u_alive/
+    python iptv_probe.py m3u/湖北.m3u --ttfb 1.5 --concurrency 800
+    python iptv_probe.py --fake-udpxy 18888    # 启动本地假 udpxy（测试用）
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.parse
+from typing import Dict, Iterable, List, Optional
+
+import iptv_playlist
+
+REPO_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INPUT_DIR = os.path.join(REPO_PATH, "m3u")
+DEFAULT_OUTPUT_DIR = os.path.join(REPO_PATH, "m3u_alive")
+PROBE_RESULTS_PATH = os.path.join(REPO_PATH, ".cache", "probe_results.json")
+
+DEFAULT_CONCURRENCY = 500
+DEFAULT_PER_HOST = 8
+DEFAULT_TTFB = 2.0        # 连接 + 首字节的总期限（秒）
+DEFAULT_SAMPLE = 0.3      # 首字节之后的采样时长（秒）
+DEFAULT_CONNECT_TIMEOUT = 1.5
+SAMPLE_MAX_BYTES = 256 * 1024
+USER_AGENT = "Mozilla/5.0 (iptv-probe)"
+
+
+def is_probeable(url: str) -> bool:
+    """能探测的地址（http://host[:port]/...）；其它地址视为“未探测”，下游一律保留"""
+    parts = urllib.parse.urlsplit(url)
+    return parts.scheme.lower() == "http" and bool(parts.hostname)
+
+
+class ProbeResult:
+    __slots__ = ("url", "ok", "status", "latency_ms", "bps", "error", "checked_at")
+
+    def __init__(self, url: str, ok: bool = False, status: int = 0, latency_ms: Optional[float] = None,
+                 bps: float = 0.0, error: str = "", checked_at: Optional[float] = None):
+        self.url = url
+        self.ok = ok
+        self.status = status
+        self.latency_ms = latency_ms
+        self.bps = bps
+        self.error = error
+        self.checked_at = checked_at if checked_at is not None else time.time()
+
+    def to_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__ if k != "url"}
+
+    @classmethod
+    def from_dict(cls, url: str, d: dict) -> "ProbeResult":
+        return cls(url, **{k: d.get(k) for k in cls.__slots__ if k != "url" and k in d})
+
+
+class StreamProber:
+    """
+    一次探测会话：共享全局 / 每主机并发限制和“主机不可用”缓存
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, per_host: int = DEFAULT_PER_HOST,
+                 ttfb: float = DEFAULT_TTFB, sample: float = DEFAULT_SAMPLE,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.ttfb = ttfb
+        self.sample = sample
+        self.connect_timeout = min(connect_timeout, ttfb)
+        self._global: Optional[asyncio.Semaphore] = None
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        self._dead_hosts: Dict[str, str] = {}
+
+    def _host_sem(self, key: str) -> asyncio.Semaphore:
+        sem = self._hosts.get(key)
+        if sem is None:
+            sem = self._hosts[key] = asyncio.Semaphore(self.per_host)
+        return sem
+
+    async def probe(self, url: str) -> ProbeResult:
+        parts = urllib.parse.urlsplit(url)
+        if not is_probeable(url):
+            return ProbeResult(url, error=f"unsupported scheme: {parts.scheme}")
+        host, port = parts.hostname, parts.port or 80
+        key = f"{host}:{port}"
+
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.concurrency)
+
+        async with self._host_sem(key):
+            if key in self._dead_hosts:
+                return ProbeResult(url, error=f"host down: {self._dead_hosts[key]}")
+            async with self._global:
+                return await self._probe_once(url, key, host, port, parts)
+
+    async def _probe_once(self, url, key, host, port, parts) -> ProbeResult:
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        started = time.monotonic()
+        writer = None
+        try:
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.connect_timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                # 连不上说明整台 udpxy 不可用，同主机其余地址直接判死
+                self._dead_hosts[key] = type(e).__name__
+                return ProbeResult(url, error=f"connect: {type(e).__name__}")
+
+            writer.write((f"GET {path} HTTP/1.0\r\nHost: {host}:{port}\r\n"
+                          f"User-Agent: {USER_AGENT}\r\nConnection: close\r\n\r\n").encode("latin-1"))
+            await writer.drain()
+
+            remaining = self.ttfb - (time.monotonic() - started)
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), max(0.01, remaining))
+            status_line = head.split(b"\r\n", 1)[0].decode("latin-1", "replace")
+            try:
+                status = int(status_line.split()[1])
+            except (IndexError, ValueError):
+                return ProbeResult(url, error=f"bad status line: {status_line[:60]}")
+            if status != 200:
+                return ProbeResult(url, status=status, error=f"http {status}")
+
+            remaining = self.ttfb - (time.monotonic() - started)
+            first = await asyncio.wait_for(reader.read(65536), max(0.01, remaining))
+            if not first:
+                return ProbeResult(url, status=status, error="empty body")
+            latency_ms = (time.monotonic() - started) * 1000
+
+            received = len(first)
+            sample_started = time.monotonic()
+            sample_deadline = sample_started + self.sample
+            while received < SAMPLE_MAX_BYTES:
+                remaining = sample_deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    chunk = await asyncio.wait_for(reader.read(65536), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if not chunk:
+                    break
+                received += len(chunk)
+            elapsed = max(time.monotonic() - sample_started, 1e-3)
+            return ProbeResult(url, ok=True, status=status, latency_ms=round(latency_ms, 1),
+                               bps=round(received / elapsed, 1))
+        except asyncio.TimeoutError:
+            return ProbeResult(url, error="ttfb timeout")
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            return ProbeResult(url, error=type(e).__name__)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    async def probe_many(self, urls: Iterable[str]) -> Dict[str, ProbeResult]:
+        unique = list(dict.fromkeys(urls))
+        results = await asyncio.gather(*(self.probe(u) for u in unique))
+        return {r.url: r for r in results}
+
+
+def probe_urls(urls: Iterable[str], **kwargs) -> Dict[str, ProbeResult]:
+    """同步入口：探测一批 URL"""
+    return asyncio.run(StreamProber(**kwargs).probe_many(urls))
+
+
+def load_probe_results(path: str = PROBE_RESULTS_PATH) -> Dict[str, ProbeResult]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {url: ProbeResult.from_dict(url, d) for url, d in data.items()}
+
+
+def save_probe_results(results: Dict[str, ProbeResult], path: str = PROBE_RESULTS_PATH, merge: bool = True):
+    """保存探测结果（默认与已有结果合并，新结果覆盖旧结果）"""
+    merged = load_probe_results(path) if merge else {}
+    merged.update(results)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({url: r.to_dict() for url, r in merged.items()}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def write_filtered(src: str, dst: str, results: Dict[str, ProbeResult]) -> int:
+    """把 src 中探测通过的条目写到 dst（不可探测的地址原样保留），返回保留条数"""
+    entries = iptv_playlist.iter_playlist(src)
+    header = next(entries)
+    alive = (ch for ch in entries if not is_probeable(ch.url) or (ch.url in results and results[ch.url].ok))
+    return iptv_playlist.publish_channels(dst, header, alive).count
+
+
+def probe_playlists(files: List[str], output_dir: Optional[str], **kwargs) -> Dict[str, ProbeResult]:
+    urls = [ch.url for path in files for ch in iptv_playlist.iter_channels(path)]
+    probeable = [u for u in urls if is_probeable(u)]
+    started = time.time()
+    results = probe_urls(probeable, **kwargs)
+    elapsed = time.time() - started
+
+    alive = sum(1 for r in results.values() if r.ok)
+    skipped = len(set(urls)) - len(set(probeable))
+    print(f"【探测】{len(results)} 个地址，可用 {alive}，耗时 {elapsed:.1f}s"
+          + (f"；{skipped} 个非 http 地址未探测（保留）" if skipped else ""))
+
+    if output_dir:
+        for path in files:
+            dst = os.path.join(output_dir, os.path.basename(path))
+            kept = write_filtered(path, dst, results)
+            print(f"  {os.path.basename(path)}：保留 {kept} 条 -> {os.path.relpath(dst, REPO_PATH)}")
+    return results
+
+
+# ===================== 主机级预检（候选组播IP是否在线）=====================
+# 常见 udpxy 端口（默认不探测，需要时用 known_ports(common=True) 或 PRECHECK_PORTS 显式指定）
+COMMON_UDPXY_PORTS = (4000, 4022, 8888, 8188, 5555, 2222, 8000, 8822, 8383, 9000, 8848, 9088, 7777, 8686,
+                      55555, 7788, 9991, 8080, 1234)
+
+
+class HostHealth:
+    __slots__ = ("ip", "port", "alive", "udpxy", "latency_ms")
+
+    def __init__(self, ip: str, port: Optional[int] = None, alive: bool = False, udpxy: bool = False,
+                 latency_ms: Optional[float] = None):
+        self.ip = ip
+        self.port = port
+        self.alive = alive
+        self.udpxy = udpxy
+        self.latency_ms = latency_ms
+
+    def rank_key(self):
+        """越小越好：确认是 udpxy < 端口可连 < 不通；同级按延迟"""
+        level = 0 if self.udpxy else (1 if self.alive else 2)
+        return (level, self.latency_ms if self.latency_ms is not None else float("inf"))
+
+
+async def _check_port(ip: str, port: int, timeout: float) -> HostHealth:
+    """TCP 连接 + GET /status：连上算在线，/status 有 HTTP 响应算确认是 udpxy；延迟取首个响应时间"""
+    started = time.monotonic()
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+        connect_ms = (time.monotonic() - started) * 1000
+        writer.write(f"GET /status HTTP/1.0\r\nHost: {ip}:{port}\r\nUser-Agent: {USER_AGENT}\r\n\r\n"
+                     .encode("latin-1"))
+        await writer.drain()
+        try:
+            head = await asyncio.wait_for(reader.read(16), max(0.01, timeout - (time.monotonic() - started)))
+        except (asyncio.TimeoutError, OSError):
+            head = b""
+        if head.startswith(b"HTTP/"):
+            return HostHealth(ip, port, alive=True, udpxy=True,
+                              latency_ms=round((time.monotonic() - started) * 1000, 1))
+        return HostHealth(ip, port, alive=True, latency_ms=round(connect_ms, 1))
+    except (OSError, asyncio.TimeoutError):
+        return HostHealth(ip, port)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def check_hosts_async(targets: Dict[str, Iterable[int]], timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                            concurrency: int = DEFAULT_CONCURRENCY) -> Dict[str, HostHealth]:
+    """targets: {ip: 候选端口}；每个 IP 取所有端口里最好的结果"""
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(ip: str, port: int) -> HostHealth:
+        async with sem:
+            return await _check_port(ip, port, timeout)
+
+    jobs = [one(ip, port) for ip, ports in targets.items() for port in dict.fromkeys(ports)]
+    best: Dict[str, HostHealth] = {ip: HostHealth(ip) for ip in targets}
+    for health in await asyncio.gather(*jobs):
+        if health.rank_key() < best[health.ip].rank_key():
+            best[health.ip] = health
+    return best
+
+
+def check_hosts(targets: Dict[str, Iterable[int]], **kwargs) -> Dict[str, HostHealth]:
+    """同步入口：并发预检一批主机"""
+    return asyncio.run(check_hosts_async(targets, **kwargs))
+
+
+def known_ports(directory: str = DEFAULT_INPUT_DIR, common: bool = False) -> List[int]:
+    """现有播放列表里出现过的 udpxy 端口（按出现次数降序）；common=True 时再补上常见端口"""
+    counts: Dict[int, int] = {}
+    for path in iptv_playlist.playlist_files(directory):
+        for ch in iptv_playlist.iter_channels(path):
+            if ch.port:
+                counts[ch.port] = counts.get(ch.port, 0) + 1
+    ports = sorted(counts, key=lambda p: -counts[p])
+    return list(dict.fromkeys(ports + (list(COMMON_UDPXY_PORTS) if common else [])))
+
+
+# ===================== 本地假 udpxy（测试 / 基准用）=====================
+async def _fake_udpxy_handler(reader, writer, dead_groups=frozenset(), chunk=b"\x47" * 1316, interval=0.01,
+                              stats: Optional[Dict[str, int]] = None):
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+        path = head.split(b" ", 2)[1].decode("latin-1")
+        group = path.rsplit("/", 1)[-1].split(":", 1)[0]
+        if not path.startswith(("/rtp/", "/udp/")) or group in dead_groups:
+            writer.write(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+            return
+        if stats is not None:
+            stats["connections"] = stats.get("connections", 0) + 1
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/octet-stream\r\n\r\n")
+        while True:
+            writer.write(chunk)
+            await writer.drain()
+            if stats is not None:
+                stats["bytes"] = stats.get("bytes", 0) + len(chunk)
+            await asyncio.sleep(interval)
+    except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.CancelledError, IndexError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_fake_udpxy(host: str = "127.0.0.1", port: int = 0, dead_groups: Iterable[str] = (),
+                           interval: float = 0.01, stats: Optional[Dict[str, int]] = None):
+    """
+    启动假 udpxy：/rtp/<组播>:<端口> 持续输出 TS 包（每 interval 秒 1316 字节）；dead_groups 中的组播返回 404
+    stats 不为 None 时累计成功的上游连接数（connections）与输出字节数（bytes）
+    """
+    dead = frozenset(dead_groups)
+    return await asyncio.start_server(
+        lambda r, w: _fake_udpxy_handler(r, w, dead, interval=interval, stats=stats), host, port)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="并发探测 M3U 中的流地址，输出过滤后的播放列表")
+    parser.add_argument("files", nargs="*", help="要探测的 .m3u（默认 m3u/*.m3u）")
+    parser.add_argument("--out-dir", default=DEFAULT_OUTPUT_DIR, help="过滤后播放列表输出目录（空字符串=不输出）")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST)
+    parser.add_argument("--ttfb", type=float, default=DEFAULT_TTFB, help="连接+首字节期限（秒）")
+    parser.add_argument("--sample", type=float, default=DEFAULT_SAMPLE, help="码率采样时长（秒）")
+    parser.add_argument("--results", default=PROBE_RESULTS_PATH, help="探测结果 JSON 路径")
+    parser.add_argument("--fake-udpxy", type=int, metavar="PORT", help="只启动本地假 udpxy 服务")
+    args = parser.parse_args(argv)
+
+    if args.fake_udpxy is not None:
+        async def serve():
+            server = await start_fake_udpxy(port=args.fake_udpxy)
+            print(f"【假 udpxy】监听 127.0.0.1:{args.fake_udpxy}")
+            async with server:
+                await server.serve_forever()
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    files = args.files or iptv_playlist.playlist_files(DEFAULT_INPUT_DIR)
+    if not files:
+        print("❌ 没有可探测的播放列表")
+        return 2
+
+    results = probe_playlists(files, args.out_dir or None, concurrency=args.concurrency,
+                              per_host=args.per_host, ttfb=args.ttfb, sample=args.sample)
+    save_probe_results(results, args.results)
+    return 0 if any(r.ok for r in results.values()) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
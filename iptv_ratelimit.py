@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_ratelimit.py
+- 按站点（host）的令牌桶限速：进程内所有 Chrome 与 HTTP 会话共用同一个桶，并发再高，对站点的总速率也不超过上限
+- 配置：SITE_RPS（每秒请求数，默认 4，0=不限）、SITE_BURST（桶容量，默认 8）、
+  SITE_LIMITS="host=rps:burst,..." 按站点单独指定（如 SITE_LIMITS="iptv.cqshushu.com=2:4,127.0.0.1=0"）
+- 自动降速：收到 429 / 5xx 或疑似验证码页面时速率减半（不低于基准的 1/10），遵守 Retry-After；
+  之后每个正常请求按基准的 5% 慢慢恢复（加性增、乘性减）
+- 统计：每个站点的请求数、被限速次数与累计等待时间、降速次数、当前速率；等待时间同时计入当前地区的运行报告
+- 预约式实现：acquire 先扣令牌（可为负）再睡到轮到自己，锁内不睡眠；协程里可用 reserve() + asyncio.sleep
+"""
+
+import os
+import threading
+import time
+import urllib.parse
+from typing import Dict, List, Optional, Tuple
+
+import iptv_trace
+
+DEFAULT_SITE_RPS = 4.0
+DEFAULT_SITE_BURST = 8
+SLOWDOWN_FACTOR = 0.5      # 每次降速乘以该系数
+MIN_RATE_FACTOR = 0.1      # 降速下限：基准速率的 1/10
+RECOVER_STEP = 0.05        # 每个正常请求恢复基准速率的 5%
+MAX_RETRY_AFTER = 300      # Retry-After 最多遵守 5 分钟
+
+SLOWDOWN_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: int):
+        self.base_rate = max(0.0, rate)
+        self.rate = self.base_rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.throttled_sec = 0.0
+        self.slowdowns = 0
+
+    def reserve(self, n: int = 1) -> float:
+        """预约 n 个令牌，返回需要等待的秒数（调用方负责睡眠）"""
+        with self._lock:
+            now = time.monotonic()
+            self.requests += n
+            wait = max(0.0, self.paused_until - now)
+            if self.rate > 0:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                self.tokens -= n
+                if self.tokens < 0:
+                    wait = max(wait, -self.tokens / self.rate)
+            if wait > 0:
+                self.throttled += 1
+                self.throttled_sec += wait
+            return wait
+
+    def acquire(self, n: int = 1) -> float:
+        wait = self.reserve(n)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def slow_down(self, retry_after: Optional[float] = None):
+        with self._lock:
+            self.slowdowns += 1
+            if self.base_rate > 0:
+                self.rate = max(self.base_rate * MIN_RATE_FACTOR, self.rate * SLOWDOWN_FACTOR)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + min(retry_after, MAX_RETRY_AFTER))
+
+    def recover(self):
+        if self.rate >= self.base_rate:
+            return
+        with self._lock:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * RECOVER_STEP)
+
+    def reset_stats(self):
+        """统计清零（速率与令牌保留：降速状态跨轮次延续）"""
+        with self._lock:
+            self.requests = self.throttled = self.slowdowns = 0
+            self.throttled_sec = 0.0
+
+    def stats(self) -> Dict:
+        return {"requests": self.requests, "throttled": self.throttled,
+                "throttled_sec": round(self.throttled_sec, 3), "slowdowns": self.slowdowns,
+                "rate": round(self.rate, 3), "base_rate": self.base_rate, "burst": self.burst}
+
+
+def host_of(url_or_host: str) -> str:
+    if "://" not in url_or_host:
+        return url_or_host.lower()
+    return (urllib.parse.urlsplit(url_or_host).hostname or "").lower()
+
+
+def parse_limits(raw: str) -> Dict[str, Tuple[float, Optional[int]]]:
+    """"a.com=2:4,b.com=0" -> {"a.com": (2.0, 4), "b.com": (0.0, None)}；写错的项忽略"""
+    limits: Dict[str, Tuple[float, Optional[int]]] = {}
+    for part in raw.split(","):
+        host, _, spec = part.strip().partition("=")
+        if not host.strip():
+            continue
+        rps, _, burst = spec.partition(":")
+        try:
+            limits[host.strip().lower()] = (float(rps), int(burst) if burst.strip() else None)
+        except ValueError:
+            continue
+    return limits
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """只支持秒数形式（HTTP 日期形式按未提供处理）"""
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+class HostLimiter:
+    """按 host 分桶；未单独配置的站点用默认速率"""
+
+    def __init__(self, rps: float = DEFAULT_SITE_RPS, burst: int = DEFAULT_SITE_BURST,
+                 limits: Optional[Dict[str, Tuple[float, Optional[int]]]] = None):
+        self.rps = rps
+        self.burst = burst
+        self.limits = limits or {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url_or_host: str) -> TokenBucket:
+        host = host_of(url_or_host)
+        with self._lock:
+            b = self._buckets.get(host)
+            if b is None:
+                rps, burst = self.limits.get(host, (self.rps, None))
+                b = self._buckets[host] = TokenBucket(rps, burst or self.burst)
+            return b
+
+    def acquire(self, url: str, n: int = 1) -> float:
+        """阻塞到放行；等待时间计入当前地区的 throttled_sec"""
+        waited = self.bucket(url).acquire(n)
+        if waited > 0:
+            iptv_trace.count("throttled_sec", round(waited, 4))
+        return waited
+
+    def feedback(self, url: str, status: Optional[int] = None, captcha: bool = False,
+                 retry_after: Optional[float] = None) -> bool:
+        """请求结果反馈：需要降速时降速并返回 True，否则慢慢恢复速率"""
+        bucket = self.bucket(url)
+        if captcha or (status is not None and status in SLOWDOWN_STATUSES):
+            bucket.slow_down(retry_after)
+            iptv_trace.count("slowdowns")
+            reason = "疑似验证码页面" if captcha else f"HTTP {status}"
+            print(f"  🐢 {host_of(url)} {reason}，降速到 {bucket.rate:.2f} 次/秒"
+                  + (f"，暂停 {retry_after:.0f}s" if retry_after else ""))
+            return True
+        bucket.recover()
+        return False
+
+    def reset_stats(self):
+        with self._lock:
+            buckets = list(self._buckets.values())
+        for b in buckets:
+            b.reset_stats()
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {host: b.stats() for host, b in self._buckets.items()}
+
+    def report_lines(self) -> List[str]:
+        lines = []
+        for host, s in sorted(self.stats().items()):
+            limit = f"{s['base_rate']:g} 次/秒 × {s['burst']}" if s["base_rate"] > 0 else "不限"
+            lines.append(f"【限速】{host}（{limit}）：请求 {s['requests']}，等待 {s['throttled']} 次共 {s['throttled_sec']:.1f}s，"
+                         f"降速 {s['slowdowns']} 次，当前 {s['rate']:.2f} 次/秒")
+        return lines
+
+
+def limiter_from_env() -> HostLimiter:
+    raw_rps = (os.getenv("SITE_RPS") or "").strip()
+    raw_burst = (os.getenv("SITE_BURST") or "").strip()
+    try:
+        rps = float(raw_rps) if raw_rps else DEFAULT_SITE_RPS
+    except ValueError:
+        rps = DEFAULT_SITE_RPS
+    burst = int(raw_burst) if raw_burst.isdigit() else DEFAULT_SITE_BURST
+    return HostLimiter(rps, burst, parse_limits(os.getenv("SITE_LIMITS") or ""))
+
+
+_LIMITER: Optional[HostLimiter] = None
+_LIMITER_LOCK = threading.Lock()
+
+
+def get_limiter() -> HostLimiter:
+    """进程内共用的限速器（首次调用时按环境变量创建）"""
+    global _LIMITER
+    with _LIMITER_LOCK:
+        if _LIMITER is None:
+            _LIMITER = limiter_from_env()
+        return _LIMITER
+
+
+def reset_limiter():
+    """丢弃现有限速器（统计清零，下次 get_limiter 按当前环境变量重建）"""
+    global _LIMITER
+    with _LIMITER_LOCK:
+        _LIMITER = None
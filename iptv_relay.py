@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_relay.py
+- udpxy 风格的本地中继：把播放列表里的 http://<来源IP>:<端口>/rtp/... 改写成指向本机的地址
+- 同一路流只开一条上游连接（家用 udpxy 盒子扛不住多路），数据写入环形缓冲后扇出给 N 个客户端
+- 客户端直接从环形缓冲取 memoryview 写 socket（不为每个客户端复制数据）
+- 每个客户端独立背压：写缓冲超过水位就等待；落后太多先跳到最新位置（丢旧数据，直播只要最新），
+  仍追不上（缓冲里的数据即将被覆盖）则断开该客户端，不影响其他人
+- 所有客户端离开后上游连接保留 LINGER_SEC 秒（换台回来不必重连）
+- 只中继已发布播放列表里出现过的上游 主机:端口（不是开放代理，不能借它访问局域网内其它地址）；
+  默认只监听 127.0.0.1，给局域网里的机顶盒用时显式 --host 0.0.0.0
+- 纯标准库 asyncio；--bench 对本地假 udpxy 做“直连 vs 中继”的对比测试
+
+地址：
+    /relay/<上游IP>:<端口>/rtp/<组播>:<端口>   流（与 udpxy 的路径一一对应）
+    /m3u/湖北.m3u、/iptv_latest.m3u           改写后的播放列表（地址指向本中继）
+
+用法：
+    python iptv_relay.py --port 8090
+    python iptv_relay.py --host 0.0.0.0 --port 8090      # 局域网内其它设备可访问
+    python iptv_relay.py --rewrite m3u/湖北.m3u --base http://192.168.1.2:8090 --out /tmp/湖北.m3u
+    python iptv_relay.py --bench 20 --seconds 5
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import sys
+import time
+import urllib.parse
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import iptv_playlist
+import iptv_probe
+
+REPO_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INPUT_DIR = os.path.join(REPO_PATH, "m3u")
+DEFAULT_LATEST_PATH = os.path.join(REPO_PATH, "iptv_latest.m3u")
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8090
+RELAY_PREFIX = "/relay/"
+
+DEFAULT_RING_BYTES = 4 * 1024 * 1024
+TS_PACKET = 188
+READ_CHUNK = 64 * 1024           # 上游单次读取 / 客户端单次写出的上限
+CLIENT_HIGH_WATER = 256 * 1024   # 客户端写缓冲水位（超过即等待 drain）
+PREBUFFER_BYTES = 188 * 700      # 新客户端从最新位置往前这么多字节开始（约 1 秒标清），播放器起播更快
+UPSTREAM_TIMEOUT = 5.0           # 上游连接 + 响应头期限（秒）
+LINGER_SEC = 5.0
+IDLE_CHECK_SEC = 1.0             # 上游没有数据时也按这个间隔检查空闲 / 停滞
+UPSTREAM_STALL_SEC = 15.0        # 上游连续这么久没有数据即关闭本路（客户端随之结束）
+ALLOWLIST_INTERVAL = 1.0         # 上游白名单最多每秒检查一次播放列表是否有更新
+USER_AGENT = "Mozilla/5.0 (iptv-relay)"
+
+# 中继路径只接受 udpxy 形式：rtp|udp/<组播IPv4>:<端口>（原样拼进上游请求行，不能带其它字符）
+_STREAM_PATH = re.compile(r"(?:rtp|udp)/\d{1,3}(?:\.\d{1,3}){3}:\d{1,5}")
+
+
+class RingBuffer:
+    """
+    定长环形缓冲；位置用“累计写入字节数”表示（单调递增），读者自己记位置
+    写入会覆盖最旧的数据，读者是否已落后由调用方根据 head 判断
+    """
+
+    def __init__(self, capacity: int = DEFAULT_RING_BYTES):
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self.head = 0
+
+    @property
+    def oldest(self) -> int:
+        return max(0, self.head - self.capacity)
+
+    def write(self, data: bytes):
+        n = len(data)
+        if n > self.capacity:
+            self.head += n - self.capacity
+            data = data[-self.capacity:]
+            n = self.capacity
+        start = self.head % self.capacity
+        first = min(n, self.capacity - start)
+        self._buf[start:start + first] = data[:first]
+        if first < n:
+            self._buf[:n - first] = data[first:]
+        self.head += n
+
+    def chunk(self, pos: int, max_bytes: int = READ_CHUNK) -> memoryview:
+        """从 pos 开始的一段连续数据（不跨越环尾、不复制）"""
+        start = pos % self.capacity
+        n = min(self.head - pos, max_bytes, self.capacity - start)
+        return self._view[start:start + n]
+
+
+class _Client:
+    __slots__ = ("writer", "pos", "skipped")
+
+    def __init__(self, writer: asyncio.StreamWriter, pos: int):
+        self.writer = writer
+        self.pos = pos
+        self.skipped = 0
+
+
+class StreamSession:
+    """一路上游流：一条上游连接 + 环形缓冲 + 若干客户端"""
+
+    def __init__(self, relay: "RelayServer", host: str, port: int, path: str):
+        self.relay = relay
+        self.host = host
+        self.port = port
+        self.path = path
+        self.key = f"{host}:{port}{path}"
+        self.ring = RingBuffer(relay.ring_bytes)
+        self.clients: Set[_Client] = set()
+        self.ready = asyncio.get_running_loop().create_future()   # 上游响应头就绪：True / 异常
+        self.closed = False
+        self.pending = 0   # 已请求、还在等上游响应头的客户端数（不算空闲）
+        self._upstream_writer: Optional[asyncio.StreamWriter] = None
+        self._wakeup = asyncio.get_running_loop().create_future()
+        self._idle_since: Optional[float] = None
+        self.task = asyncio.create_task(self._run())
+
+    def _notify(self):
+        waiter, self._wakeup = self._wakeup, asyncio.get_running_loop().create_future()
+        if not waiter.done():
+            waiter.set_result(None)
+
+    async def wait_data(self):
+        await asyncio.shield(self._wakeup)
+
+    async def _open_upstream(self) -> asyncio.StreamReader:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        self._upstream_writer = writer
+        writer.write(f"GET {self.path} HTTP/1.0\r\nHost: {self.host}:{self.port}\r\n"
+                     f"User-Agent: {USER_AGENT}\r\n\r\n".encode("latin-1"))
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        status = head.split(b" ", 2)[1] if head.count(b" ") >= 2 else b""
+        if status != b"200":
+            raise ConnectionError(f"上游返回 {status.decode('latin-1') or '?'}")
+        return reader
+
+    async def _run(self):
+        try:
+            reader = await asyncio.wait_for(self._open_upstream(), UPSTREAM_TIMEOUT)
+            self.relay.upstream_connections += 1
+            self.ready.set_result(True)
+            last_data = time.monotonic()
+            while True:
+                # 带超时读：上游停滞时也要能按时回收空闲会话，而不是一直卡在 read 上
+                try:
+                    data = await asyncio.wait_for(reader.read(READ_CHUNK), IDLE_CHECK_SEC)
+                except asyncio.TimeoutError:
+                    data = None
+                now = time.monotonic()
+                if data is not None:
+                    if not data:
+                        break
+                    last_data = now
+                    self.ring.write(data)
+                    self.relay.bytes_in += len(data)
+                    self._enforce_lag()
+                    self._notify()
+                elif now - last_data > UPSTREAM_STALL_SEC:
+                    break
+                if not self.clients and not self.pending:
+                    self._idle_since = self._idle_since or now
+                    if now - self._idle_since > self.relay.linger_sec:
+                        break
+                else:
+                    self._idle_since = None
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError) as e:
+            if not self.ready.done():
+                self.ready.set_exception(ConnectionError(str(e) or type(e).__name__))
+        finally:
+            self.closed = True
+            if not self.ready.done():
+                self.ready.set_exception(ConnectionError("上游已关闭"))
+            if self._upstream_writer is not None:
+                self._upstream_writer.close()
+            self.relay.sessions.pop(self.key, None)
+            self._notify()
+
+    def _enforce_lag(self):
+        """
+        写缓冲里还没发出去的数据引用着环形缓冲（memoryview）：客户端位置落后到快被覆盖时直接断开，
+        避免发出被覆盖的数据。正常落后由客户端自己跳到最新位置处理，这里只兜底。
+        """
+        limit = self.ring.capacity - CLIENT_HIGH_WATER - 2 * READ_CHUNK
+        for client in list(self.clients):
+            if self.ring.head - client.pos > limit:
+                self.clients.discard(client)
+                self.relay.dropped_clients += 1
+                client.writer.transport.abort()
+
+    def start_position(self) -> int:
+        pos = max(self.ring.oldest, self.ring.head - PREBUFFER_BYTES)
+        pos += (-pos) % TS_PACKET
+        return min(pos, self.ring.head)
+
+    async def serve_client(self, writer: asyncio.StreamWriter):
+        client = _Client(writer, self.start_position())
+        writer.transport.set_write_buffer_limits(high=CLIENT_HIGH_WATER)
+        self.clients.add(client)
+        self._idle_since = None
+        ring = self.ring
+        try:
+            while client in self.clients:
+                if client.pos >= ring.head:
+                    if self.closed:
+                        break
+                    await self.wait_data()
+                    continue
+                # 落后超过半个缓冲：跳到最新位置（按 TS 包对齐），直播宁可跳帧也不要越来越延迟
+                lag = ring.head - client.pos
+                if lag > ring.capacity // 2:
+                    skip = (lag - PREBUFFER_BYTES) // TS_PACKET * TS_PACKET
+                    client.pos += skip
+                    client.skipped += skip
+                view = ring.chunk(client.pos)
+                writer.write(view)
+                client.pos += len(view)
+                self.relay.bytes_out += len(view)
+                await writer.drain()
+        finally:
+            self.clients.discard(client)
+
+
+def relay_url(ch: iptv_playlist.Channel, base: str) -> Optional[str]:
+    """udpxy 地址 -> 中继地址；不是 udpxy 形式的地址返回 None（保持原样）"""
+    if ch.host is None:
+        return None
+    kind = "udp" if "/udp/" in ch.url.lower() else "rtp"
+    return f"{base.rstrip('/')}{RELAY_PREFIX}{ch.host}:{ch.port}/{kind}/{ch.mcast_group}:{ch.rtp_port}"
+
+
+def rewrite_playlist(source: str, base: str) -> str:
+    entries = iptv_playlist.iter_playlist(source)
+    parts = [next(entries).to_m3u()]
+    for ch in entries:
+        url = relay_url(ch, base)
+        if url:
+            ch.set_url(url)
+        parts.append(ch.to_m3u())
+    return "".join(parts)
+
+
+class RelayServer:
+
+    def __init__(self, input_dir: str = DEFAULT_INPUT_DIR, latest_path: str = DEFAULT_LATEST_PATH,
+                 ring_bytes: int = DEFAULT_RING_BYTES, linger_sec: float = LINGER_SEC,
+                 extra_upstreams: Iterable[Tuple[str, int]] = ()):
+        """extra_upstreams：播放列表之外额外允许的上游 (主机, 端口)（基准测试的本地假 udpxy）"""
+        self.input_dir = input_dir
+        self.latest_path = latest_path
+        self.ring_bytes = ring_bytes
+        self.linger_sec = linger_sec
+        self.sessions: Dict[str, StreamSession] = {}
+        self._playlists: Dict[Tuple[str, str], Tuple[float, bytes]] = {}
+        self.extra_upstreams = {(h.lower(), p) for h, p in extra_upstreams}
+        self._allowed: Tuple[Tuple, Set[Tuple[str, int]]] = ((), set())
+        self._allowed_checked = float("-inf")
+        self.rejected = 0
+        self.upstream_connections = 0
+        self.dropped_clients = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def session(self, host: str, port: int, path: str) -> StreamSession:
+        key = f"{host}:{port}{path}"
+        session = self.sessions.get(key)
+        if session is None or session.closed:
+            session = self.sessions[key] = StreamSession(self, host, port, path)
+        return session
+
+    def allowed_upstreams(self) -> Set[Tuple[str, int]]:
+        """已发布播放列表（省份目录 + 单次输出）里出现过的 udpxy (主机, 端口)；文件有变化时重建"""
+        now = time.monotonic()
+        if now - self._allowed_checked < ALLOWLIST_INTERVAL:
+            return self._allowed[1]
+        self._allowed_checked = now
+        signature = []
+        for path in iptv_playlist.playlist_files(self.input_dir) + [self.latest_path]:
+            try:
+                signature.append((path, os.stat(path).st_mtime))
+            except OSError:
+                continue
+        signature = tuple(signature)
+        if signature != self._allowed[0]:
+            allowed = set()
+            for path, _ in signature:
+                allowed.update((ch.host.lower(), ch.port) for ch in iptv_playlist.iter_channels(path) if ch.host)
+            self._allowed = (signature, allowed)
+        return self._allowed[1]
+
+    def upstream_allowed(self, host: str, port: int) -> bool:
+        key = (host.lower(), port)
+        return key in self.extra_upstreams or key in self.allowed_upstreams()
+
+    def playlist(self, name: str, base: str) -> Optional[bytes]:
+        if name == "iptv_latest.m3u":
+            path = self.latest_path
+        else:
+            name = os.path.basename(name)
+            if not name or name.startswith("."):
+                return None
+            path = os.path.join(self.input_dir, name if name.lower().endswith(".m3u") else name + ".m3u")
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        cached = self._playlists.get((path, base))
+        if cached is None or cached[0] != mtime:
+            cached = self._playlists[(path, base)] = (mtime, rewrite_playlist(path, base).encode("utf-8"))
+        return cached[1]
+
+    @staticmethod
+    def _reply(writer: asyncio.StreamWriter, status: str, body: bytes = b"", content_type: str = "text/plain"):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1") + body)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            lines = head.decode("latin-1").split("\r\n")
+            parts = lines[0].split(" ")
+            if len(parts) != 3 or parts[0] != "GET":
+                self._reply(writer, "400 Bad Request")
+                return
+            raw_path = urllib.parse.urlsplit(parts[1]).path.encode("latin-1").decode("utf-8", "replace")
+            target = urllib.parse.unquote(raw_path)
+            headers = {k.strip().lower(): v.strip() for k, _, v in (ln.partition(":") for ln in lines[1:]) if k}
+
+            if target.startswith(RELAY_PREFIX):
+                await self._stream(writer, target[len(RELAY_PREFIX):])
+            elif target.startswith("/m3u/") or target == "/iptv_latest.m3u":
+                base = f"http://{headers.get('host') or writer.get_extra_info('sockname')[0]}"
+                body = self.playlist(target.rsplit("/", 1)[-1], base)
+                if body is None:
+                    self._reply(writer, "404 Not Found")
+                else:
+                    self._reply(writer, "200 OK", body, "audio/x-mpegurl; charset=utf-8")
+            else:
+                self._reply(writer, "404 Not Found")
+            await writer.drain()
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def _stream(self, writer: asyncio.StreamWriter, rest: str):
+        # <上游IP>:<端口>/rtp/<组播>:<端口>
+        hostport, sep, path = rest.partition("/")
+        host, _, port = hostport.rpartition(":")
+        if not sep or not host or not port.isdigit() or not _STREAM_PATH.fullmatch(path):
+            self._reply(writer, "400 Bad Request")
+            return
+        if not self.upstream_allowed(host, int(port)):
+            self.rejected += 1
+            self._reply(writer, "403 Forbidden", b"upstream not in published playlists\n")
+            return
+        session = self.session(host, int(port), "/" + path)
+        session.pending += 1
+        try:
+            await asyncio.shield(session.ready)
+        except ConnectionError as e:
+            self._reply(writer, "502 Bad Gateway", f"{e}\n".encode("utf-8"))
+            return
+        finally:
+            session.pending -= 1
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: video/mp2t\r\nConnection: close\r\n\r\n")
+        await session.serve_client(writer)
+
+
+async def start_relay(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                      relay: Optional[RelayServer] = None) -> Tuple[RelayServer, asyncio.AbstractServer]:
+    relay = relay or RelayServer()
+    server = await asyncio.start_server(relay.handle, host, port)
+    return relay, server
+
+
+# ===================== 基准测试：直连 vs 中继 =====================
+async def _bench_client(host: str, port: int, path: str, seconds: float) -> int:
+    received = 0
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        return 0
+    writer.write(f"GET {path} HTTP/1.0\r\nHost: {host}\r\n\r\n".encode("latin-1"))
+    deadline = time.monotonic() + seconds
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                data = await asyncio.wait_for(reader.read(READ_CHUNK), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not data:
+                break
+            received += len(data)
+    except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        pass
+    finally:
+        writer.close()
+    return received
+
+
+async def run_bench(clients: int, seconds: float, interval: float = 0.001) -> Dict[str, Dict[str, float]]:
+    """N 个客户端看同一路流：分别直连假 udpxy 与经过中继，比较上游连接数和客户端收到的码率"""
+    report = {}
+    path = "/rtp/239.1.1.1:5000"
+    for mode in ("direct", "relay"):
+        stats: Dict[str, int] = {}
+        upstream = await iptv_probe.start_fake_udpxy(interval=interval, stats=stats)
+        up_port = upstream.sockets[0].getsockname()[1]
+        relay = server = None
+        if mode == "relay":
+            relay, server = await start_relay("127.0.0.1", 0, RelayServer(linger_sec=0,
+                                                                           extra_upstreams=[("127.0.0.1", up_port)]))
+            host, port, req = "127.0.0.1", server.sockets[0].getsockname()[1], f"{RELAY_PREFIX}127.0.0.1:{up_port}{path}"
+        else:
+            host, port, req = "127.0.0.1", up_port, path
+
+        cpu0 = time.process_time()
+        received = await asyncio.gather(*(_bench_client(host, port, req, seconds) for _ in range(clients)))
+        cpu = time.process_time() - cpu0
+
+        if server is not None:
+            server.close()
+            for session in list(relay.sessions.values()):
+                session.task.cancel()
+        upstream.close()
+        await asyncio.sleep(0.05)
+        report[mode] = {
+            "upstream_connections": stats.get("connections", 0),
+            "upstream_mbps": stats.get("bytes", 0) * 8 / seconds / 1e6,
+            "client_mbps_avg": sum(received) * 8 / seconds / 1e6 / max(1, clients),
+            "client_mbps_min": min(received) * 8 / seconds / 1e6 if received else 0.0,
+            "cpu_sec": cpu,
+            "dropped_clients": relay.dropped_clients if relay else 0,
+        }
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="udpxy 风格本地中继（单上游连接扇出给多个客户端）")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--dir", default=DEFAULT_INPUT_DIR, help="省份播放列表目录")
+    parser.add_argument("--ring-mb", type=float, default=DEFAULT_RING_BYTES / 1024 / 1024, help="每路流的环形缓冲大小（MB）")
+    parser.add_argument("--rewrite", metavar="M3U", help="只改写播放列表地址后输出，不启动服务")
+    parser.add_argument("--base", help="改写后的中继地址前缀，如 http://192.168.1.2:8090")
+    parser.add_argument("--out", help="改写结果输出路径（默认打印到标准输出）")
+    parser.add_argument("--bench", type=int, metavar="CLIENTS", help="对本地假 udpxy 做直连 vs 中继对比")
+    parser.add_argument("--seconds", type=float, default=5.0, help="基准测试时长（秒）")
+    args = parser.parse_args(argv)
+
+    if args.rewrite:
+        text = rewrite_playlist(args.rewrite, args.base or f"http://127.0.0.1:{args.port}")
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                f.write(text)
+        else:
+            sys.stdout.write(text)
+        return 0
+
+    if args.bench:
+        report = asyncio.run(run_bench(args.bench, args.seconds))
+        print(f"【中继基准】{args.bench} 个客户端同看一路流，{args.seconds:.0f}s")
+        for mode, r in report.items():
+            print(f"  {mode:6s} 上游连接 {r['upstream_connections']:3d}  上游 {r['upstream_mbps']:7.1f} Mbps  "
+                  f"客户端平均 {r['client_mbps_avg']:6.2f} Mbps（最低 {r['client_mbps_min']:.2f}）  "
+                  f"CPU {r['cpu_sec']:.2f}s  断开 {r['dropped_clients']}")
+        return 0
+
+    async def serve():
+        relay = RelayServer(input_dir=args.dir, ring_bytes=int(args.ring_mb * 1024 * 1024))
+        _, server = await start_relay(args.host, args.port, relay)
+        print(f"【中继】http://{args.host}:{args.port}/m3u/<省>.m3u（地址已改写为经过本中继）")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
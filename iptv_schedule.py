@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_schedule.py
+- 批量抓取的失败感知调度：按历史成功率给关键词排序、对总是失败的地区熔断、临时性失败延后重试
+- 熔断状态（连续失败次数、冷却轮数）存成仓库里的 state/schedule.json，随输出提交；
+  只在真正跑过该地区（成功恢复或试探失败）时才变，熔断期间被跳过的轮次不改动它，不会每轮都产生提交
+- 每轮都会变的统计（运行/成功次数、最近成功时间、熔断中已跳过的轮数、关键词成功率）单独存在 .cache/ 下，
+  不入库（CI 用 actions/cache 跨运行保留；丢了只会让关键词排序从头学起、熔断中的地区多等一个冷却期）
+- 熔断按“轮”计：连续失败达到阈值后跳过若干轮（每多失败一次翻倍，有上限），期满放行一次（半开），
+  成功即恢复，失败则继续熔断
+- 失败分两类：empty（站点正常应答但没有可用结果，换关键词即可）/ error（超时、异常，可能是临时的，
+  整个地区放到本批末尾带抖动退避重试，不在当场反复耗时）
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+FAILURE_EMPTY = "empty"
+FAILURE_ERROR = "error"
+
+REGION_OK = "ok"
+REGION_FAILED = "failed"
+REGION_RETRY = "retry"
+
+DEFAULT_BREAKER_THRESHOLD = 3
+DEFAULT_MAX_COOLDOWN_RUNS = 8
+
+# 写入 state/schedule.json 的熔断字段；其余字段都算统计，写到 stats_path
+_BREAKER_FIELDS = ("consecutive_failures", "cooldown")
+
+_local = threading.local()
+
+
+def mark_failure(kind: str):
+    """抓取函数失败返回前调用，说明失败类型（线程局部，由调度方读取）"""
+    _local.failure = kind
+
+
+def take_failure() -> str:
+    kind = getattr(_local, "failure", None) or FAILURE_ERROR
+    _local.failure = None
+    return kind
+
+
+def clear_failure():
+    _local.failure = None
+
+
+def _load_json(path: Optional[str]) -> Dict:
+    if not path:
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _write_json(path: str, data: Dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp, path)
+
+
+def backoff_delay(attempt: int, base_sec: float, cap_sec: float = 300) -> float:
+    """第 attempt 次重试前的等待：指数退避 × [0.5, 1.5) 随机抖动（避免所有 worker 同时回到站点）"""
+    return min(cap_sec, base_sec * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+
+class RetryScheduler:
+    """
+    数据结构：
+      path（入库）：      {"regions": {地区: {"consecutive_failures", "cooldown"}}}  只记非零字段
+      stats_path（本地）：{"regions": {地区: {"runs", "successes", "skipped", "last_success"}},
+                           "keywords": {地区: {关键词: {"attempts", "successes", "last_success"}}}}
+    stats_path 为 None 时全部写进 path。
+    """
+
+    def __init__(self, path: str, stats_path: Optional[str] = None,
+                 breaker_threshold: int = DEFAULT_BREAKER_THRESHOLD,
+                 max_cooldown_runs: int = DEFAULT_MAX_COOLDOWN_RUNS):
+        self.path = path
+        self.stats_path = stats_path
+        self.breaker_threshold = max(1, breaker_threshold)
+        self.max_cooldown_runs = max(1, max_cooldown_runs)
+        self._lock = threading.Lock()
+        state = _load_json(path)
+        stats = _load_json(stats_path)
+        self.regions: Dict[str, Dict] = {}
+        for source in (stats, state):
+            for region, r in (source.get("regions") or {}).items():
+                if isinstance(r, dict):
+                    self.regions.setdefault(region, {}).update(r)
+        # 旧版把关键词统计也写在 state/schedule.json 里，没有本地统计时沿用
+        self.keywords: Dict[str, Dict[str, Dict]] = stats.get("keywords") or state.get("keywords") or {}
+
+    # ---- 关键词排序 ----
+    def order_keywords(self, region: str, candidates: List[str]) -> List[str]:
+        """按平滑成功率 (成功+1)/(尝试+2) 降序，其次最近成功时间；没有历史的保持原顺序"""
+        stats = self.keywords.get(region, {})
+
+        def score(item):
+            index, kw = item
+            s = stats.get(kw) or {}
+            attempts = s.get("attempts", 0)
+            rate = (s.get("successes", 0) + 1) / (attempts + 2)
+            return (-rate, -(s.get("last_success") or 0), index)
+
+        return [kw for _, kw in sorted(enumerate(candidates), key=score)]
+
+    def record_attempt(self, region: str, keyword: str, ok: bool):
+        with self._lock:
+            s = self.keywords.setdefault(region, {}).setdefault(keyword, {"attempts": 0, "successes": 0})
+            s["attempts"] += 1
+            if ok:
+                s["successes"] += 1
+                s["last_success"] = int(time.time())
+
+    # ---- 熔断 ----
+    def allow(self, region: str) -> bool:
+        """本轮是否放行该地区；熔断中则计一次跳过（期满后放行一次试探）"""
+        with self._lock:
+            r = self.regions.get(region)
+            if not r or r.get("consecutive_failures", 0) < self.breaker_threshold:
+                return True
+            if r.get("skipped", 0) >= r.get("cooldown", 1):
+                return True
+            r["skipped"] = r.get("skipped", 0) + 1
+            return False
+
+    def breaker_info(self, region: str) -> str:
+        r = self.regions.get(region) or {}
+        return (f"连续失败 {r.get('consecutive_failures', 0)} 次，熔断 {r.get('cooldown', 1)} 轮，"
+                f"本轮为第 {r.get('skipped', 0)} 轮")
+
+    def finish_region(self, region: str, ok: bool):
+        with self._lock:
+            r = self.regions.setdefault(region, {"runs": 0, "successes": 0, "consecutive_failures": 0})
+            r["runs"] = r.get("runs", 0) + 1
+            r["skipped"] = 0
+            if ok:
+                r["successes"] = r.get("successes", 0) + 1
+                r["consecutive_failures"] = 0
+                r["cooldown"] = 0
+                r["last_success"] = int(time.time())
+                return
+            r["consecutive_failures"] = r.get("consecutive_failures", 0) + 1
+            over = r["consecutive_failures"] - self.breaker_threshold
+            if over >= 0:
+                r["cooldown"] = min(self.max_cooldown_runs, 2 ** over)
+
+    def save(self):
+        with self._lock:
+            if not self.stats_path:
+                _write_json(self.path, {"regions": self.regions, "keywords": self.keywords})
+                return
+            breakers = {}
+            counters = {}
+            for region, r in self.regions.items():
+                b = {k: v for k, v in r.items() if k in _BREAKER_FIELDS and v}
+                if b:
+                    breakers[region] = b
+                counters[region] = {k: v for k, v in r.items() if k not in _BREAKER_FIELDS}
+            _write_json(self.path, {"regions": breakers})
+            _write_json(self.stats_path, {"regions": counters, "keywords": self.keywords})
+
+    def open_regions(self) -> List[str]:
+        return sorted(k for k, r in self.regions.items() if r.get("consecutive_failures", 0) >= self.breaker_threshold)
+
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_serve.py
+- 本地播放列表 HTTP 服务（asyncio，纯标准库）：直接对外提供 m3u/*.m3u 和 iptv_latest.m3u
+- 查询参数过滤：省份、group-title、频道名、只要上次探测通过的流
+- 解析后的播放列表常驻内存；每个过滤结果缓存成“响应体 + gzip 体 + ETag”，源文件 mtime 变化即失效
+- 支持 gzip、ETag / If-None-Match（304）、HTTP/1.1 keep-alive：机顶盒每几分钟轮询一次几乎零开销
+
+地址：
+    /m3u/湖北.m3u                     单个省份文件
+    /iptv_latest.m3u                  单次模式输出
+    /playlist.m3u?province=湖北,湖南   多个省份拼接（不带 province 时为全部省份）
+    以上都可追加：group=电信&name=CCTV&alive=1（group / name 为不区分大小写的子串匹配，逗号分隔表示“任一”）
+
+用法：
+    python iptv_serve.py                    # 监听 0.0.0.0:8080
+    python iptv_serve.py --port 9000 --host 127.0.0.1
+"""
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import os
+import sys
+import time
+import urllib.parse
+from email.utils import formatdate
+from typing import Dict, List, Optional, Tuple
+
+import iptv_merge
+import iptv_playlist
+import iptv_probe
+
+REPO_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INPUT_DIR = os.path.join(REPO_PATH, "m3u")
+DEFAULT_LATEST_PATH = os.path.join(REPO_PATH, "iptv_latest.m3u")
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8080
+
+STAT_INTERVAL = 1.0          # 同一文件两次 stat 的最小间隔（秒）：高并发轮询时不必每个请求都碰磁盘
+MAX_CACHED_RESPONSES = 512   # 过滤结果缓存条目上限（超出时整体清空，组合数通常很少）
+MAX_HEADER_BYTES = 16 * 1024
+KEEPALIVE_TIMEOUT = 30
+GZIP_MIN_BYTES = 1024
+MAX_DISCARD_BODY = 64 * 1024  # GET / HEAD 带请求体时最多读掉这么多（更大或分块的直接关闭连接）
+M3U_CONTENT_TYPE = "audio/x-mpegurl; charset=utf-8"
+
+_REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+class _Parsed:
+    __slots__ = ("mtime", "header", "channels")
+
+    def __init__(self, mtime: float, header: iptv_playlist.PlaylistHeader, channels: List[iptv_playlist.Channel]):
+        self.mtime = mtime
+        self.header = header
+        self.channels = channels
+
+
+class _Response:
+    __slots__ = ("signature", "body", "gzipped", "etag", "count")
+
+    def __init__(self, signature: Tuple, body: bytes, count: int):
+        self.signature = signature
+        self.body = body
+        self.gzipped: Optional[bytes] = None
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        self.count = count
+
+    @property
+    def gzip_etag(self) -> str:
+        """gzip 版本与原文字节不同，强 ETag 也要不同"""
+        return self.etag[:-1] + '-gz"'
+
+    def gzip_body(self) -> bytes:
+        if self.gzipped is None:
+            self.gzipped = gzip.compress(self.body, compresslevel=6, mtime=0)
+        return self.gzipped
+
+
+class PlaylistStore:
+    """
+    解析缓存 + 过滤结果缓存
+    - 每个文件记住 mtime（最多每 STAT_INTERVAL 秒 stat 一次）
+    - 过滤结果的签名 = 所涉文件（及 alive=1 时探测结果文件）的 mtime；签名不同即重建
+    """
+
+    def __init__(self, input_dir: str = DEFAULT_INPUT_DIR, latest_path: str = DEFAULT_LATEST_PATH,
+                 results_path: str = iptv_probe.PROBE_RESULTS_PATH):
+        self.input_dir = input_dir
+        self.latest_path = latest_path
+        self.results_path = results_path
+        self._parsed: Dict[str, _Parsed] = {}
+        self._responses: Dict[Tuple, _Response] = {}
+        self._mtimes: Dict[str, Tuple[float, float]] = {}   # path -> (上次 stat 时间, mtime)
+        self._alive: Optional[Tuple[float, frozenset]] = None
+
+    def mtime(self, path: str) -> float:
+        now = time.monotonic()
+        cached = self._mtimes.get(path)
+        if cached and now - cached[0] < STAT_INTERVAL:
+            return cached[1]
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = -1.0
+        self._mtimes[path] = (now, mtime)
+        return mtime
+
+    def province_path(self, province: str) -> Optional[str]:
+        name = os.path.basename(province)
+        if not name or name.startswith("."):
+            return None
+        if not name.lower().endswith(".m3u"):
+            name += ".m3u"
+        return os.path.join(self.input_dir, name)
+
+    def all_provinces(self) -> List[str]:
+        """各省主文件（不含 <省>.rank<N>.m3u，否则同一批频道按排名数重复出现）"""
+        return [p for p in iptv_playlist.playlist_files(self.input_dir) if not iptv_merge.is_rank_file(p)]
+
+    def parsed(self, path: str) -> Optional[_Parsed]:
+        mtime = self.mtime(path)
+        if mtime < 0:
+            self._parsed.pop(path, None)
+            return None
+        entry = self._parsed.get(path)
+        if entry is None or entry.mtime != mtime:
+            entries = iptv_playlist.iter_playlist(path)
+            header = next(entries)
+            entry = self._parsed[path] = _Parsed(mtime, header, list(entries))
+        return entry
+
+    def alive_urls(self) -> frozenset:
+        mtime = self.mtime(self.results_path)
+        if self._alive is None or self._alive[0] != mtime:
+            results = iptv_probe.load_probe_results(self.results_path)
+            self._alive = (mtime, frozenset(url for url, r in results.items() if r.ok))
+        return self._alive[1]
+
+    def response(self, paths: List[str], groups: Tuple[str, ...], names: Tuple[str, ...],
+                 alive_only: bool) -> Optional[_Response]:
+        signature = tuple(self.mtime(p) for p in paths)
+        if alive_only:
+            signature += (self.mtime(self.results_path),)
+        key = (tuple(paths), groups, names, alive_only)
+        cached = self._responses.get(key)
+        if cached is not None and cached.signature == signature:
+            return cached
+
+        parsed = [p for p in (self.parsed(path) for path in paths) if p is not None]
+        if not parsed:
+            return None
+        alive = self.alive_urls() if alive_only else None
+
+        def keep(ch: iptv_playlist.Channel) -> bool:
+            if alive is not None and ch.url not in alive and iptv_probe.is_probeable(ch.url):
+                return False
+            if groups and not any(g in (ch.group_title or "").lower() for g in groups):
+                return False
+            if names and not any(n in ch.name.lower() for n in names):
+                return False
+            return True
+
+        # 多文件拼接时用第一个文件头（x-tvg-url 等），不带各省盖章
+        header = parsed[0].header if len(parsed) == 1 else iptv_playlist.PlaylistHeader(parsed[0].header.extm3u)
+        parts = [header.to_m3u()]
+        count = 0
+        for entry in parsed:
+            for ch in entry.channels:
+                if keep(ch):
+                    parts.append(ch.to_m3u())
+                    count += 1
+
+        if len(self._responses) >= MAX_CACHED_RESPONSES:
+            self._responses.clear()
+        response = self._responses[key] = _Response(signature, "".join(parts).encode("utf-8"), count)
+        return response
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match：逗号分隔的实体标签列表或 *，按弱比较（忽略 W/ 前缀）逐个整体比较"""
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def _split_param(query: Dict[str, List[str]], name: str) -> Tuple[str, ...]:
+    values = []
+    for raw in query.get(name, []):
+        values.extend(v.strip().lower() for v in raw.replace("，", ",").split(",") if v.strip())
+    return tuple(sorted(set(values)))
+
+
+class PlaylistServer:
+
+    def __init__(self, store: PlaylistStore):
+        self.store = store
+        self.requests = 0
+
+    def route(self, target: str) -> Tuple[int, Optional[_Response], str]:
+        """-> (状态码, 响应, 错误说明)"""
+        url = urllib.parse.urlsplit(target)
+        path = urllib.parse.unquote(url.path)
+        query = urllib.parse.parse_qs(url.query)
+        groups = _split_param(query, "group")
+        names = _split_param(query, "name")
+        alive_only = (query.get("alive") or ["0"])[-1] in ("1", "true", "True")
+
+        if path == "/iptv_latest.m3u":
+            paths = [self.store.latest_path]
+        elif path.startswith("/m3u/"):
+            one = self.store.province_path(path[len("/m3u/"):])
+            if one is None:
+                return 404, None, "not found"
+            paths = [one]
+        elif path in ("/playlist.m3u", "/"):
+            provinces = _split_param(query, "province")
+            if provinces:
+                paths = [p for p in (self.store.province_path(x) for x in provinces) if p]
+            else:
+                paths = self.store.all_provinces()
+        else:
+            return 404, None, "not found"
+
+        response = self.store.response(paths, groups, names, alive_only)
+        if response is None:
+            return 404, None, "playlist not found"
+        return 200, response, ""
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    writer.write(self._plain(400, "header too large", keep_alive=False))
+                    return
+                if len(head) > MAX_HEADER_BYTES:
+                    writer.write(self._plain(400, "header too large", keep_alive=False))
+                    return
+
+                lines = head.decode("latin-1").split("\r\n")
+                parts = lines[0].split(" ")
+                if len(parts) != 3:
+                    writer.write(self._plain(400, "bad request", keep_alive=False))
+                    return
+                method, target, version = parts
+                # 有的客户端直接发送未转义的 UTF-8 路径
+                target = target.encode("latin-1").decode("utf-8", "replace")
+                headers = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(":")
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                self.requests += 1
+
+                # 请求体必须读掉，否则 keep-alive 连接上剩下的字节会被当成下一个请求
+                length = headers.get("content-length", "0").strip()
+                if method not in ("GET", "HEAD") or "transfer-encoding" in headers or not length.isdigit() \
+                        or int(length) > MAX_DISCARD_BODY:
+                    keep_alive = False
+                elif int(length):
+                    try:
+                        await asyncio.wait_for(reader.readexactly(int(length)), KEEPALIVE_TIMEOUT)
+                    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                        return
+
+                if method not in ("GET", "HEAD"):
+                    writer.write(self._message(405, b"method not allowed\n", [("Allow", "GET, HEAD")], False,
+                                               "text/plain; charset=utf-8"))
+                else:
+                    writer.write(self._respond(method, target, headers, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    def _respond(self, method: str, target: str, headers: Dict[str, str], keep_alive: bool) -> bytes:
+        try:
+            status, response, error = self.route(target)
+        except Exception as e:
+            status, response, error = 400, None, str(e)
+        if response is None:
+            return self._plain(status, error, keep_alive)
+
+        use_gzip = len(response.body) >= GZIP_MIN_BYTES and "gzip" in headers.get("accept-encoding", "")
+        etag = response.gzip_etag if use_gzip else response.etag
+        extra = [("ETag", etag), ("Cache-Control", "no-cache"), ("Vary", "Accept-Encoding"),
+                 ("X-Channel-Count", str(response.count))]
+        if etag_matches(headers.get("if-none-match") or "", etag):
+            return self._message(304, b"", extra, keep_alive, content_type=None)
+
+        body = response.body
+        if use_gzip:
+            body = response.gzip_body()
+            extra.append(("Content-Encoding", "gzip"))
+        return self._message(200, body, extra, keep_alive, M3U_CONTENT_TYPE, head_only=method == "HEAD")
+
+    def _plain(self, status: int, text: str, keep_alive: bool) -> bytes:
+        return self._message(status, (text + "\n").encode("utf-8"), [], keep_alive, "text/plain; charset=utf-8")
+
+    @staticmethod
+    def _message(status: int, body: bytes, extra: List[Tuple[str, str]], keep_alive: bool,
+                 content_type: Optional[str], head_only: bool = False) -> bytes:
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", f"Date: {formatdate(usegmt=True)}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if content_type:
+            lines.append(f"Content-Type: {content_type}")
+        if status != 304:
+            lines.append(f"Content-Length: {len(body)}")
+        lines.extend(f"{k}: {v}" for k, v in extra)
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+        return head if head_only or status == 304 else head + body
+
+
+async def start_server(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                       store: Optional[PlaylistStore] = None) -> asyncio.AbstractServer:
+    server = PlaylistServer(store or PlaylistStore())
+    return await asyncio.start_server(server.handle, host, port)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="本地播放列表 HTTP 服务（过滤 + 缓存 + gzip + ETag）")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--dir", default=DEFAULT_INPUT_DIR, help="省份播放列表目录")
+    parser.add_argument("--results", default=iptv_probe.PROBE_RESULTS_PATH, help="探测结果 JSON（alive=1 使用）")
+    args = parser.parse_args(argv)
+
+    async def serve():
+        store = PlaylistStore(input_dir=args.dir, results_path=args.results)
+        server = await start_server(args.host, args.port, store)
+        print(f"【播放列表服务】http://{args.host}:{args.port}/playlist.m3u （/m3u/<省>.m3u，/iptv_latest.m3u）")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_site.py
+- iptv.cqshushu.com 页面解析（纯标准库，不依赖浏览器）
+- 搜索结果页：只在“Multicast IPTV”分区内提取“组播”行 -> IP / 状态 / 详情链接（酒店等其它分区不算）
+- 任意页面：按链接文字查找 href（查看频道列表 / M3U下载）
+- Selenium 与 HTTP 两种抓取方式共用这里的状态解析与排序规则
+"""
+
+import re
+import urllib.parse
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+
+IP_PATTERN = re.compile(r'(\d{1,3}(?:\.\d{1,3}){3})')
+IP_PORT_PATTERN = re.compile(r'(\d{1,3}(?:\.\d{1,3}){3}):(\d{2,5})')
+ALIVE_DAYS_PATTERN = re.compile(r'存活\s*(\d+)\s*天')
+
+# 作为“候选行”的元素（与 Selenium 版 .//tr | .//li | .//div 一致）
+ROW_TAGS = {"tr", "li", "div"}
+# 组播分区：最内层含该标题文字的元素，其最近的 div/section/main/body 祖先即分区（找不到时退回整页）
+SECTION_TITLE = "multicast iptv"
+SECTION_TAGS = {"div", "section", "main", "body"}
+# 不产生文字的标签（script/style 内容在浏览器里不可见）
+SKIP_TEXT_TAGS = {"script", "style", "noscript", "template"}
+# 自闭合标签（不入栈）
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text.replace("\u3000", " ")).strip()
+
+
+def parse_status(text: str) -> Tuple[bool, Tuple[int, int], str]:
+    """
+    解析行内状态 -> (是否有效, 排序键, 规范化状态)
+    排序键越小越新：新上线 < 存活1天 < 存活2天 ...；失效/未知排最后
+    """
+    t = text.replace("\u3000", " ").strip()
+    if "暂时失效" in t:
+        return (False, (99, 999999), "暂时失效")
+    if "新上线" in t:
+        return (True, (0, 0), "新上线")
+    m = ALIVE_DAYS_PATTERN.search(t)
+    if m:
+        days = int(m.group(1))
+        return (True, (1, days), f"存活{days}天")
+    return (False, (99, 999999), t)
+
+
+class _PageCollector(HTMLParser):
+    """
+    单遍扫描 HTML：
+      - rows：每个 tr/li/div 的完整文字（含子孙）及其内部链接 [(文字, href)]
+      - links：整页所有链接 [(文字, href)]
+      - section：组播分区内的行在 rows 中的范围 (起, 止)；没有该分区为 None
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows: List[Dict] = []
+        self.links: List[Tuple[str, str]] = []
+        self.section: Optional[Tuple[int, int]] = None
+        self._stack: List[Dict] = []   # 打开中的元素
+        self._skip_depth = 0
+        self._title_seen = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            return
+        if tag in SKIP_TEXT_TAGS:
+            self._skip_depth += 1
+        node = {"tag": tag, "parts": [], "links": []}
+        if tag == "a":
+            node["href"] = dict(attrs).get("href") or ""
+        elif tag in ROW_TAGS:
+            # 按开始标签登记，保证 rows 为文档顺序（与 find_elements 一致），闭合时再填内容
+            node["row"] = {"text": "", "links": node["links"]}
+            self.rows.append(node["row"])
+        if tag in SECTION_TAGS:
+            # 子孙行从这里开始（不含自身，与 .//tr | .//li | .//div 一致）
+            node["row_start"] = len(self.rows)
+        self._stack.append(node)
+
+    def handle_endtag(self, tag):
+        # 容错：不规范的 HTML 可能漏写闭合标签，向上找到同名元素一并关闭
+        if not any(n["tag"] == tag for n in self._stack):
+            return
+        while self._stack:
+            node = self._stack.pop()
+            self._close(node)
+            if node["tag"] == tag:
+                break
+
+    def handle_data(self, data):
+        if self._skip_depth or not data:
+            return
+        for node in self._stack:
+            node["parts"].append(data)
+
+    def close(self):
+        super().close()
+        while self._stack:
+            self._close(self._stack.pop())
+
+    def _close(self, node: Dict):
+        tag = node["tag"]
+        if tag in SKIP_TEXT_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+        if tag == "a":
+            link = (normalize_text("".join(node["parts"])), node["href"])
+            self.links.append(link)
+            for parent in self._stack:
+                parent["links"].append(link)
+        elif tag in ROW_TAGS:
+            node["row"]["text"] = normalize_text("".join(node["parts"]))
+        # 子元素先于父元素闭合：第一个闭合的含标题元素就是最内层的标题
+        if not self._title_seen and SECTION_TITLE in normalize_text("".join(node["parts"])).lower():
+            self._title_seen = True
+            container = next((n for n in reversed(self._stack) if n["tag"] in SECTION_TAGS), None)
+            if container is not None:
+                container["multicast"] = True
+        if node.get("multicast"):
+            self.section = (node["row_start"], len(self.rows))
+
+
+def parse_page(html: str) -> _PageCollector:
+    collector = _PageCollector()
+    collector.feed(html)
+    collector.close()
+    return collector
+
+
+def extract_multicast_rows(html: str) -> List[Dict]:
+    """搜索结果页 -> 组播分区（找不到分区时为整页）里含“组播”的候选行 [{"text", "links"}]"""
+    page = parse_page(html)
+    rows = page.rows[page.section[0]:page.section[1]] if page.section else page.rows
+    return [row for row in rows if "组播" in row["text"]]
+
+
+def select_multicast_items(rows: List[Dict]) -> List[Dict]:
+    """
+    候选行 -> 有效组播IP列表（已排序，1=最新）
+    每行：{"text": 行文字, "links": [(链接文字, href), ...]}
+    输出：{"ip", "href", "status", "sort_key", "port"}（port 仅当行内写了 IP:端口 时有值）
+    - 链接优先取文字恰好为 IP 的，其次取文字包含 IP 的
+    - 同一 IP 出现在多层嵌套行里时，状态取文字最短（最内层）的那一行，
+      避免外层 div 把相邻 IP 的“新上线”算到自己头上；同状态按文档中首次出现的顺序
+    """
+    best: Dict[str, Tuple[int, int, Dict]] = {}  # ip -> (首次出现序号, 行文字长度, item)
+
+    for order, row in enumerate(rows):
+        row_text = (row.get("text") or "").strip()
+        if not row_text or "组播" not in row_text:
+            continue
+
+        m_ip = IP_PATTERN.search(row_text)
+        if not m_ip:
+            continue
+        ip = m_ip.group(1)
+
+        prev = best.get(ip)
+        if prev is not None and prev[1] <= len(row_text):
+            continue
+
+        links = row.get("links") or []
+        href = next((h for t, h in links if t == ip), None)
+        if href is None:
+            href = next((h for t, h in links if ip in t), None)
+        if href is None:
+            continue
+
+        is_valid, sort_key, status_norm = parse_status(row_text)
+        m_port = IP_PORT_PATTERN.search(row_text)
+        port = int(m_port.group(2)) if m_port and m_port.group(1) == ip else None
+        item = {"ip": ip, "href": href, "status": status_norm, "sort_key": sort_key, "port": port,
+                "valid": is_valid}
+        best[ip] = (prev[0] if prev else order, len(row_text), item)
+
+    ranked = sorted(best.values(), key=lambda x: (x[2]["sort_key"], x[0]))
+    items = []
+    for _, _, item in ranked:
+        if item.pop("valid"):
+            items.append(item)
+    return items
+
+
+def find_link_href(html: str, text: str) -> Optional[str]:
+    """返回第一个文字包含 text 的链接 href（javascript:/# 视为无效）"""
+    for link_text, href in parse_page(html).links:
+        if text in link_text and is_navigable_href(href):
+            return href
+    return None
+
+
+def is_navigable_href(href: Optional[str]) -> bool:
+    if not href:
+        return False
+    h = href.strip().lower()
+    return not (h.startswith("javascript:") or h.startswith("#"))
+
+
+def absolute_url(base_url: str, href: str) -> str:
+    return urllib.parse.urljoin(base_url, href)
+
+
+CAPTCHA_MARKERS = ("验证码", "人机验证", "安全验证", "滑动验证", "访问过于频繁", "访问频繁", "请稍后再试",
+                   "captcha", "cf-challenge", "too many requests")
+
+
+def looks_like_captcha(html: str) -> bool:
+    """疑似验证码 / 频率限制页面（只看开头部分；正常页面不含这些字样）"""
+    head = html[:20000].lower()
+    return any(marker in head for marker in CAPTCHA_MARKERS)
+
+
+def looks_like_m3u(body: bytes) -> bool:
+    head = body[:4096].lstrip(b"\xef\xbb\xbf").lstrip()
+    return head.startswith(b"#EXTM3U") or b"#EXTINF" in head
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_state.py
+- 增量刷新用的每文件状态：上次来源IP、频道内容摘要、下载时间
+- 存成仓库里的一个 JSON（随 m3u 一起提交，CI 每次 checkout 都能拿到上次状态）
+- 线程安全：批量并发时多个 worker 共用一个 ProvinceState
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import iptv_playlist
+
+
+class ProvinceState:
+    """
+    key 为输出文件相对仓库的路径（如 m3u/湖北.m3u），值：
+      {"source_ip", "rank", "content_hash", "updated_at"}
+    """
+
+    def __init__(self, path: str, repo_path: str):
+        self.path = path
+        self.repo_path = repo_path
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+        except (OSError, ValueError):
+            self._data = {}
+
+    def key(self, output_path: str) -> str:
+        return os.path.relpath(output_path, self.repo_path).replace(os.sep, "/")
+
+    def get(self, output_path: str) -> Optional[Dict]:
+        """
+        读取状态；没有记录时用文件里的盖章（# source_ip=...）补齐，兼容启用增量之前生成的文件
+        """
+        with self._lock:
+            entry = self._data.get(self.key(output_path))
+        if entry:
+            return dict(entry)
+        if not os.path.exists(output_path):
+            return None
+        stamp = iptv_playlist.parse_stamp(iptv_playlist.read_header(output_path).stamp or "")
+        if not stamp.get("source_ip") or "," in stamp["source_ip"]:
+            return None
+        return {
+            "source_ip": stamp["source_ip"],
+            # 多排名合并文件的盖章形如 rank=1,2,3：取第一个
+            "rank": int((stamp.get("rank") or "0").split(",")[0]),
+            "content_hash": iptv_playlist.channels_digest(output_path),
+            "updated_at": stamp.get("updated_at", ""),
+        }
+
+    def record(self, output_path: str, source_ip: str, rank: int, content_hash: Optional[str] = None):
+        """来源、排名、内容都没变时不改写（保留原 updated_at，状态文件不产生 diff）"""
+        entry = {
+            "source_ip": source_ip,
+            "rank": rank,
+            "content_hash": content_hash or iptv_playlist.channels_digest(output_path),
+        }
+        key = self.key(output_path)
+        with self._lock:
+            prev = self._data.get(key)
+            if prev and all(prev.get(k) == v for k, v in entry.items()):
+                return
+            entry["updated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            self._data[key] = entry
+            self._save_locked()
+
+    def _save_locked(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        os.replace(tmp, self.path)
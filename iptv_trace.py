@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+iptv_trace.py
+- 轻量计时埋点：with span("步骤名"): ... 记录每一步耗时；count("bytes", n) 累计计数
+- 按“地区”归档（线程局部，批量并发时每个 worker 各记各的）
+- 运行结束输出报告：JSON（每地区每步耗时、重试、下载字节数、候选数）+ CSV（地区 × 步骤一行）
+- 可选导出 Chrome trace（chrome://tracing / Perfetto 可直接打开）
+- 开销：每个 span 两次 perf_counter + 一次列表追加（加锁），相对页面加载可忽略
+"""
+
+import csv
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+
+class Span:
+    __slots__ = ("name", "region", "start", "dur", "tid", "args")
+
+    def __init__(self, name: str, region: str, start: float, dur: float, tid: int, args: Optional[Dict]):
+        self.name = name
+        self.region = region
+        self.start = start
+        self.dur = dur
+        self.tid = tid
+        self.args = args
+
+
+class Tracer:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.perf_counter()
+            self.started_wall = time.time()
+            self.spans: List[Span] = []
+            self.counters: Dict[str, Dict[str, float]] = {}   # region -> {counter: value}
+            self.results: Dict[str, bool] = {}
+
+    # ---- 当前地区（线程局部）----
+    @property
+    def region(self) -> str:
+        return getattr(self._local, "region", "") or ""
+
+    @contextmanager
+    def region_scope(self, region: str) -> Iterator[None]:
+        prev = getattr(self._local, "region", "")
+        self._local.region = region
+        try:
+            yield
+        finally:
+            self._local.region = prev
+
+    # ---- 埋点 ----
+    @contextmanager
+    def span(self, name: str, **args) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            dur = time.perf_counter() - start
+            record = Span(name, self.region, start - self.started, dur, threading.get_ident(), args or None)
+            with self._lock:
+                self.spans.append(record)
+
+    def add_span(self, name: str, region: str, start: float, dur: float, **args):
+        """补记一个已经结束的 span（start 为 perf_counter 值）：用于协程里不能依赖线程局部地区的场合"""
+        record = Span(name, region, start - self.started, dur, threading.get_ident(), args or None)
+        with self._lock:
+            self.spans.append(record)
+
+    def count(self, name: str, value: float = 1, region: Optional[str] = None):
+        region = self.region if region is None else region
+        with self._lock:
+            bucket = self.counters.setdefault(region, {})
+            bucket[name] = bucket.get(name, 0) + value
+
+    def set_result(self, region: str, ok: bool):
+        with self._lock:
+            self.results[region] = ok
+
+    # ---- 汇总 / 输出 ----
+    def summary(self) -> Dict:
+        regions: Dict[str, Dict] = {}
+        with self._lock:
+            spans = list(self.spans)
+            counters = {k: dict(v) for k, v in self.counters.items()}
+            results = dict(self.results)
+
+        def entry(region: str) -> Dict:
+            return regions.setdefault(region, {"ok": results.get(region), "duration_sec": 0.0, "steps": {},
+                                               "counters": counters.get(region, {})})
+
+        for s in spans:
+            e = entry(s.region)
+            step = e["steps"].setdefault(s.name, {"calls": 0, "total_sec": 0.0, "max_sec": 0.0})
+            step["calls"] += 1
+            step["total_sec"] += s.dur
+            step["max_sec"] = max(step["max_sec"], s.dur)
+        for region in set(counters) | set(results):
+            entry(region)
+
+        for region, e in regions.items():
+            own = [s for s in spans if s.region == region]
+            if own:
+                e["duration_sec"] = max(s.start + s.dur for s in own) - min(s.start for s in own)
+            for step in e["steps"].values():
+                step["total_sec"] = round(step["total_sec"], 4)
+                step["max_sec"] = round(step["max_sec"], 4)
+            e["duration_sec"] = round(e["duration_sec"], 4)
+
+        steps: Dict[str, Dict] = {}
+        for s in spans:
+            step = steps.setdefault(s.name, {"calls": 0, "total_sec": 0.0})
+            step["calls"] += 1
+            step["total_sec"] += s.dur
+        return {
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_wall)),
+            "elapsed_sec": round(time.perf_counter() - self.started, 4),
+            "steps": {k: {"calls": v["calls"], "total_sec": round(v["total_sec"], 4)}
+                      for k, v in sorted(steps.items(), key=lambda kv: -kv[1]["total_sec"])},
+            "regions": regions,
+        }
+
+    def write_report(self, json_path: str, csv_path: Optional[str] = None, extra: Optional[Dict] = None) -> Dict:
+        """extra：并入 JSON 顶层的附加信息（如各站点的限速统计）"""
+        report = self.summary()
+        report.update(extra or {})
+        os.makedirs(os.path.dirname(json_path) or ".", exist_ok=True)
+        with open(json_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        os.replace(json_path + ".tmp", json_path)
+
+        if csv_path:
+            counter_names = sorted({k for e in report["regions"].values() for k in e["counters"]})
+            with open(csv_path + ".tmp", "w", encoding="utf-8-sig", newline="") as f:
+                w = csv.writer(f)
+                w.writerow(["region", "ok", "step", "calls", "total_sec", "max_sec"] + counter_names)
+                for region, e in report["regions"].items():
+                    counters = [e["counters"].get(k, "") for k in counter_names]
+                    for name, step in e["steps"].items() or [("", {})]:
+                        w.writerow([region, e["ok"], name, step.get("calls", ""), step.get("total_sec", ""),
+                                    step.get("max_sec", "")] + counters)
+            os.replace(csv_path + ".tmp", csv_path)
+        return report
+
+    def write_chrome_trace(self, path: str):
+        """Chrome trace 事件格式（ph=X 完整事件，微秒），按线程分行，地区写在 args 里"""
+        with self._lock:
+            spans = list(self.spans)
+        tids: Dict[int, int] = {}
+        events = []
+        for s in spans:
+            tid = tids.setdefault(s.tid, len(tids) + 1)
+            args = dict(s.args or {})
+            if s.region:
+                args["region"] = s.region
+            events.append({"name": s.name, "cat": s.region or "run", "ph": "X", "pid": 1, "tid": tid,
+                           "ts": round(s.start * 1e6), "dur": round(s.dur * 1e6), "args": args})
+        for ident, tid in tids.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": f"worker-{tid}"}})
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+    def report_lines(self, top: int = 8) -> List[str]:
+        """控制台摘要：耗时最多的几个步骤"""
+        report = self.summary()
+        lines = [f"【耗时统计】总计 {report['elapsed_sec']:.1f}s，按步骤累计："]
+        for name, step in list(report["steps"].items())[:top]:
+            lines.append(f"  {name:<16s} {step['total_sec']:8.2f}s  ×{step['calls']}")
+        return lines
+
+
+TRACER = Tracer()
+span = TRACER.span
+count = TRACER.count
+region_scope = TRACER.region_scope
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+# 仓库根目录下的 iptv_*.py 是平铺模块（没有打包），测试从根目录导入
+import os
+import sys
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_PATH not in sys.path:
+    sys.path.insert(0, REPO_PATH)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import iptv_cache
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(iptv_cache.time, "time", c)
+    return c
+
+
+def items(ip: str):
+    return [{"ip": ip, "href": f"/ip?id={ip}", "status": "新上线", "sort_key": (0, 0), "port": 4000,
+             "health": object()}]
+
+
+def test_hit_restores_sort_key_and_drops_unserializable_fields(tmp_path, clock):
+    cache = iptv_cache.SearchCache(str(tmp_path))
+    cache.put("湖北省", items("1.1.1.1"))
+    got = iptv_cache.SearchCache(str(tmp_path)).get("湖北省")
+    assert got == [{"ip": "1.1.1.1", "href": "/ip?id=1.1.1.1", "status": "新上线", "sort_key": (0, 0), "port": 4000}]
+    cache.put("空", [])
+    assert cache.get("空") is None
+
+
+def test_ttl_expiry(tmp_path, clock):
+    cache = iptv_cache.SearchCache(str(tmp_path), ttl_sec=60)
+    cache.put("湖北省", items("1.1.1.1"))
+    clock.now += 59
+    assert cache.get("湖北省") is not None
+    clock.now += 2
+    assert cache.get("湖北省") is None
+    assert os.listdir(str(tmp_path)) == [iptv_cache.INDEX_NAME]
+
+
+def test_lru_eviction_uses_access_time(tmp_path, clock):
+    cache = iptv_cache.SearchCache(str(tmp_path), max_entries=2)
+    cache.put("a", items("1.1.1.1"))
+    clock.now += 1
+    cache.put("b", items("2.2.2.2"))
+    clock.now += 1
+    assert cache.get("a") is not None   # a 最近用过，b 成为最久未用
+    clock.now += 1
+    cache.put("c", items("3.3.3.3"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_hits_flush_index_only_on_save(tmp_path, clock):
+    cache = iptv_cache.SearchCache(str(tmp_path))
+    cache.put("a", items("1.1.1.1"))
+    index_path = tmp_path / iptv_cache.INDEX_NAME
+    before = index_path.read_text(encoding="utf-8")
+    clock.now += 10
+    for _ in range(5):
+        assert cache.get("a") is not None
+    assert index_path.read_text(encoding="utf-8") == before
+
+    cache.save()
+    reloaded = iptv_cache.SearchCache(str(tmp_path))
+    assert reloaded._index["a"]["accessed"] == clock.now
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# 用基准测试的本地替身站点走一遍 HTTP 抓取：搜索 -> 详情页 -> 频道列表 -> M3U 下载 -> 发布
+import pytest
+
+import iptv_bench
+import iptv_playlist
+import iptv_ratelimit
+
+requests = pytest.importorskip("requests")
+import iptv_http_fetch  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def site():
+    s = iptv_bench.FixtureSite(rows=20, latency=0, jitter=0)
+    url = s.start()
+    yield s, url
+    s.stop()
+
+
+@pytest.fixture
+def fetcher(site):
+    f = iptv_http_fetch.HttpFetcher(site[1], limiter=iptv_ratelimit.HostLimiter(rps=0))
+    yield f
+    f.close()
+
+
+def test_search_returns_only_valid_multicast_rows_newest_first(site, fetcher):
+    fixture, _ = site
+    items = fetcher.search("湖北省")
+    expected = [c for c in fixture.candidates("湖北省") if c["status"] != "暂时失效"]
+    assert {i["ip"] for i in items} == {c["ip"] for c in expected}
+    # 酒店分区里写着“组播”的行不算候选
+    assert not any(i["ip"].startswith("10.0.0.") for i in items)
+    assert [i["sort_key"] for i in items] == sorted(i["sort_key"] for i in items)
+    assert all(i["port"] for i in items)
+
+
+def test_downloaded_playlist_is_published_byte_for_byte(site, fetcher, tmp_path):
+    fixture, _ = site
+    item = fetcher.search("湖北省")[0]
+    body = fetcher.fetch_m3u(item["href"])
+    assert body == fixture.playlists["湖北"]
+
+    out = tmp_path / "湖北.m3u"
+    iptv_playlist.publish_playlist(body, str(out))
+    assert out.read_bytes() == body
+
+    stamp = iptv_playlist.format_stamp(item["ip"], 1, "2026-02-01 00:00:00")
+    iptv_playlist.publish_playlist(body, str(tmp_path / "stamped.m3u"), stamp)
+    published = (tmp_path / "stamped.m3u").read_bytes()
+    assert iptv_playlist.read_header(str(tmp_path / "stamped.m3u")).stamp == stamp
+    without_stamp = [ln for ln in published.splitlines(True) if not ln.startswith(b"# source_ip=")]
+    assert b"".join(without_stamp) == b"".join(
+        ln for ln in body.splitlines(True) if not ln.startswith(b"# source_ip="))
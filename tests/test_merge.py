@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import iptv_merge
+import iptv_probe
+from iptv_playlist import Channel
+
+
+def url(host: str, group: str = "239.1.1.1") -> str:
+    return f"http://{host}:4000/rtp/{group}:5000"
+
+
+def test_keeps_best_alternatives_in_latency_order():
+    latencies = {"1.0.0.1": 80.0, "1.0.0.2": 20.0, "1.0.0.3": 50.0, "1.0.0.4": 10.0}
+    results = {url(h): iptv_probe.ProbeResult(url(h), ok=True, status=200, latency_ms=ms) for h, ms in latencies.items()}
+    results[url("1.0.0.5")] = iptv_probe.ProbeResult(url("1.0.0.5"), ok=False)
+    merger = iptv_merge.NationalMerger(alternatives=3, probe_results=results)
+    for host in ("1.0.0.1", "1.0.0.2", "1.0.0.5", "1.0.0.6", "1.0.0.3", "1.0.0.4"):
+        merger.add(Channel("湖北卫视", url(host)), "湖北")
+    merger.add(Channel("湖北卫视", url("1.0.0.4")), "湖北")   # 重复地址只算一次
+
+    out = list(merger.iter_output())
+    assert [ch.host for ch in out] == ["1.0.0.4", "1.0.0.2", "1.0.0.3"]
+    assert merger.dropped_dead == 1
+
+
+def test_unprobed_sources_rank_after_probed_and_keep_input_order():
+    results = {url("1.0.0.9"): iptv_probe.ProbeResult(url("1.0.0.9"), ok=True, status=200, latency_ms=500.0)}
+    merger = iptv_merge.NationalMerger(alternatives=3, probe_results=results)
+    merger.add(Channel("CCTV1", url("1.0.0.7")), "北京")
+    merger.add(Channel("CCTV1", "rtp://239.3.1.1:8000"), "北京")
+    merger.add(Channel("CCTV1", url("1.0.0.9")), "北京")
+    assert [ch.url for ch in merger.iter_output()] == [url("1.0.0.9"), url("1.0.0.7"), "rtp://239.3.1.1:8000"]
+
+
+def test_channel_key_unifies_cctv_variants_but_not_distinct_channels():
+    key = lambda name: iptv_merge.channel_key(Channel(name, ""))
+    assert key("CCTV1综合") == key("CCTV-1 高清") == key("ＣＣＴＶ１") == "CCTV1"
+    assert len({key("CCTV4K"), key("CCTV4"), key("CCTV5+"), key("CCTV5")}) == 4
+
+
+def test_groups_regional_channels_by_home_province():
+    merger = iptv_merge.NationalMerger(alternatives=2)
+    merger.add(Channel("北京新闻", url("2.0.0.1"), group_title="天津电信组播"), "天津")
+    merger.add(Channel("北京新闻", url("2.0.0.2"), group_title="北京联通组播"), "北京")
+    merger.add(Channel("CCTV1综合", url("2.0.0.3")), "湖北")
+    groups = {ch.name: ch.group_title for ch in merger.iter_output()}
+    assert groups == {"北京新闻": "北京", "CCTV1综合": iptv_merge.GROUP_CCTV}
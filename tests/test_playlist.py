@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import glob
+import os
+
+import pytest
+
+import iptv_playlist
+from conftest import REPO_PATH
+
+SAMPLE = "\n".join([
+    "#EXTM3U x-tvg-url=\"http://epg.example/e.xml\"",
+    "# source_ip=1.2.3.4 rank=1 updated_at=2026-01-16 00:47:20",
+    "# 文件头注释",
+    "#EXTINF:-1 tvg-id=CCTV1 tvg-name='x \"y\"' group-title=\"央视\",CCTV1, 综合",
+    "#EXTVLCOPT:network-caching=1000",
+    "http://27.18.31.67:8888/rtp/239.254.96.96:8550",
+    "# 条目之后的注释",
+    "#EXTINF:-1,没有地址的残缺条目",
+    "#EXTINF:-1 group-title=\"卫视\",湖北卫视",
+    "http://27.18.31.67:8888/udp/239.254.96.97:8550",
+    "",
+])
+
+
+def round_trip(text: str) -> str:
+    return "".join(entry.to_m3u() for entry in iptv_playlist.iter_playlist(text.splitlines()))
+
+
+def test_round_trip_keeps_names_attrs_and_loose_lines():
+    assert round_trip(SAMPLE) == SAMPLE
+    channels = list(iptv_playlist.iter_channels(SAMPLE.splitlines()))
+    assert [ch.name for ch in channels] == ["CCTV1, 综合", "湖北卫视"]
+    first = channels[0]
+    assert first.tvg_id == "CCTV1"
+    assert dict(first.extra_attrs)["tvg-name"] == 'x "y"'
+    assert (first.host, first.port, first.mcast_group, first.rtp_port) == ("27.18.31.67", 8888, "239.254.96.96", 8550)
+    assert first.trailing == ("# 条目之后的注释", "#EXTINF:-1,没有地址的残缺条目")
+
+
+@pytest.mark.parametrize("path", sorted(glob.glob(os.path.join(REPO_PATH, "m3u", "*.m3u"))),
+                         ids=os.path.basename)
+def test_round_trip_published_playlists(path):
+    with open(path, "r", encoding="utf-8-sig") as f:
+        text = f.read()
+    expected = "".join(line + "\n" for line in text.splitlines() if line.strip())
+    assert round_trip(text) == expected
+
+
+def test_publish_playlist_is_byte_identical_except_stamp(tmp_path):
+    raw = ("\ufeff" + SAMPLE).replace("\n", "\r\n").encode("utf-8")
+    out = tmp_path / "湖北.m3u"
+
+    result = iptv_playlist.publish_playlist(raw, str(out))
+    assert result.changed and result.count == 2
+    assert out.read_bytes() == raw
+
+    stamp = iptv_playlist.format_stamp("5.6.7.8", 2, "2026-02-01 00:00:00")
+    stamped_path = tmp_path / "stamped.m3u"
+    iptv_playlist.publish_playlist(raw, str(stamped_path), stamp)
+    stamped = stamped_path.read_bytes()
+    old_stamp = b"# source_ip=1.2.3.4 rank=1 updated_at=2026-01-16 00:47:20"
+    assert stamped == raw.replace(old_stamp, stamp.encode("utf-8"))
+
+
+def test_publish_playlist_leaves_unchanged_channels_alone(tmp_path):
+    out = tmp_path / "湖北.m3u"
+    raw = SAMPLE.encode("utf-8")
+    iptv_playlist.publish_playlist(raw, str(out))
+    before = out.read_bytes()
+
+    # 只换了盖章：频道摘要相同，不改动现有文件（不产生提交）
+    stamp = iptv_playlist.format_stamp("9.9.9.9", 1, "2026-03-01 00:00:00")
+    result = iptv_playlist.publish_playlist(raw, str(out), stamp)
+    assert not result.changed
+    assert out.read_bytes() == before
+    assert not os.path.exists(str(out) + ".tmp")
+
+    result = iptv_playlist.publish_playlist(raw.replace(b"239.254.96.97", b"239.254.96.98"), str(out), stamp)
+    assert result.changed
+    assert result.digest == iptv_playlist.channels_digest(str(out))
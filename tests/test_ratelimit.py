@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import iptv_ratelimit
+
+
+class Clock:
+    def __init__(self, now: float = 100.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(iptv_ratelimit.time, "monotonic", c)
+    return c
+
+
+def test_burst_then_refill_at_rate(clock):
+    bucket = iptv_ratelimit.TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0 and bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1)
+    # 预约过的令牌算作已用：0.1s 后只补回一个，刚好还清
+    clock.now += 0.1
+    assert bucket.reserve() == pytest.approx(0.1)
+    # 空闲足够久最多补满 burst
+    clock.now += 10
+    assert [bucket.reserve() for _ in range(3)] == pytest.approx([0, 0, 0.1])
+    assert bucket.stats()["throttled"] == 3
+
+
+def test_slow_down_and_recover(clock):
+    bucket = iptv_ratelimit.TokenBucket(rate=10, burst=1)
+    bucket.slow_down(retry_after=5)
+    assert bucket.rate == pytest.approx(10 * iptv_ratelimit.SLOWDOWN_FACTOR)
+    assert bucket.reserve() == pytest.approx(5)
+    for _ in range(100):
+        bucket.recover()
+    assert bucket.rate == bucket.base_rate
+
+
+def test_limiter_is_per_host(clock):
+    limiter = iptv_ratelimit.HostLimiter(rps=1, burst=1)
+    limiter.bucket("http://a.example/x").reserve()
+    assert limiter.bucket("http://b.example/").reserve() == 0
+    assert limiter.bucket("http://a.example/z").reserve() == pytest.approx(1)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import json
+
+import iptv_schedule
+
+
+def make(tmp_path, threshold=3):
+    return iptv_schedule.RetryScheduler(str(tmp_path / "schedule.json"), str(tmp_path / "stats.json"),
+                                        breaker_threshold=threshold)
+
+
+def run_once(tmp_path, region: str, ok: bool) -> bool:
+    """模拟一次批量运行（每轮新建调度器，与 CI 每次读写文件一致），返回本轮是否放行"""
+    s = make(tmp_path)
+    allowed = s.allow(region)
+    if allowed:
+        s.finish_region(region, ok)
+    s.save()
+    return allowed
+
+
+def test_breaker_opens_backs_off_and_recovers(tmp_path):
+    # 连续失败 3 次前一直放行
+    assert [run_once(tmp_path, "青海", False) for _ in range(3)] == [True, True, True]
+    # 熔断：跳过 1 轮，期满放行一次试探
+    assert run_once(tmp_path, "青海", False) is False
+    assert run_once(tmp_path, "青海", False) is True
+    # 试探失败：冷却翻倍为 2 轮；期满再试探仍失败则为 4 轮
+    assert [run_once(tmp_path, "青海", False) for _ in range(3)] == [False, False, True]
+    assert make(tmp_path).open_regions() == ["青海"]
+    # 冷却期内即使站点已恢复也不放行；期满试探成功即恢复
+    assert [run_once(tmp_path, "青海", True) for _ in range(5)] == [False] * 4 + [True]
+    assert make(tmp_path).open_regions() == []
+    assert run_once(tmp_path, "青海", True) is True
+
+
+def test_cooldown_is_capped(tmp_path):
+    s = make(tmp_path)
+    for _ in range(20):
+        s.finish_region("西藏", False)
+    assert s.regions["西藏"]["cooldown"] == iptv_schedule.DEFAULT_MAX_COOLDOWN_RUNS
+
+
+def test_committed_file_only_changes_when_region_runs(tmp_path):
+    path = tmp_path / "schedule.json"
+    snapshots = []
+    ran = []
+    for _ in range(12):
+        ran.append(run_once(tmp_path, "青海", False))
+        snapshots.append(path.read_text(encoding="utf-8"))
+    for i in range(1, len(snapshots)):
+        if not ran[i]:
+            assert snapshots[i] == snapshots[i - 1]
+    committed = json.loads(snapshots[-1])
+    assert set(committed["regions"]["青海"]) <= {"consecutive_failures", "cooldown"}
+
+    # 全部正常的地区不写进入库文件
+    run_once(tmp_path, "湖北", True)
+    assert "湖北" not in json.loads(path.read_text(encoding="utf-8"))["regions"]
+
+
+def test_keyword_order_follows_success_rate(tmp_path):
+    s = make(tmp_path)
+    for _ in range(3):
+        s.record_attempt("湖北", "湖北省", False)
+    s.record_attempt("湖北", "湖北", True)
+    s.save()
+    assert make(tmp_path).order_keywords("湖北", ["湖北省", "湖北", "武汉"]) == ["湖北", "武汉", "湖北省"]